@@ -0,0 +1,84 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Micro-benchmark for serializing large test expectations.
+
+Compares `expectation_json.dumps` (used by `recipes.py test`) with the json
+module on a synthetic expectation with many steps. "json.dumps+copy" is how
+expectations used to be serialized (converting them to plain JSON types first).
+
+    ./misc/bench_expectation_json.py [--steps N] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+from collections.abc import Iterable, Mapping
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from recipe_engine.internal.commands.test import expectation_json
+
+
+def _make_expectation(steps):
+  ret = []
+  for i in range(steps):
+    ret.append({
+      'cmd': ['python3', '-u', 'RECIPE_MODULE[foo]/resources/script.py',
+              '--step', str(i), '--output-json', '/path/to/tmp/json'],
+      'env': {'PATH': '<PATH>:/some/bin', 'STEP_INDEX': str(i)},
+      'infra_step': bool(i % 2),
+      'name': 'parent.step %d' % i,
+      'timeout': 3600,
+      '~followup_annotations': [
+        '@@@STEP_NEST_LEVEL@1@@@',
+        '@@@STEP_LOG_LINE@json.output@{@@@',
+        '@@@STEP_LOG_LINE@json.output@  "value": %d@@@' % i,
+        '@@@STEP_LOG_LINE@json.output@}@@@',
+        '@@@STEP_LOG_END@json.output@@@',
+      ],
+    })
+  ret.append({'name': '$result', 'status': 'SUCCESS'})
+  return ret
+
+
+def _plain_copy(obj):
+  if isinstance(obj, (str, bytes)):
+    return obj.decode('utf-8', 'replace') if isinstance(obj, bytes) else obj
+  if isinstance(obj, Mapping):
+    return {_plain_copy(k): _plain_copy(v) for k, v in obj.items()}
+  if isinstance(obj, Iterable):
+    return [_plain_copy(i) for i in obj]
+  return obj
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--steps', type=int, default=5000)
+  parser.add_argument('--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  expectation = _make_expectation(args.steps)
+  assert expectation_json.dumps(expectation) == json.dumps(
+      expectation, sort_keys=True, indent=2, separators=(',', ': '))
+
+  for name, func in [
+      ('json.dumps+copy', lambda: json.dumps(
+          _plain_copy(expectation), sort_keys=True, indent=2,
+          separators=(',', ': '))),
+      ('json.dumps', lambda: json.dumps(
+          expectation, sort_keys=True, indent=2, separators=(',', ': '))),
+      ('expectation_json.dumps', lambda: expectation_json.dumps(expectation)),
+  ]:
+    best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+    print('%-24s %8.1fms' % (name, best * 1000))
+
+
+if __name__ == '__main__':
+  main()
@@ -464,9 +464,24 @@ class StepPresentation(object):
     assert isinstance(val, dict)
     self._properties = val
 
-  def finalize(self, step_stream):
+  def finalize(self, step_stream, warning_client=None):
+    """Writes this presentation to `step_stream`.
+
+    If `warning_client` is given, issues warnings for the output properties
+    and summary which are big enough for the LUCI stream engine to move them
+    into logs.
+    """
     self._finalized = True
 
+    if warning_client:
+      # late import to avoid import cycle
+      from .internal.stream import (
+          DEFAULT_MAX_PROPERTY_BYTES, DEFAULT_MAX_SUMMARY_BYTES)
+      summary_text = (self.step_summary_text or '') + (self.step_text or '')
+      if len(summary_text.encode('utf-8')) > DEFAULT_MAX_SUMMARY_BYTES:
+        warning_client.record_execution_warning(
+            'recipe_engine/STEP_SUMMARY_TOO_LARGE')
+
     # crbug.com/833539: prune all logs from memory when finalizing.
     logs = self._logs
     self._logs = None
@@ -497,10 +512,18 @@ class StepPresentation(object):
       # TODO(iannucci) - This seems simultaneously beneficial (?) and woefully
       # insufficient.
       step_stream.add_step_link(text(label), text(url).replace(" ", "%20"))
+    property_too_large = False
     for key, value in sorted(iteritems(self._properties)):
       if isinstance(value, message.Message):
         value = json_pb.MessageToDict(value)
-      step_stream.set_build_property(key, json.dumps(value, sort_keys=True))
+      encoded = json.dumps(value, sort_keys=True)
+      # json.dumps escapes all non-ASCII characters, so len() is the byte size.
+      if (warning_client and not property_too_large and
+          len(encoded) > DEFAULT_MAX_PROPERTY_BYTES):
+        property_too_large = True
+        warning_client.record_execution_warning(
+            'recipe_engine/BUILD_PROPERTY_TOO_LARGE')
+      step_stream.set_build_property(key, encoded)
     for key, value in sorted(iteritems(self._tags)):
       step_stream.set_step_tag(key, value)
     step_stream.set_step_status(self.status, self.had_timeout)
@@ -13,7 +13,7 @@ import time
 
 from future.utils import iteritems, itervalues
 
-from ..fetch import GitBackend
+from ..fetch import GitBackend, git_cache_from_env
 
 from .commit_list import CommitList
 from .roll_candidate import RollCandidate
@@ -273,7 +273,7 @@ def _get_roll_candidates_impl(recipe_deps, commit_lists_by_repo):
       # abstraction leak, but adding this to RecipeDeps just for autoroller
       # seemed like a worse alternative.
       dep_path = os.path.join(recipe_deps.recipe_deps_path, repo)
-      backend = GitBackend(dep_path, dep.url)
+      backend = GitBackend(dep_path, dep.url, git_cache_from_env())
       backend.checkout(dep.branch, dep.revision)
 
     clist = CommitList.from_backend(dep, backend)
@@ -14,6 +14,7 @@ import logging
 import os
 import pkgutil
 import sys
+import time
 
 from builtins import zip
 from future.utils import iteritems, itervalues
@@ -26,7 +27,8 @@ else:
 
 # pylint: disable=wrong-import-position
 from .. import simple_cfg
-from ..recipe_deps import RecipeDeps
+from .. import startup_profile
+from ..recipe_deps import DEFAULT_FETCH_JOBS, RecipeDeps
 from ..recipe_module_importer import RecipeModuleImporter
 
 
@@ -113,6 +115,8 @@ def _cleanup_pyc(recipe_deps):
     * recipe_deps (RecipeDeps) - The loaded recipe dependencies.
   """
   for repo in itervalues(recipe_deps.repos):
+    if not repo.has_pyc:
+      continue
     for to_walk in (repo.recipes_dir, repo.modules_dir):
       for root, _dirs, files in OS_WALK(to_walk):
         for fname in files:
@@ -146,12 +150,17 @@ def _common_post_process(args):
     except Exception:
       logging.exception("unable to write pidfile")
 
-  args.recipe_deps = RecipeDeps.create(
-      args.main_repo_path,
-      {} if args.minimal_recipe_deps else args.repo_override,
-      args.proto_override,
-      minimal_protoc = args.minimal_recipe_deps,
-  )
+  if args.profile_startup:
+    startup_profile.enable(args.profile_startup)
+
+  with startup_profile.phase('RecipeDeps.create'):
+    args.recipe_deps = RecipeDeps.create(
+        args.main_repo_path,
+        {} if args.minimal_recipe_deps else args.repo_override,
+        args.proto_override,
+        minimal_protoc = args.minimal_recipe_deps,
+        fetch_jobs=args.fetch_jobs,
+    )
 
   _check_recipes_cfg_consistency(args.recipe_deps)
 
@@ -167,6 +176,8 @@ def _common_post_process(args):
   del args.verbose
   del args.repo_override
   del args.proto_override
+  del args.profile_startup
+  del args.fetch_jobs
 
 
 def _add_common_args(parser):
@@ -248,6 +259,18 @@ def _add_common_args(parser):
         'Absolute path to a file where the engine should write its pid. '
         'Path must be absolute and not exist.'))
 
+  parser.add_argument('--fetch-jobs', metavar='N', type=int,
+      default=DEFAULT_FETCH_JOBS,
+      help=(
+        'Check out at most N dependency repos concurrently '
+        '(default %(default)s).'))
+  parser.add_argument('--profile-startup', metavar='PATH',
+      type=os.path.abspath,
+      help=(
+        'Write a Chrome trace-event JSON file with the timings of the startup '
+        'phases of the engine (up to the first step of the recipe) to PATH, '
+        'and print a summary of them to stderr.'))
+
   def _proto_override_abspath(value):
     try:
       value = os.path.abspath(value)
@@ -281,6 +304,7 @@ def parse_and_run():
   Returns the command's return value (either int or None, suitable as input to
   `os._exit`).
   """
+  parse_start = time.time()
   parser = argparse.ArgumentParser(
       description='Interact with the recipe system.')
 
@@ -303,12 +327,19 @@ def parse_and_run():
     ))
 
   args = parser.parse_args()
+  startup_profile.record('parse args', parse_start)
   _common_post_process(args)
   args.postprocess_func(parser.error, args)
 
   try:
     return args.func(args)
   finally:
+    # Covers commands which never start a recipe step.
+    startup_profile.finish()
+
+    # Persist anything (e.g. DEPS) which was evaluated and added to the index.
+    args.recipe_deps.save_index()
+
     # Any file-like objects directly attached to args need to be closed
     # explicitly here because otherwise main.py will do an os._exit and any
     # buffered data in these files could be lost.
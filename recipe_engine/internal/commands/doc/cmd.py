@@ -37,6 +37,7 @@ from .... import util
 
 from ...recipe_deps import Recipe, RecipeModule, RecipeRepo
 from ...recipe_deps import parse_deps_spec
+from ...static_symbols import extract_jsonish_assignments, find_value_of
 
 from . import doc_markdown
 
@@ -92,34 +93,6 @@ def _unparse(node):
   return buf.getvalue()
 
 
-def _find_value_of(mod_ast, target):
-  """Looks for an assignment to `target`, returning the assignment value AST
-  node and the line number of the assignment.
-
-  Example:
-
-     some_var = 100
-     other = 20 + 10
-
-     _find_value_of(<code>, 'some_var')  ->  ast.Num(100)
-
-  Args:
-    * mod_ast (ast.Module) - The parsed Python module code.
-    * target (str) - The variable name to look for an assignment to.
-
-  Returns the Python AST object which is the right-hand-side of an assignment to
-  `target`.
-  """
-  assert isinstance(mod_ast, ast.Module), type(mod_ast)
-  for node in mod_ast.body:
-    if isinstance(node, ast.Assign):
-      if (len(node.targets) == 1 and
-          isinstance(node.targets[0], ast.Name) and
-          node.targets[0].id == target):
-        return node.value, node.lineno
-  return None, None
-
-
 def _expand_mock_imports(*mock_imports):
   """Returns an expanded set of mock imports.
 
@@ -363,7 +336,7 @@ def parse_deps(repo_name, mod_ast, relpath):
   assert isinstance(mod_ast, ast.Module), type(mod_ast)
   ret = None
 
-  DEPS, lineno = _find_value_of(mod_ast, 'DEPS')
+  DEPS, lineno = find_value_of(mod_ast, 'DEPS')
   if DEPS:
     ret = doc.Doc.Deps(
       relpath=relpath,
@@ -376,34 +349,6 @@ def parse_deps(repo_name, mod_ast, relpath):
   return ret
 
 
-def extract_jsonish_assignments(mod_ast):
-  """This extracts all single assignments where the target is a name, and the
-  value is a simple 'jsonish' statement (aka Python literal).
-
-  The result is returned as a dictionary of name to the decoded literal.
-
-  Example:
-    Foo = "hello"
-    Bar = [1, 2, "something"]
-    Other, Things = range(2)  # not single assignment
-    Bogus = object()  # not a Python literal
-    # returns: {"Foo": "hello", "Bar": [1, 2, "something"]}
-  """
-  ret = {}
-  for node in mod_ast.body:
-    if not isinstance(node, ast.Assign):
-      continue
-    if len(node.targets) != 1:
-      continue
-    if not isinstance(node.targets[0], ast.Name):
-      continue
-    try:
-      ret[node.targets[0].id] = ast.literal_eval(node.value)
-    except (KeyError, ValueError):
-      pass
-  return ret
-
-
 def parse_parameter(param):
   """Parses a recipe parameter into a Doc.Parameter.
 
@@ -439,7 +384,7 @@ def parse_parameters(mod_ast, relpath):
   Returns Doc.Parameters.
   """
   assert isinstance(mod_ast, ast.Module), type(mod_ast)
-  parameters, lineno = _find_value_of(mod_ast, 'PROPERTIES')
+  parameters, lineno = find_value_of(mod_ast, 'PROPERTIES')
   if not parameters:
     return None
 
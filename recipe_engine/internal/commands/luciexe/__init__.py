@@ -48,6 +48,35 @@ def add_arguments(parser):
         'If specified, output build.proto datagrams stream as JSONPB instead '
         'of PB. Only for debugging.'
       ))
+  parser.add_argument(
+      '--build-proto-min-send-interval', type=float, metavar='SECONDS',
+      help=(
+        'The minimum time between build.proto datagrams. Updates are '
+        'coalesced for at least this long, except that step status changes '
+        'are sent as soon as this much time passed since the last send. '
+        '(default: 1)'
+      ))
+  parser.add_argument(
+      '--build-proto-max-send-interval', type=float, metavar='SECONDS',
+      help=(
+        'The maximum time between build.proto datagrams. The interval grows '
+        'from the minimum with the size and serialization cost of the build '
+        'up to this. (default: 10)'
+      ))
+  parser.add_argument(
+      '--max-output-property-bytes', type=int, metavar='BYTES',
+      help=(
+        'Output property values bigger than this are written to a log of the '
+        'step which set them, and replaced by a reference to that log in the '
+        'build. Consumers of the build\'s output properties then see the '
+        'reference instead of the value. (default: no limit)'
+      ))
+  parser.add_argument(
+      '--max-step-summary-bytes', type=int, metavar='BYTES',
+      help=(
+        'Step summaries bigger than this are written to a "summary" log of '
+        'the step instead. (default: no limit)'
+      ))
 
   def _launch(args):
     from .cmd import main
@@ -57,7 +86,21 @@ def add_arguments(parser):
       LOG.fatal('"luciexe" protocol contract violation: %s', ex)
       return 1
 
-  def _post(_error, _args):
+  def _post(error, args):
+    # NOTE: late import to avoid early protobuf import
+    from ...stream.luci import (
+        DEFAULT_MIN_SEND_INTERVAL, DEFAULT_MAX_SEND_INTERVAL)
+    min_send_interval = args.build_proto_min_send_interval
+    if min_send_interval is None:
+      min_send_interval = DEFAULT_MIN_SEND_INTERVAL
+    max_send_interval = args.build_proto_max_send_interval
+    if max_send_interval is None:
+      max_send_interval = DEFAULT_MAX_SEND_INTERVAL
+    if not 0 <= min_send_interval <= max_send_interval:
+      error('expected 0 <= --build-proto-min-send-interval (%g) <= '
+            '--build-proto-max-send-interval (%g)' % (
+                min_send_interval, max_send_interval))
+
     logging.getLogger().setLevel(logging.INFO)
 
   parser.set_defaults(func=_launch, postprocess_func=_post)
@@ -19,7 +19,7 @@ from PB.go.chromium.org.luci.buildbucket.proto.build import Build
 from ....third_party import luci_context
 from ....util import fix_json_object
 
-from ...engine import RecipeEngine
+from ...engine import RecipeEngine, get_engine_properties
 from ...global_shutdown import install_signal_handlers
 from ...step_runner.subproc import SubprocessStepRunner
 from ...stream.invariants import StreamEngineInvariants
@@ -99,14 +99,25 @@ def _main_impl(args):
 
   _tweak_env()
 
-  luciexe_engine = LUCIStreamEngine(args.build_proto_stream_jsonpb)
+  engine_kwargs = {}
+  for kwarg, value in (
+      ('min_send_interval', args.build_proto_min_send_interval),
+      ('max_send_interval', args.build_proto_max_send_interval),
+      ('max_property_bytes', args.max_output_property_bytes),
+      ('max_summary_bytes', args.max_step_summary_bytes)):
+    if value is not None:
+      engine_kwargs[kwarg] = value
+  luciexe_engine = LUCIStreamEngine(
+      args.build_proto_stream_jsonpb, **engine_kwargs)
+  step_runner = SubprocessStepRunner(
+      get_engine_properties(properties).use_posix_spawn)
 
   raw_result = None
   with StreamEngineInvariants.wrap(luciexe_engine) as stream_engine:
     try:
       raw_result, _ = RecipeEngine.run_steps(
         args.recipe_deps, properties, stream_engine,
-        SubprocessStepRunner(), NULL_WARNING_RECORDER,
+        step_runner, NULL_WARNING_RECORDER,
         os.environ, os.getcwd(), luci_context.read_full(),
         psutil.cpu_count(), psutil.virtual_memory().total)
       stream_engine.write_result(raw_result)
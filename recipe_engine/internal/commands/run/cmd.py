@@ -21,7 +21,7 @@ from .... import util
 
 from ... import legacy
 
-from ...engine import RecipeEngine
+from ...engine import RecipeEngine, get_engine_properties
 from ...global_shutdown import install_signal_handlers
 from ...step_runner.subproc import SubprocessStepRunner
 from ...stream.annotator import AnnotatorStreamEngine
@@ -66,7 +66,8 @@ def _main_impl(args):
       args.recipe_deps,
       properties,
       StreamEngineInvariants.wrap(stream_engine),
-      SubprocessStepRunner(),
+      SubprocessStepRunner(
+          get_engine_properties(properties).use_posix_spawn),
       NULL_WARNING_RECORDER,
       os.environ,
       os.path.abspath(workdir),
@@ -13,12 +13,32 @@ from future.utils import itervalues
 import argparse
 import json
 import multiprocessing
+import sys
 import textwrap
 
 
 # Give this a high priority so it shows second in help.
 __cmd_priority__ = 1
 
+DAEMON_HELP = """Run tests on persistent ("warm") runner subprocesses, which
+are started on first use and reused by later invocations. Warm runners only
+reload recipe modules whose files changed since their last use. Not supported
+on Windows."""
+
+CACHE_HELP = """Run every test, ignoring cached results. By default, tests
+whose recipe, DEPS modules, test data and expectation file are unchanged since
+they last passed are not run again; their previous result is reported instead.
+When collecting coverage, this only applies to results which were recorded with
+their coverage. Results are still recorded in the cache."""
+
+INCREMENTAL_COVERAGE_HELP = """With --filter, still check the coverage of the
+whole repo. Tests excluded by the filter contribute the coverage cached from
+their last passing run; this fails if any of them changed since then."""
+
+FORK_SERVER_HELP = """Start all runner subprocesses by forking a single one which
+already imported the engine and all recipe modules. This reduces startup time
+and memory usage with many --jobs. Only supported on Linux."""
+
 TIMING_INFO_HELP = """Dumps test timing info to a file. Each line in the file
 has this structure: <test_name><tab><duration>. The duration is
 the wall clock time of running the test in fractional seconds (a value of 1.5
@@ -99,6 +119,22 @@ def add_arguments(parser):
       '--show-warnings',
       action='store_true', default=False, dest='show_warnings',
       help='Show detailed warnings even on test failures.')
+  run_p.add_argument(
+      '--no-cache', dest='use_cache', action='store_false', default=True,
+      help=CACHE_HELP)
+  run_p.add_argument(
+      '--incremental-coverage', action='store_true', default=False,
+      help=INCREMENTAL_COVERAGE_HELP)
+  run_p.add_argument(
+      '--daemon', action='store_true', default=False, help=DAEMON_HELP)
+  run_p.add_argument(
+      '--fork-server', dest='use_fork_server', action='store_true',
+      default=False, help=FORK_SERVER_HELP)
+  run_p.add_argument(
+      '--daemon-idle-timeout', metavar='SECONDS', type=float, default=30*60,
+      help=(
+        'With --daemon, the number of seconds newly started warm runners stay '
+        'alive without being used (default %(default)s).'))
 
   helpstr = 'Re-train recipe expectations.'
   train_p = subp.add_parser(
@@ -136,6 +172,22 @@ def add_arguments(parser):
       '--show-warnings',
       action='store_true', default=False, dest='show_warnings',
       help='Show detailed warnings even on test failures.')
+  train_p.add_argument(
+      '--no-cache', dest='use_cache', action='store_false', default=True,
+      help=CACHE_HELP)
+  train_p.add_argument(
+      '--incremental-coverage', action='store_true', default=False,
+      help=INCREMENTAL_COVERAGE_HELP)
+  train_p.add_argument(
+      '--daemon', action='store_true', default=False, help=DAEMON_HELP)
+  train_p.add_argument(
+      '--fork-server', dest='use_fork_server', action='store_true',
+      default=False, help=FORK_SERVER_HELP)
+  train_p.add_argument(
+      '--daemon-idle-timeout', metavar='SECONDS', type=float, default=30*60,
+      help=(
+        'With --daemon, the number of seconds newly started warm runners stay '
+        'alive without being used (default %(default)s).'))
 
   helpstr = 'Print all test names.'
   list_p = subp.add_parser(
@@ -153,6 +205,10 @@ def add_arguments(parser):
   runner_p.add_argument('--train', action='store_true', default=False)
   runner_p.add_argument('--cover-module-imports', action='store_true',
                         default=False)
+  runner_p.add_argument('--listen')
+  runner_p.add_argument('--idle-timeout', type=float)
+  runner_p.add_argument('--fork-server')
+  runner_p.add_argument('--fork-workers', type=int)
 
   def _launch(args):
     if args.subcommand == 'list':
@@ -162,13 +218,24 @@ def add_arguments(parser):
       from .runner import main
       try:
         return main(args.recipe_deps, args.cov_file, args.filtered_stacks,
-                    args.train, args.cover_module_imports)
+                    args.train, args.cover_module_imports, args.listen,
+                    args.idle_timeout, args.fork_server, args.fork_workers)
       except KeyboardInterrupt:
         return 0
 
     from .run_train import main
     return main(args)
-  parser.set_defaults(func=_launch)
+
+  def _postprocess_func(error, args):
+    if getattr(args, 'daemon', False) and sys.platform.startswith('win'):
+      error('--daemon is not supported on Windows')
+    if getattr(args, 'use_fork_server', False):
+      if not sys.platform.startswith('linux'):
+        error('--fork-server is only supported on Linux')
+      if args.daemon:
+        error('--fork-server and --daemon are mutually exclusive')
+
+  parser.set_defaults(func=_launch, postprocess_func=_postprocess_func)
 
 
 def run_list(recipe_deps, json_file):
@@ -0,0 +1,161 @@
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Line coverage collection for test runner subprocesses.
+
+A test only counts as coverage for the files matching its recipe's
+`coverage_patterns`. Rather than starting and stopping a new coverage
+measurement for every test, a runner starts one collector for its whole session
+and calls `switch` with the name and patterns of each test before running it.
+The collected lines are attributed to the test which was active when they ran,
+and filtered by its patterns in `stop`.
+
+On python 3.12+ this uses `sys.monitoring`, where every line only triggers
+a single event per test. Otherwise it uses a single coverage.py measurement with
+one dynamic context per test.
+"""
+
+import fnmatch
+import os
+import sys
+
+from future.utils import iteritems, itervalues
+
+import coverage
+
+
+def make_collector(include):
+  """Returns a new (not yet started) coverage collector.
+
+  Args:
+    * include (Iterable[str]) - fnmatch patterns (absolute paths) of all files
+      which any test could cover.
+  """
+  if hasattr(sys, 'monitoring'):
+    mon = sys.monitoring
+    if mon.get_tool(mon.COVERAGE_ID) is None:
+      return _SysMonitoringCollector(include)
+  return _CoveragePyCollector(include)
+
+
+class _PatternMatcher(object):
+  """Caches which files match which patterns."""
+
+  def __init__(self):
+    self._cache = {}
+
+  def match(self, filename, patterns):
+    """Returns True iff the (canonical) `filename` matches any of the
+    `patterns`."""
+    key = (filename, patterns)
+    ret = self._cache.get(key)
+    if ret is None:
+      # Match coverage.py, which resolves symlinks in measured file names (and
+      # `include` patterns).
+      ret = self._cache[key] = any(
+          fnmatch.fnmatch(filename, os.path.realpath(pattern))
+          for pattern in patterns)
+    return ret
+
+
+class _CoveragePyCollector(object):
+  def __init__(self, include):
+    self._cov = coverage.Coverage(
+        config_file=False, concurrency='gevent', data_file=None,
+        include=sorted(include))
+    # e.g. if all tests in this session came from the result cache.
+    self._cov.set_option('run:disable_warnings', ['no-data-collected'])
+    # test name -> coverage_patterns
+    self._patterns = {}
+
+  def start(self):
+    """Starts collecting coverage."""
+    self._cov.start()
+
+  def switch(self, name, patterns):
+    """Attributes all lines executed from now on to the test `name`, if they
+    match its `patterns` (frozenset of fnmatch patterns)."""
+    self._patterns[name] = patterns
+    self._cov.switch_context(name)
+
+  def stop(self):
+    """Stops collecting coverage.
+
+    Returns {test name: {filename: List[line number]}} of all lines which ran
+    while a test whose patterns match their file was active.
+    """
+    self._cov.stop()
+    data = self._cov.get_data()
+    matcher = _PatternMatcher()
+    ret = {}
+    for filename in data.measured_files():
+      for line, names in iteritems(data.contexts_by_lineno(filename)):
+        for name in names:
+          patterns = self._patterns.get(name)
+          if patterns and matcher.match(filename, patterns):
+            ret.setdefault(name, {}).setdefault(filename, []).append(line)
+    for files in itervalues(ret):
+      for lines in itervalues(files):
+        lines.sort()
+    return ret
+
+
+class _SysMonitoringCollector(object):
+  def __init__(self, include):
+    self._include = frozenset(include)
+    self._matcher = _PatternMatcher()
+    # co_filename -> canonical filename, or None if it's not included.
+    self._files = {}
+    # test name -> (coverage_patterns, {canonical filename: set(line number)})
+    self._tests = {}
+    # Lines executed before the first `switch` don't count.
+    self._current = {}
+
+  def _on_line(self, code, line_number):
+    try:
+      filename = self._files[code.co_filename]
+    except KeyError:
+      filename = os.path.realpath(code.co_filename)
+      if not self._matcher.match(filename, self._include):
+        filename = None
+      self._files[code.co_filename] = filename
+    if filename:
+      self._current.setdefault(filename, set()).add(line_number)
+    # Don't report this line again until the next `restart_events`.
+    return sys.monitoring.DISABLE
+
+  def start(self):
+    """Starts collecting coverage."""
+    mon = sys.monitoring
+    mon.use_tool_id(mon.COVERAGE_ID, 'recipe engine test coverage')
+    mon.register_callback(mon.COVERAGE_ID, mon.events.LINE, self._on_line)
+    mon.set_events(mon.COVERAGE_ID, mon.events.LINE)
+
+  def switch(self, name, patterns):
+    """Attributes all lines executed from now on to the test `name`, if they
+    match its `patterns` (frozenset of fnmatch patterns)."""
+    self._current = self._tests.setdefault(name, (patterns, {}))[1]
+    # Lines which already ran for other tests need to be seen again.
+    sys.monitoring.restart_events()
+
+  def stop(self):
+    """Stops collecting coverage.
+
+    Returns {test name: {filename: List[line number]}} of all lines which ran
+    while a test whose patterns match their file was active.
+    """
+    mon = sys.monitoring
+    mon.set_events(mon.COVERAGE_ID, 0)
+    mon.register_callback(mon.COVERAGE_ID, mon.events.LINE, None)
+    mon.free_tool_id(mon.COVERAGE_ID)
+
+    ret = {}
+    for name, (patterns, files) in iteritems(self._tests):
+      files = {
+        filename: sorted(lines) for filename, lines in iteritems(files)
+        if self._matcher.match(filename, patterns)
+      }
+      if files:
+        ret[name] = files
+    return ret
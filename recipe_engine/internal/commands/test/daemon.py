@@ -0,0 +1,409 @@
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Support for persistent ("warm") `recipes.py test _runner` subprocesses.
+
+Normally every `test run`/`test train` invocation launches `--jobs` fresh runner
+subprocesses, each of which has to import the engine, protobufs and all recipe
+modules before running its first test. With `--daemon`, the runners are instead
+started once as detached processes listening on a unix domain socket, and every
+subsequent invocation connects to them and feeds them `Description` messages
+over the socket (using the same framing as the regular stdin/stdout pipes).
+
+Runner pools are keyed by a hash of the repo and deps state (see `pool_dir`);
+any change to the set of repos, the recipe engine code or the compiled protos
+results in a brand new pool. Stale pools exit on their own once their idle
+timeout expires.
+
+Between sessions, a warm runner only reloads the recipe modules whose files have
+changed on disk (plus any loaded modules which depend on them); everything else
+(the engine, protobufs, gevent and unchanged recipe modules) stays imported.
+
+Each connection is one 'session':
+
+  * The client sends a `Session` message.
+  * The client sends any number of `Description` messages, and receives one
+    `Outcome` message for each.
+  * The client sends a zero-length message. The runner writes out any coverage
+    data, replies with a zero-length message and waits for the next connection.
+"""
+
+import errno
+import hashlib
+import importlib
+import linecache
+import logging
+import os
+import socket
+import stat
+import sys
+import tempfile
+import time
+
+from future.utils import iteritems, itervalues
+
+from gevent import socket as gsocket
+from gevent import subprocess
+import gevent
+
+from recipe_engine import __path__ as RECIPE_ENGINE_PATH
+
+# pylint: disable=import-error
+import PB
+from PB.recipe_engine.internal.test.runner import Session
+
+from ...recipe_deps import RecipeDeps
+from ...recipe_module_importer import RecipeModuleImporter
+from ...test.magic_check_fn import Check
+
+from .pipe import read_message, END_OF_SESSION
+
+
+LOG = logging.getLogger(__name__)
+
+# The maximum number of seconds to wait for a freshly spawned runner to start
+# listening on its socket.
+_SPAWN_TIMEOUT = 120
+
+
+def is_supported():
+  """Returns True iff `--daemon` mode is available on this platform."""
+  return hasattr(socket, 'AF_UNIX') and hasattr(os, 'getuid')
+
+
+class SocketFile(object):
+  """Minimal file-like wrapper around a connected socket, suitable for use with
+  `pipe.read_message` and `pipe.write_message`.
+
+  Unlike `socket.makefile`, writes always send the whole buffer.
+  """
+
+  def __init__(self, sock):
+    self._sock = sock
+
+  def read(self, size):
+    return self._sock.recv(size)
+
+  def write(self, data):
+    self._sock.sendall(data)
+
+  def close(self):
+    self._sock.close()
+
+
+def _stat_key(path):
+  st = os.stat(path)
+  return st.st_mtime_ns, st.st_size
+
+
+def _engine_files():
+  """Yields the path of every python file in the recipe engine."""
+  for base, _, fnames in os.walk(RECIPE_ENGINE_PATH[0]):
+    for fname in fnames:
+      if fname.endswith('.py'):
+        yield os.path.join(base, fname)
+
+
+def pool_dir(recipe_deps, filtered_stacks):
+  """Returns the directory holding the sockets of the runner pool for the
+  current repo and deps state.
+
+  The directory name is a hash of:
+    * The python interpreter.
+    * The name and path of every repo in `recipe_deps`.
+    * The checksum of the compiled protos.
+    * The mtime and size of every recipe engine python file.
+    * Whether or not the runners filter their stack traces.
+
+  Args:
+    * recipe_deps (RecipeDeps) - The loaded recipe dependencies.
+    * filtered_stacks (bool) - If the runners should filter stack traces.
+
+  Returns the absolute path to the (possibly not yet existing) directory.
+  """
+  csum = hashlib.sha256()
+  def _add(value):
+    csum.update(str(value).encode('utf-8'))
+    csum.update(b'\0')
+
+  _add(sys.executable)
+  _add(filtered_stacks)
+  for repo_name, repo in sorted(iteritems(recipe_deps.repos)):
+    _add(repo_name)
+    _add(repo.path)
+
+  proto_package = os.path.dirname(PB.__path__[0])
+  _add(proto_package)
+  try:
+    with open(os.path.join(proto_package, 'PB', 'csum'), 'rb') as csum_f:
+      csum.update(csum_f.read())
+  except IOError:
+    pass
+
+  for path in sorted(_engine_files()):
+    _add(path)
+    _add(_stat_key(path))
+
+  # Unix socket paths are limited to ~100 characters, so this can't live in
+  # the (arbitrarily deep) .recipe_deps folder. Prefer the per-user runtime
+  # directory over the shared temp directory.
+  return os.path.join(
+      os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(),
+      'recipes-test-daemon-%d' % os.getuid(), csum.hexdigest()[:16])
+
+
+def _ensure_private_dir(path):
+  """Creates the directory `path` (only accessible by the current user), if
+  it doesn't exist yet.
+
+  Since the pool directories have predictable names, other users could create
+  them first to plant sockets (i.e. fake runners) or symlinks in them.
+
+  Raises ValueError if `path` isn't a directory owned by the current user,
+  or if anybody else can write to it.
+  """
+  try:
+    os.mkdir(path, 0o700)
+  except OSError as ex:
+    if ex.errno != errno.EEXIST:
+      raise
+  st = os.lstat(path)
+  if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+      st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+    raise ValueError(
+        'Refusing to use %r for warm test runners: it must be a directory '
+        'owned by the current user, which nobody else can write to.' % (path,))
+
+
+def connect(pool, worker_id, cmd):
+  """Connects to warm runner `worker_id` in `pool`, spawning it if necessary.
+
+  Args:
+    * pool (str) - The pool directory, as returned by `pool_dir`.
+    * worker_id (int) - The index of the runner in the pool.
+    * cmd (List[str]) - The `recipes.py ... test _runner` command line.
+      `--listen` is appended to this when spawning a new runner.
+
+  Returns a connected gevent socket.
+  Raises ValueError if the pool directory isn't private, or if a freshly
+  spawned runner failed to start.
+  """
+  # Make sure that nobody else could have put anything in the pool before
+  # trusting whatever we find there.
+  _ensure_private_dir(os.path.dirname(pool))
+  _ensure_private_dir(pool)
+
+  sock_path = os.path.join(pool, 'worker-%d.sock' % worker_id)
+
+  def _try_connect():
+    sock = gsocket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      sock.connect(sock_path)
+      return sock
+    except (IOError, OSError):
+      sock.close()
+      return None
+
+  sock = _try_connect()
+  if sock:
+    return sock
+
+  # The socket file is either missing or stale (i.e. its runner died).
+  try:
+    os.remove(sock_path)
+  except OSError:
+    pass
+
+  log_path = os.path.join(pool, 'worker-%d.log' % worker_id)
+  with open(log_path, 'wb') as log_file:
+    proc = subprocess.Popen(
+        cmd + ['--listen', sock_path],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=log_file,
+        start_new_session=True)
+
+  deadline = time.time() + _SPAWN_TIMEOUT
+  while time.time() < deadline:
+    sock = _try_connect()
+    if sock:
+      return sock
+    # A different runner may have won the race to listen on `sock_path`, so only
+    # give up on a dead process if we also couldn't connect.
+    if proc.poll() is not None:
+      sock = _try_connect()
+      if sock:
+        return sock
+      break
+    gevent.sleep(0.1)
+
+  with open(log_path) as log_file:
+    raise ValueError('Failed to start warm test runner %d:\n%s' % (
+        worker_id, log_file.read()))
+
+
+def _module_files(repo):
+  """Returns {abspath: (mtime_ns, size)} for all python files in the repo's
+  recipe modules."""
+  ret = {}
+  for base, dirs, fnames in os.walk(repo.modules_dir):
+    dirs[:] = [d for d in dirs if not d.endswith(('.expected', '.resources'))]
+    for fname in fnames:
+      if fname.endswith('.py'):
+        path = os.path.join(base, fname)
+        try:
+          ret[path] = _stat_key(path)
+        except OSError:
+          pass
+  return ret
+
+
+def _snapshot(recipe_deps):
+  """Returns a {(repo_name, module_name): {path: stat key}} map for every recipe
+  module python file in `recipe_deps`."""
+  ret = {}
+  for repo_name, repo in iteritems(recipe_deps.repos):
+    for path, key in iteritems(_module_files(repo)):
+      module_name = os.path.relpath(path, repo.modules_dir).split(os.path.sep)[0]
+      ret.setdefault((repo_name, module_name), {})[path] = key
+  return ret
+
+
+class WarmState(object):
+  """Holds the state of a warm runner which persists across sessions."""
+
+  def __init__(self, recipe_deps):
+    self.recipe_deps = recipe_deps
+    self._snapshot = _snapshot(recipe_deps)
+
+  def _loaded_modules(self):
+    """Yields the RecipeModule for every recipe module which is currently
+    imported."""
+    for repo_name, repo in iteritems(self.recipe_deps.repos):
+      for module_name, module in iteritems(repo.modules):
+        if 'RECIPE_MODULES.%s.%s' % (repo_name, module_name) in sys.modules:
+          yield module
+
+  def _purge(self, to_purge):
+    """Removes the given (repo_name, module_name) recipe modules, and all loaded
+    modules which (transitively) depend on them, from sys.modules."""
+    to_purge = set(to_purge)
+    loaded = list(self._loaded_modules())
+    while True:
+      added = {
+        (module.repo.name, module.name) for module in loaded
+        if (module.repo.name, module.name) not in to_purge
+        and to_purge.intersection(itervalues(module.normalized_DEPS))
+      }
+      if not added:
+        break
+      to_purge.update(added)
+
+    prefixes = tuple(
+        'RECIPE_MODULES.%s.%s' % key for key in to_purge)
+    for name in list(sys.modules):
+      if name in prefixes or name.startswith(
+          tuple(prefix + '.' for prefix in prefixes)):
+        del sys.modules[name]
+    if to_purge:
+      LOG.info('reloading recipe modules: %r', sorted(to_purge))
+
+  def refresh(self, purge_main_repo):
+    """Brings this warm runner up to date with the files on disk.
+
+    Reloads the RecipeDeps (so that recipe files are re-read and new or deleted
+    recipes are picked up), and drops any recipe modules whose files changed
+    since the last session from sys.modules so that they will be re-imported.
+    Also forgets the parsed source of changed files which failed checks were
+    rendered from.
+
+    Args:
+      * purge_main_repo (bool) - If True, all modules of the main repo are
+        dropped, regardless of whether they changed. This is required to
+        collect coverage of their import.
+    """
+    snapshot = _snapshot(self.recipe_deps)
+    changed = {
+      key for key in set(snapshot) | set(self._snapshot)
+      if snapshot.get(key) != self._snapshot.get(key)
+    }
+    if purge_main_repo:
+      changed.update(
+          (self.recipe_deps.main_repo_id, module_name)
+          for module_name in self.recipe_deps.main_repo.modules)
+    self._purge(changed)
+    self._snapshot = snapshot
+
+    old = self.recipe_deps
+    self.recipe_deps = RecipeDeps.create(
+        old.main_repo.path,
+        {
+          repo_name: repo.path
+          for repo_name, repo in iteritems(old.repos)
+          if repo_name != old.main_repo_id
+        },
+        os.path.dirname(PB.__path__[0]))
+    sys.meta_path = [
+      RecipeModuleImporter(self.recipe_deps)
+      if isinstance(hook, RecipeModuleImporter) else hook
+      for hook in sys.meta_path
+    ]
+    importlib.invalidate_caches()
+    linecache.checkcache()
+    Check.forget_changed_files()
+
+
+def serve(recipe_deps, listen, idle_timeout, run_session):
+  """Serves sessions on the unix socket `listen` until no new session arrives
+  within `idle_timeout` seconds.
+
+  Args:
+    * recipe_deps (RecipeDeps) - The initially loaded recipe dependencies.
+    * listen (str) - The path of the unix socket to listen on.
+    * idle_timeout (float) - Seconds to wait for a new session before exiting.
+    * run_session (func(recipe_deps, in_file, out_file, session)) - Runs all
+      tests in a single session.
+
+  Returns 0.
+  """
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    listener.bind(listen)
+  except OSError as ex:
+    if ex.errno == errno.EADDRINUSE:
+      # Some other runner beat us to it.
+      return 0
+    raise
+
+  try:
+    listener.listen(1)
+    listener.settimeout(idle_timeout)
+    state = WarmState(recipe_deps)
+    first = True
+    while True:
+      try:
+        conn, _ = listener.accept()
+      except socket.timeout:
+        return 0
+      conn.settimeout(None)
+      conn_file = SocketFile(conn)
+      try:
+        # NOTE: A Session with all default values is encoded as a zero-length
+        # message, which read_message returns as None.
+        session = read_message(conn_file, Session) or Session()
+        # The first session runs against the freshly started process, so there
+        # is nothing to reload yet.
+        if not first:
+          state.refresh(purge_main_repo=bool(session.cov_file))
+        first = False
+        run_session(state.recipe_deps, conn_file, conn_file, session)
+        conn_file.write(END_OF_SESSION)
+      except (EOFError, IOError, OSError) as ex:
+        LOG.warning('session aborted: %r', ex)
+      finally:
+        conn_file.close()
+  finally:
+    listener.close()
+    try:
+      os.remove(listen)
+    except OSError:
+      pass
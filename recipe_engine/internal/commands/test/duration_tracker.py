@@ -0,0 +1,104 @@
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import heapq
+import json
+import os
+
+from future.utils import iteritems
+
+import attr
+
+
+@attr.s
+class DurationTracker(object):
+  """Tracks how long each test took in previous runs.
+
+  Durations are saved to a JSON file (mapping full test name to seconds) next
+  to the .previous_test_failures file. They are used to queue the longest tests
+  first, so that a single slow test doesn't hold up the end of a run, and to
+  predict the critical path (the busiest runner's total test time) of a run.
+  """
+  _durations_path = attr.ib()
+
+  # full test name -> duration in seconds, as loaded from disk.
+  _durations = attr.ib(factory=dict)
+  # full test name -> duration in seconds, as measured in this run.
+  _measured = attr.ib(factory=dict)
+  # Estimated durations of all tests sent to the runners, in queue order.
+  _queued = attr.ib(factory=list)
+  # The average of `_durations`, computed on first use.
+  _average = attr.ib(default=None)
+
+  def __attrs_post_init__(self):
+    try:
+      with open(self._durations_path) as f:
+        self._durations = {
+          str(name): float(duration)
+          for name, duration in iteritems(json.load(f))
+        }
+    except (IOError, ValueError, AttributeError, TypeError):
+      self._durations = {}
+
+  def estimate(self, test_name):
+    """Returns the expected duration of `test_name` in seconds.
+
+    Tests without a recorded duration are assumed to take the average time of
+    all recorded tests (or 0 if there are none).
+    """
+    ret = self._durations.get(test_name)
+    if ret is None:
+      if self._average is None:
+        self._average = (
+            sum(self._durations.values()) / len(self._durations)
+            if self._durations else 0.)
+      ret = self._average
+    return ret
+
+  def queued(self, test_name):
+    """Notes that `test_name` was sent to the runners (in this order)."""
+    self._queued.append(self.estimate(test_name))
+
+  def predict_critical_path(self, jobs):
+    """Returns the predicted critical path, in seconds, of running all queued
+    tests on `jobs` runners, or None if there's no recorded data.
+
+    Each test goes to whichever runner becomes free first, which is how the
+    RunnerThreads pick tests off of the description queue.
+    """
+    if not any(self._queued):
+      return None
+    runners = [0.] * max(jobs, 1)
+    for duration in self._queued:
+      heapq.heappush(runners, heapq.heappop(runners) + duration)
+    return max(runners)
+
+  def record(self, outcome_msg):
+    """Records the durations of all tests in `outcome_msg`.
+
+    Results without a duration (e.g. from the test result cache) are ignored.
+    """
+    for test_name, test_result in iteritems(outcome_msg.test_results):
+      if test_result.HasField('duration'):
+        self._measured[test_name] = test_result.duration.ToTimedelta(
+            ).total_seconds()
+
+  def save(self, prune):
+    """Writes the recorded durations to disk.
+
+    Args:
+      * prune (bool) - If True, drop the durations of all tests which didn't
+        run this time (i.e. the run was unfiltered, so they no longer exist).
+    """
+    if not self._measured:
+      return
+    durations = {} if prune else {
+      name: duration for name, duration in iteritems(self._durations)
+      if name not in self._measured
+    }
+    durations.update(self._measured)
+    tmp_path = self._durations_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(durations, f, sort_keys=True)
+    os.replace(tmp_path, self._durations_path)
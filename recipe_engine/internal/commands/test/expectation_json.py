@@ -0,0 +1,147 @@
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Serializes test expectations to the JSON text of expectation files.
+
+`dumps(obj)` returns exactly the same text as
+
+    json.dumps(obj, sort_keys=True, indent=2, separators=(',', ': '))
+
+but also accepts bytes (decoded as utf-8) and any Mapping or Iterable, which
+can leak into the expectations of simulation tests.
+
+When indenting, the json module always uses its pure python encoder, which
+passes every chunk of output through a chain of nested generators (one per
+nesting level). Together with the copy needed to convert the expectations to
+plain JSON types first, this is a noticeable part of the runtime of tests with
+large expectations. Instead, this makes a single recursive pass over `obj`,
+appending all chunks to one list.
+"""
+
+from collections.abc import Iterable, Mapping
+from json.encoder import encode_basestring_ascii as _encode_str
+from operator import itemgetter
+
+from future.utils import iteritems
+
+
+_INDENT = '  '
+
+_INF = float('inf')
+
+_first = itemgetter(0)
+
+
+def dumps(obj):
+  """Returns the expectation file text for `obj` (jsonish)."""
+  chunks = []
+  _encode(obj, chunks.append, '\n')
+  return ''.join(chunks)
+
+
+def _float_repr(value):
+  if value != value:  # pylint: disable=comparison-with-itself
+    return 'NaN'
+  if value == _INF:
+    return 'Infinity'
+  if value == -_INF:
+    return '-Infinity'
+  return float.__repr__(value)
+
+
+def _key_repr(key):
+  """Returns the JSON object key (str) for the dict key `key`."""
+  if isinstance(key, str):
+    return key
+  if isinstance(key, float):
+    return _float_repr(key)
+  if key is True:
+    return 'true'
+  if key is False:
+    return 'false'
+  if key is None:
+    return 'null'
+  if isinstance(key, int):
+    return int.__repr__(key)
+  raise TypeError('keys must be str, int, float, bool or None, not %s' % (
+      key.__class__.__name__,))
+
+
+def _sorted_items(obj):
+  """Returns the (key, value) pairs of the Mapping `obj`, sorted by key, with
+  bytes keys decoded."""
+  for key in obj:
+    if isinstance(key, bytes):
+      return sorted(
+          ((key.decode('utf-8', 'replace') if isinstance(key, bytes) else key,
+            value) for key, value in iteritems(obj)),
+          key=_first)
+  return sorted(iteritems(obj), key=_first)
+
+
+def _encode(obj, append, newline):
+  """Appends the JSON text for `obj` to the output.
+
+  Args:
+    * obj (jsonish) - The object to encode.
+    * append (func(str)) - Appends a chunk to the output.
+    * newline (str) - A newline followed by the indentation of `obj`.
+  """
+  # Check the common (exact) types first.
+  obj_type = type(obj)
+  if obj_type is str:
+    append(_encode_str(obj))
+  elif obj_type is dict or (
+      obj_type is not list and isinstance(obj, Mapping)):
+    if not obj:
+      append('{}')
+      return
+    inner = newline + _INDENT
+    sep = '{' + inner
+    for key, value in _sorted_items(obj):
+      append(sep)
+      append(_encode_str(key if type(key) is str else _key_repr(key)))
+      append(': ')
+      _encode(value, append, inner)
+      sep = ',' + inner
+    append(newline)
+    append('}')
+  elif obj_type is list or obj_type is tuple or (
+      not isinstance(obj, (str, bytes, int, float)) and obj is not None
+      and isinstance(obj, Iterable)):
+    if obj_type is not list and obj_type is not tuple:
+      obj = list(obj)
+    if not obj:
+      append('[]')
+      return
+    inner = newline + _INDENT
+    if all(type(value) is str for value in obj):
+      # e.g. 'cmd' and '~followup_annotations'.
+      append('[' + inner + (',' + inner).join(map(_encode_str, obj)) +
+             newline + ']')
+      return
+    sep = '[' + inner
+    for value in obj:
+      append(sep)
+      _encode(value, append, inner)
+      sep = ',' + inner
+    append(newline)
+    append(']')
+  elif isinstance(obj, str):
+    append(_encode_str(obj))
+  elif isinstance(obj, bytes):
+    append(_encode_str(obj.decode('utf-8', 'replace')))
+  elif obj is None:
+    append('null')
+  elif obj is True:
+    append('true')
+  elif obj is False:
+    append('false')
+  elif isinstance(obj, int):
+    append(int.__repr__(obj))
+  elif isinstance(obj, float):
+    append(_float_repr(obj))
+  else:
+    raise TypeError('Object of type %s is not JSON serializable' % (
+        obj.__class__.__name__,))
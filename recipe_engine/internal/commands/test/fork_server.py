@@ -0,0 +1,173 @@
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Support for starting `recipes.py test _runner` subprocesses from a fork
+server (Linux only).
+
+Normally each of the `--jobs` runner subprocesses separately starts python,
+imports the engine, gevent and the protobufs, loads the RecipeDeps and imports
+the recipe modules. With `--fork-server`, a single runner subprocess does all
+of this once and then forks the runners, which share the already imported
+state copy-on-write.
+
+The fork server listens on a unix domain socket. Each connection is handed to
+a freshly forked runner, and then uses the same session protocol as warm
+runners (see daemon.py). The fork server removes the socket and exits once it
+forked all runners (or when no runner connected for a while).
+
+The socket lives in a private temporary directory, so that other users can't
+listen on it first.
+"""
+
+import atexit
+import errno
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+import gevent
+from gevent import socket as gsocket
+from gevent import subprocess
+
+# pylint: disable=import-error
+from PB.recipe_engine.internal.test.runner import Session
+
+from .daemon import SocketFile
+from .pipe import read_message, END_OF_SESSION
+
+
+LOG = logging.getLogger(__name__)
+
+# The maximum number of seconds to wait for the fork server to start listening,
+# and for the fork server to wait for each runner connection.
+_TIMEOUT = 120
+
+
+class ForkServer(object):
+  """The client side of a running fork server subprocess."""
+
+  def __init__(self, cmd, workers):
+    """Starts the fork server.
+
+    Args:
+      * cmd (List[str]) - The `recipes.py ... test _runner` command line.
+        `--fork-server` is appended to this.
+      * workers (int) - The number of runners which will connect.
+    """
+    self._sock_dir = tempfile.mkdtemp(prefix='recipes-fork-server-')
+    self._sock_path = os.path.join(self._sock_dir, 'sock')
+    # Runners which still have to connect; see connect.
+    self._pending = workers
+    atexit.register(self.close)
+    self._proc = subprocess.Popen(
+        cmd + [
+          '--fork-server', self._sock_path, '--fork-workers', str(workers),
+        ],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=None)
+
+  def connect(self):
+    """Returns a gevent socket connected to a newly forked runner.
+
+    Raises ValueError if the fork server failed to start.
+    """
+    deadline = time.time() + _TIMEOUT
+    while time.time() < deadline:
+      sock = gsocket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      try:
+        sock.connect(self._sock_path)
+        self._pending -= 1
+        if not self._pending:
+          self.close()
+        return sock
+      except (IOError, OSError):
+        sock.close()
+      if self._proc.poll() is not None:
+        break
+      gevent.sleep(0.05)
+    self.close()
+    raise ValueError(
+        'Failed to connect to the test runner fork server (exit code %r)' % (
+            self._proc.poll(),))
+
+  def close(self):
+    """Removes the socket's directory. Called once all runners connected (or
+    the fork server failed), and at exit."""
+    shutil.rmtree(self._sock_dir, ignore_errors=True)
+
+
+def _serve_connection(recipe_deps, conn, run_session):
+  """Runs in the forked runner; serves the single session on `conn`."""
+  conn_file = SocketFile(conn)
+  try:
+    session = read_message(conn_file, Session) or Session()
+    run_session(recipe_deps, conn_file, conn_file, session)
+    conn_file.write(END_OF_SESSION)
+  except (EOFError, IOError, OSError) as ex:
+    LOG.warning('session aborted: %r', ex)
+  finally:
+    conn_file.close()
+
+
+def serve(recipe_deps, listen, workers, run_session):
+  """Forks a runner for each of the first `workers` connections to the unix
+  socket `listen`.
+
+  Args:
+    * recipe_deps (RecipeDeps) - The loaded recipe dependencies.
+    * listen (str) - The path of the unix socket to listen on.
+    * workers (int) - The number of runners to fork.
+    * run_session (func(recipe_deps, in_file, out_file, session)) - Runs all
+      tests in a single session.
+
+  Returns 0 in the fork server. Never returns in the forked runners.
+  """
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  listener.bind(listen)
+  children = []
+  try:
+    listener.listen(workers)
+    listener.settimeout(_TIMEOUT)
+    for _ in range(workers):
+      try:
+        conn, _ = listener.accept()
+      except socket.timeout:
+        LOG.warning('timed out waiting for test runner connections')
+        break
+      conn.settimeout(None)
+
+      pid = os.fork()
+      if pid == 0:
+        exit_code = 0
+        try:
+          listener.close()
+          gevent.reinit()
+          _serve_connection(recipe_deps, conn, run_session)
+        except BaseException:  # pylint: disable=broad-except
+          LOG.exception('forked test runner crashed')
+          exit_code = 1
+        finally:
+          # Never return into (or run the cleanup of) the fork server's stack.
+          sys.stdout.flush()
+          sys.stderr.flush()
+          os._exit(exit_code)  # pylint: disable=protected-access
+      conn.close()
+      children.append(pid)
+  finally:
+    listener.close()
+    try:
+      os.remove(listen)
+    except OSError:
+      pass
+
+  for pid in children:
+    try:
+      os.waitpid(pid, 0)
+    except OSError as ex:
+      if ex.errno != errno.ECHILD:
+        raise
+  return 0
@@ -12,6 +12,9 @@ import os
 
 _PY3 = sys.version_info.major == 3
 
+# A zero-length message; `read_message` returns None when it reads this.
+END_OF_SESSION = struct.pack('!L', 0)
+
 
 def read_message(in_file, msg_class):
   """Reads the given proto Message subclass from the file descriptor `in_file`.
@@ -80,8 +83,8 @@ def write_message(out_file, message):
   """
   out_data = message.SerializeToString()
   try:
-    out_file.write(struct.pack('!L', len(out_data)))
-    out_file.write(out_data)
+    # A single write, so that unbuffered pipes only need one syscall.
+    out_file.write(struct.pack('!L', len(out_data)) + out_data)
     return True
   except IOError:
     return False
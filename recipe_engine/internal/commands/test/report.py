@@ -36,6 +36,9 @@ class Reporter(object):
   _fail_tracker = attr.ib()
   # If set, will print warning details (even if there are other fatal failures)
   _enable_warning_details = attr.ib()
+  # If set, the ResultCache whose hit/miss counters are included in the final
+  # report.
+  _result_cache = attr.ib(default=None)
 
   _column_count = attr.ib(default=0)
   _error_buf = attr.ib(factory=StringIO)
@@ -120,7 +123,8 @@ class Reporter(object):
     return has_fail
 
 
-  def final_report(self, cov, outcome_msg):
+  def final_report(self, cov, outcome_msg, critical_path=None,
+                   missing_coverage=None):
     """Prints all final information about the test run to stdout.
     Raises SystemExit if the tests have failed.
 
@@ -133,6 +137,13 @@ class Reporter(object):
         Consulted for uncovered_modules and unused_expectation_files.
         coverage_percent is also populated as a side effect.
         Any uncovered_modules/unused_expectation_files count as a test failure.
+      * critical_path (Tuple[float|None, float]|None) - The predicted (None if
+        there was no timing data to base a prediction on) and actual critical
+        path of the run, in seconds. That is, the total time which the busiest
+        runner spent running tests.
+      * missing_coverage (List[str]|None) - The names of the tests which didn't
+        run and had no cached coverage. If non-empty, `cov` is incomplete, so
+        no coverage analysis is done and the tests count as failed.
 
     Side-effects: Populates outcome_msg.coverage_percent.
 
@@ -146,6 +157,21 @@ class Reporter(object):
       sys.stdout.write(
         'Errors in %s\n' % (self._error_buf.getvalue()))
 
+    if missing_coverage:
+      fail = True
+      print('------')
+      print('ERROR: No up-to-date coverage is cached for %d tests excluded by '
+            '--filter:' % len(missing_coverage))
+      for name in sorted(missing_coverage)[:10]:
+        print('  ', name)
+      if len(missing_coverage) > 10:
+        print('   ... and %d more' % (len(missing_coverage) - 10))
+      print()
+      print('Run them once (e.g. `./recipes.py test run`) to record their')
+      print('coverage.')
+      print()
+      cov = None
+
     # For some integration tests we have repos which don't actually have any
     # recipe files at all. We skip coverage measurement if cov has no data.
     if cov and cov.get_data().measured_files():
@@ -166,6 +192,17 @@ class Reporter(object):
     print('-' * 70)
     print('Ran %d tests in %0.3fs' % (len(outcome_msg.test_results),
                                       duration))
+    cache = self._result_cache
+    if cache and (cache.hits or cache.misses):
+      print('Test result cache: %d hits, %d misses' % (cache.hits,
+                                                      cache.misses))
+    # Skip this if no tests ran at all (e.g. they all came from the cache).
+    if critical_path and any(critical_path):
+      predicted, actual = critical_path
+      if predicted is None:
+        print('Critical path: %0.3fs' % (actual,))
+      else:
+        print('Critical path: %0.3fs (predicted %0.3fs)' % (actual, predicted))
     print()
 
     if outcome_msg.uncovered_modules:
@@ -0,0 +1,307 @@
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Content-addressed cache of passing simulation test results.
+
+Every test gets a cache key which is a hash of everything that can influence
+its outcome:
+  * The python version, the recipe engine code and the compiled protos.
+  * The recipes.cfg and recipe.warnings files of every repo.
+  * The recipe file and its resources.
+  * All files of every recipe module in the recipe's transitive DEPS.
+  * The test data yielded by GenTests.
+  * The current content of the test's expectation file.
+
+Only passing results (no failures, expectation file unchanged) are stored. When
+a test's key matches its stored entry, the stored result is reported instead of
+running the test again.
+
+When the test ran with coverage, its entry also stores the lines it covered.
+This allows a run to compute the coverage of the whole repo without running
+the tests whose entries are still up to date.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+
+from future.utils import iteritems
+
+import attr
+
+from google.protobuf import json_format
+
+from recipe_engine import __path__ as RECIPE_ENGINE_PATH
+
+# pylint: disable=import-error
+import PB
+from PB.recipe_engine.internal.test.runner import Outcome
+
+from ...recipe_deps import MODULE_RECIPE_SUBDIRS
+from ...simple_cfg import RECIPES_CFG_LOCATION_REL
+from ...warn.definition import RECIPE_WARNING_DEFINITIONS_REL
+from .fail_tracker import FailTracker
+
+
+# Bump this to invalidate all existing caches (e.g. if the entry format
+# changes).
+_CACHE_VERSION = 2
+
+# Matches the object addresses in default python reprs (e.g.
+# `<function foo at 0x7f0c1a2b3c4d>`), which differ between processes.
+_ADDR_RE = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def _update_file(csum, path):
+  try:
+    with open(path, 'rb') as f:
+      csum.update(f.read())
+  except IOError:
+    csum.update(b'<missing>')
+  csum.update(b'\0')
+
+
+def _update_tree(csum, root, exts=None, skip_dirs=()):
+  """Adds the relative path and content of every file under `root` to `csum`.
+
+  Skips `.expected` directories, and the subdirectories of `root` named in
+  `skip_dirs`. If `exts` is given, only files with one of those extensions are
+  included.
+  """
+  for base, dirs, fnames in os.walk(root):
+    dirs[:] = sorted(
+        d for d in dirs
+        if not d.endswith('.expected') and not (
+          base == root and d in skip_dirs))
+    for fname in sorted(fnames):
+      if exts and not fname.endswith(exts):
+        continue
+      path = os.path.join(base, fname)
+      csum.update(os.path.relpath(path, root).encode('utf-8'))
+      csum.update(b'\0')
+      _update_file(csum, path)
+
+
+def _test_data_repr(test_data):
+  """Returns a process-independent string representation of a TestData."""
+  ret = [repr(test_data)]
+  for hook in test_data.post_process_hooks:
+    ret.append(repr((hook.func, hook.args, hook.kwargs)))
+  return _ADDR_RE.sub('', '\n'.join(ret))
+
+
+@attr.s
+class ResultCache(object):
+  """Looks up and records passing test results in the on-disk cache at
+  `RecipeDeps.test_result_cache_path`."""
+  _recipe_deps = attr.ib()
+
+  # If False, the cache is never consulted, but passing results are still
+  # recorded.
+  _use_cached = attr.ib()
+
+  # If True, only entries with coverage count as cache hits.
+  _need_coverage = attr.ib(default=False)
+
+  hits = attr.ib(default=0)
+  misses = attr.ib(default=0)
+
+  # full test name -> {
+  #   'key': str,
+  #   'result': JSONPB Outcome.Results,
+  #   'coverage': {path relative to the main repo: List[line number]},  # opt
+  # }
+  _entries = attr.ib(factory=dict)
+
+  # Full names of the tests whose cached coverage was used (see
+  # `add_cached_coverage`).
+  _cached_coverage = attr.ib(factory=set)
+
+  # Full names of the tests whose results were recorded in this run.
+  _recorded = attr.ib(factory=set)
+
+  # full test name -> cache key, for tests which were sent to a runner.
+  _pending = attr.ib(factory=dict)
+
+  # module full name -> hex digest
+  _module_digests = attr.ib(factory=dict)
+  _base_digest = attr.ib(default=None)
+  _dirty = attr.ib(default=False)
+
+  def __attrs_post_init__(self):
+    try:
+      with open(self._recipe_deps.test_result_cache_path) as f:
+        data = json.load(f)
+      if data.get('version') == _CACHE_VERSION:
+        self._entries = data['entries']
+    except (IOError, ValueError, KeyError, AttributeError):
+      self._entries = {}
+
+  def _get_base_digest(self):
+    if self._base_digest is None:
+      csum = hashlib.sha256()
+      csum.update(sys.version.encode('utf-8'))
+      _update_tree(csum, RECIPE_ENGINE_PATH[0], ('.py', '.proto'))
+      _update_file(csum, os.path.join(PB.__path__[0], 'csum'))
+      for _, repo in sorted(iteritems(self._recipe_deps.repos)):
+        _update_file(csum, os.path.join(repo.path, RECIPES_CFG_LOCATION_REL))
+        _update_file(csum, os.path.join(
+            repo.recipes_root_path, RECIPE_WARNING_DEFINITIONS_REL))
+      self._base_digest = csum.hexdigest()
+    return self._base_digest
+
+  def _get_module_digest(self, module_full_name):
+    ret = self._module_digests.get(module_full_name)
+    if ret is None:
+      repo_name, module_name = module_full_name.split('/', 1)
+      csum = hashlib.sha256()
+      # The module's own recipes can't affect other recipes; they're part of
+      # their own keys.
+      _update_tree(
+          csum, self._recipe_deps.repos[repo_name].modules[module_name].path,
+          skip_dirs=MODULE_RECIPE_SUBDIRS)
+      ret = self._module_digests[module_full_name] = csum.hexdigest()
+    return ret
+
+  def _key(self, recipe, full_name, test_data):
+    csum = hashlib.sha256()
+    for part in (_CACHE_VERSION, self._get_base_digest(), full_name):
+      csum.update(str(part).encode('utf-8'))
+      csum.update(b'\0')
+    _update_file(csum, recipe.path)
+    _update_tree(csum, recipe.resources_dir)
+    for module_full_name in sorted(recipe.transitive_DEPS):
+      csum.update(self._get_module_digest(module_full_name).encode('utf-8'))
+    csum.update(_test_data_repr(test_data).encode('utf-8'))
+    csum.update(b'\0')
+    _update_file(csum, test_data.expect_file)
+    return csum.hexdigest()
+
+  def _get_entry(self, recipe, test_data):
+    """Returns (full_name, key, entry), where entry is the up-to-date entry for
+    this test, or None."""
+    full_name = '%s.%s' % (recipe.name, test_data.name)
+    key = self._key(recipe, full_name, test_data)
+    entry = self._entries.get(full_name)
+    if not entry or entry['key'] != key:
+      entry = None
+    elif self._need_coverage and 'coverage' not in entry:
+      entry = None
+    return full_name, key, entry
+
+  def lookup(self, recipe, test_data):
+    """Returns the cached Outcome for this test, or None if it needs to run.
+
+    Args:
+      * recipe (Recipe) - The recipe under test.
+      * test_data (TestData) - The test case, as yielded by `recipe.gen_tests`.
+    """
+    full_name, key, entry = self._get_entry(recipe, test_data)
+    if self._use_cached and entry:
+      self.hits += 1
+      if self._need_coverage:
+        self._cached_coverage.add(full_name)
+      ret = Outcome()
+      json_format.ParseDict(entry['result'], ret.test_results[full_name])
+      return ret
+
+    if self._use_cached:
+      self.misses += 1
+    self._pending[full_name] = key
+    return None
+
+  def lookup_coverage(self, recipe, test_data):
+    """Uses the cached coverage of a test which doesn't run (i.e. which is
+    excluded by a filter) in `add_cached_coverage`.
+
+    Args:
+      * recipe (Recipe) - The recipe of the test.
+      * test_data (TestData) - The test case, as yielded by `recipe.gen_tests`.
+
+    Returns True iff the test has up-to-date cached coverage.
+    """
+    full_name, _, entry = self._get_entry(recipe, test_data)
+    if not entry or 'coverage' not in entry:
+      return False
+    self._cached_coverage.add(full_name)
+    return True
+
+  def record(self, outcome_msg):
+    """Stores all passing results in `outcome_msg` for tests which were looked
+    up (and missed) earlier, and drops the entries of all other tests in it."""
+    for full_name, test_result in iteritems(outcome_msg.test_results):
+      key = self._pending.pop(full_name, None)
+      if key is None:
+        continue  # a cache hit
+      self._dirty = True
+      old_entry = self._entries.pop(full_name, None)
+      if (FailTracker.test_failed(test_result) or
+          test_result.WhichOneof('expectation_file')):
+        continue
+      result = Outcome.Results()
+      result.CopyFrom(test_result)
+      result.ClearField('duration')
+      self._recorded.add(full_name)
+      entry = self._entries[full_name] = {
+        'key': key,
+        'result': json_format.MessageToDict(
+            result, preserving_proto_field_name=True),
+      }
+      # The coverage only depends on the key, so keep it if this run doesn't
+      # collect coverage.
+      if old_entry and old_entry['key'] == key and 'coverage' in old_entry:
+        entry['coverage'] = old_entry['coverage']
+
+  def record_coverage(self, cov_data):
+    """Stores the coverage of every test which was recorded by `record`.
+
+    Args:
+      * cov_data (coverage.CoverageData) - The combined coverage of the test
+        runners, where each test's coverage is in a context named after the
+        test.
+    """
+    root = self._coverage_root()
+    per_test = {}
+    for filename in cov_data.measured_files():
+      rel_path = os.path.relpath(filename, root)
+      for line, names in iteritems(cov_data.contexts_by_lineno(filename)):
+        for name in names:
+          per_test.setdefault(name, {}).setdefault(rel_path, []).append(line)
+    for full_name in self._recorded:
+      # Tests without any lines didn't cover anything.
+      self._entries[full_name]['coverage'] = {
+        rel_path: sorted(lines)
+        for rel_path, lines in iteritems(per_test.get(full_name, {}))
+      }
+      self._dirty = True
+
+  def add_cached_coverage(self, cov_data):
+    """Adds the cached coverage of all tests which didn't run to `cov_data`
+    (coverage.CoverageData)."""
+    root = self._coverage_root()
+    lines = {}
+    for full_name in self._cached_coverage:
+      for rel_path, entry_lines in iteritems(
+          self._entries[full_name]['coverage']):
+        lines.setdefault(os.path.join(root, rel_path), set()).update(
+            entry_lines)
+    if lines:
+      cov_data.add_lines(lines)
+
+  def _coverage_root(self):
+    # Measured file names have their symlinks resolved.
+    return os.path.realpath(self._recipe_deps.main_repo.recipes_root_path)
+
+  def save(self):
+    """Writes the cache to disk, if anything changed."""
+    if not self._dirty:
+      return
+    path = self._recipe_deps.test_result_cache_path
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump({'version': _CACHE_VERSION, 'entries': self._entries}, f)
+    os.replace(tmp_path, path)
+    self._dirty = False
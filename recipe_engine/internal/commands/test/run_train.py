@@ -30,7 +30,9 @@ from PB.recipe_engine.internal.test.runner import Description, Outcome
 from ..doc.cmd import regenerate_doc, is_doc_changed
 
 from . import report, test_name
+from .duration_tracker import DurationTracker
 from .fail_tracker import FailTracker
+from .result_cache import ResultCache
 from .runner import RunnerThread, DescriptionWithCallback
 
 
@@ -55,8 +57,19 @@ def _extract_filter_matchers(test_filters):
 
 # TODO(crbug.com/1147793): Remove the second return value after migration.
 def _push_tests(test_filters, is_train, main_repo, description_queue,
-                recent_fails):
+                recent_fails, outcome_queue, result_cache, duration_tracker,
+                missing_coverage=None):
   """
+  Recently failed tests are queued first, followed by all other tests in order
+  of their expected duration (longest first, according to `duration_tracker`).
+
+  Tests with a cached result in `result_cache` are not sent to the runners;
+  their cached Outcome is put directly on `outcome_queue` instead.
+
+  If `missing_coverage` is a list, the cached coverage of all tests excluded by
+  `test_filters` is looked up in `result_cache`, and the names of the tests
+  without up-to-date coverage are appended to it.
+
   Returns:
     * set - unused_expectation_files
   """
@@ -80,13 +93,23 @@ def _push_tests(test_filters, is_train, main_repo, description_queue,
           (test_case.name, og_name, expect_file))
 
     recipe_filenames[expect_file] = test_case.name
-    if not test_filter('%s.%s' % (recipe.name, test_case.name)):
+    full_name = '%s.%s' % (recipe.name, test_case.name)
+    if not test_filter(full_name):
+      if (missing_coverage is not None and
+          not result_cache.lookup_coverage(recipe, test_case)):
+        missing_coverage.append(full_name)
+      return
+
+    cached = result_cache.lookup(recipe, test_case)
+    if cached:
+      outcome_queue.put(cached)
       return
 
     description_queue.put(
         Description(
             recipe_name=recipe.name,
             test_name=test_case.name))
+    duration_tracker.queued(full_name)
 
     gevent.sleep()  # let any blocking threads pick this up
 
@@ -99,19 +122,20 @@ def _push_tests(test_filters, is_train, main_repo, description_queue,
   deferred_tests = []
   for recipe in itervalues(main_repo.recipes):
     if not recipe_filter(recipe.name):
-      continue
-
-    if test_filters:
+      if missing_coverage is None:
+        continue
+    elif test_filters:
       unused_expectation_files.update(recipe.expectation_paths)
 
     # Maps expect_file -> original test_name
     try:
       for test_case in recipe.gen_tests():  # User code, could raise
         full_name = recipe.full_name.split('::')[-1] + '.' + test_case.name
-        if len(recent_fails) == 0 or full_name in recent_fails:
+        if full_name in recent_fails:
           push_test(recipe, test_case)
         else:
-          deferred_tests.append((recipe, test_case))
+          deferred_tests.append(
+              (duration_tracker.estimate(full_name), recipe, test_case))
     except KeyboardInterrupt:
       raise
     except:
@@ -119,9 +143,11 @@ def _push_tests(test_filters, is_train, main_repo, description_queue,
       print("Crashed while running GenTests from recipe %r" % (recipe.name,))
       raise
 
-  # Test any non-recently-failed cases
-  for deferred_test in deferred_tests:
-    push_test(*deferred_test)
+  # Test any non-recently-failed cases, longest first. The sort is stable, so
+  # tests with equal estimates stay in recipe order.
+  deferred_tests.sort(key=lambda deferred: -deferred[0])
+  for _, recipe, test_case in deferred_tests:
+    push_test(recipe, test_case)
 
   unused_expectation_files -= used_expectation_files
   if not is_train:
@@ -133,7 +159,9 @@ def _push_tests(test_filters, is_train, main_repo, description_queue,
 
 
 def _run(test_results, recipe_deps, use_emoji, test_filters, is_train,
-         filtered_stacks, stop, jobs, show_warnings):
+         filtered_stacks, stop, jobs, show_warnings, daemon=False,
+         daemon_idle_timeout=None, use_cache=True, fork_server=False,
+         incremental_coverage=False):
   """Run tests in py3 subprocess pools.
   """
   main_repo = recipe_deps.main_repo
@@ -155,8 +183,15 @@ def _run(test_results, recipe_deps, use_emoji, test_filters, is_train,
   ))
 
   fail_tracker = FailTracker(recipe_deps.previous_test_failures_path)
+  duration_tracker = DurationTracker(recipe_deps.test_durations_path)
+  # Without filters, we always collect coverage. With filters, only if the
+  # coverage of the other tests is taken from the cache.
+  collect_coverage = not test_filters or incremental_coverage
+  missing_coverage = [] if test_filters and incremental_coverage else None
+  # When collecting coverage, only cached results with coverage can be used.
+  result_cache = ResultCache(recipe_deps, use_cache, collect_coverage)
   reporter = report.Reporter(recipe_deps, use_emoji, is_train, fail_tracker,
-                             show_warnings)
+                             show_warnings, result_cache)
 
   cov_dir = None
   total_cov = coverage.Coverage(config_file=False, data_file='.total_coverage',
@@ -172,13 +207,17 @@ def _run(test_results, recipe_deps, use_emoji, test_filters, is_train,
         outcome_queue,
         is_train,
         filtered_stacks,
-        collect_coverage=not test_filters,
-        jobs=jobs)
+        collect_coverage=collect_coverage,
+        jobs=jobs,
+        daemon=daemon,
+        idle_timeout=daemon_idle_timeout,
+        fork_server=fork_server)
     live_threads[:] = all_threads
 
     unused_expectation_files = _push_tests(
         test_filters, is_train, main_repo, description_queue,
-        fail_tracker.recent_fails)
+        fail_tracker.recent_fails, outcome_queue, result_cache,
+        duration_tracker, missing_coverage)
     test_results.unused_expectation_files.extend(unused_expectation_files)
 
     def execute_queue():
@@ -193,6 +232,8 @@ def _run(test_results, recipe_deps, use_emoji, test_filters, is_train,
           continue
 
         test_results.MergeFrom(rslt)
+        result_cache.record(rslt)
+        duration_tracker.record(rslt)
         has_fail = reporter.short_report(rslt, can_abort=True)
         if has_fail and stop:
           break
@@ -201,12 +242,16 @@ def _run(test_results, recipe_deps, use_emoji, test_filters, is_train,
       # (because outcome_queue has been closed by each worker, which is how we
       # escaped the while loop above).
       #
-      # If we don't have any filters, collect coverage data.
-      if (test_filters or (stop and has_fail)) is False:
+      # If we collected coverage, combine it with the cached coverage of all
+      # tests which didn't run.
+      if collect_coverage and not (stop and has_fail):
         data_paths = [t.cov_file for t in all_threads
                       if os.path.isfile(t.cov_file)]
         if data_paths:
           total_cov.combine(data_paths)
+        cov_data = total_cov.get_data()
+        result_cache.record_coverage(cov_data)
+        result_cache.add_cached_coverage(cov_data)
 
       return has_fail
 
@@ -215,14 +260,23 @@ def _run(test_results, recipe_deps, use_emoji, test_filters, is_train,
       description_queue.put(None)
 
     has_fail = execute_queue()
+    result_cache.save()
+    # Only forget about tests which didn't run if we ran all of them.
+    duration_tracker.save(prune=not (test_filters or (has_fail and stop)))
     print()
 
+    critical_path = (
+      duration_tracker.predict_critical_path(jobs),
+      max(thread.busy_time for thread in all_threads),
+    )
+
     # Don't display coverage if the --stop flag was specified and there's a
     # failure
     if has_fail and stop:
-      reporter.final_report(None, test_results)
+      reporter.final_report(None, test_results, critical_path)
     else:
-      reporter.final_report(total_cov, test_results)
+      reporter.final_report(total_cov, test_results, critical_path,
+                            missing_coverage)
 
   finally:
     for thread in live_threads:
@@ -268,7 +322,9 @@ def main(args):
   repo = args.recipe_deps.main_repo
   try:
     _run(ret, args.recipe_deps, args.use_emoji, args.test_filters, is_train,
-         args.filtered_stacks, args.stop, args.jobs, args.show_warnings)
+         args.filtered_stacks, args.stop, args.jobs, args.show_warnings,
+         args.daemon, args.daemon_idle_timeout, args.use_cache,
+         args.use_fork_server, args.incremental_coverage)
     _dump()
   except KeyboardInterrupt:
     args.docs = False  # skip docs
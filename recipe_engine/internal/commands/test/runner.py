@@ -4,14 +4,13 @@
 
 from builtins import str
 from future.utils import iteritems, itervalues
-from past.builtins import basestring
 from builtins import range
 
 import attr
 import collections
 import difflib
 import errno
-import json
+import functools
 import multiprocessing
 import os
 import re
@@ -24,6 +23,7 @@ import coverage
 
 from gevent import subprocess
 import gevent
+import gevent.queue
 
 from google.protobuf import json_format as jsonpb
 from google.protobuf import duration_pb2
@@ -33,7 +33,8 @@ from recipe_engine.util import extract_tb, enable_filtered_stacks
 
 # pylint: disable=import-error
 import PB
-from PB.recipe_engine.internal.test.runner import Description, Outcome
+from PB.recipe_engine.internal.test.runner import DescriptionBatch, Outcome
+from PB.recipe_engine.internal.test.runner import Session
 from PB.go.chromium.org.luci.buildbucket.proto.common import Status
 
 
@@ -47,8 +48,17 @@ from ...simple_cfg import RECIPES_CFG_LOCATION_REL
 from ...test import magic_check_fn
 from ...test.execute_test_case import execute_test_case
 
+from . import expectation_json
+from .coverage_collector import make_collector
 from .expectation_conversion import transform_expectations
-from .pipe import write_message, read_message
+from .pipe import write_message, read_message, END_OF_SESSION
+
+
+# RunnerThreads keep about this many seconds worth of tests (based on the
+# durations of the tests they ran so far) queued in their runner subprocess,
+# but never more than _MAX_BATCH_SIZE tests.
+_BATCH_SECONDS = 0.2
+_MAX_BATCH_SIZE = 32
 
 
 def _merge_presentation_updates(steps_ran, presentation_steps):
@@ -255,10 +265,7 @@ def _diff_test(test_results, expect_file, new_expect, is_train):
   if new_expect is None and cur_expect_text is None:
     return
 
-  new_expect_text = json.dumps(
-      _encode_decode(new_expect), sort_keys=True, indent=2,
-      separators=(',', ': '),
-  )
+  new_expect_text = expectation_json.dumps(new_expect)
 
   if new_expect_text == cur_expect_text:
     return
@@ -350,12 +357,10 @@ def _run_test(path_cleaner, test_results, recipe_deps, test_desc, test_data,
       test_case_result.raw_result, test_data, test_results,
       recipe_deps.main_repo.recipes_cfg_pb2.enforce_test_expected_status)
 
-  # Convert the result to a json object by dumping to json, and then parsing.
-  # TODO(iannucci): Use real objects so this only needs to be serialized once.
-  raw_expectations['$result'] = json.loads(jsonpb.MessageToJson(
+  raw_expectations['$result'] = jsonpb.MessageToDict(
       legacy.to_legacy_result(test_case_result.raw_result),
       including_default_value_fields=True,
-  ))
+  )
 
   if not raw_expectations['$result'].get('failure'): # on success
     if test_case_result.raw_result.summary_markdown: # has markdown populated
@@ -399,76 +404,156 @@ def _cover_all_imports(main_repo):
 # administrative stuff (main, pipe handling, etc.)
 
 def main(recipe_deps, cov_file, filtered_stacks, is_train,
-         cover_module_imports):
+         cover_module_imports, listen=None, idle_timeout=None,
+         fork_server=None, fork_workers=None):
   if filtered_stacks:
     enable_filtered_stacks()
   gevent.get_hub().exception_stream = None
 
+  if listen:
+    from .daemon import serve
+    return serve(recipe_deps, listen, idle_timeout, _run_session)
+
+  if fork_server:
+    from .fork_server import serve
+    import_cov_data = _preload_modules(recipe_deps, cover_module_imports)
+    return serve(recipe_deps, fork_server, fork_workers, functools.partial(
+        _run_session, import_cov_data=import_cov_data))
+
+  _run_session(
+      recipe_deps, sys.stdin.buffer, sys.stdout.buffer,
+      Session(train=is_train, cov_file=cov_file or '',
+              cover_module_imports=cover_module_imports))
+
+
+def _preload_modules(recipe_deps, cover_module_imports):
+  """Imports all recipe modules, so that runners forked from this process don't
+  have to.
+
+  Args:
+
+    * recipe_deps (RecipeDeps)
+    * cover_module_imports (bool) - Whether to collect coverage for the import
+      of the main repo's modules (see _cover_all_imports).
+
+  Returns the import coverage data (coverage.CoverageData), or None if it
+  wasn't collected.
+  """
+  import_cov_data = None
+  if cover_module_imports:
+    try:
+      import_cov_data = _cover_all_imports(recipe_deps.main_repo)
+    except Exception:  # pylint: disable=broad-except
+      # The runner which covers module imports will try again and report the
+      # error.
+      pass
+  for repo in itervalues(recipe_deps.repos):
+    for module in itervalues(repo.modules):
+      try:
+        module.do_import()
+      except Exception:  # pylint: disable=broad-except
+        # Reported by any test which actually uses this module.
+        pass
+  return import_cov_data
+
+
+def _run_session(recipe_deps, in_file, out_file, session,
+                 import_cov_data=None):
+  """Runs tests for DescriptionBatch messages read from `in_file` until EOF,
+  and writes an Outcome message for each Description to `out_file`.
+
+  Args:
+
+    * recipe_deps (RecipeDeps)
+    * in_file (file-like object) - The handle to read Descriptions from.
+    * out_file (writeable file-like object) - The handle to write Outcomes to.
+    * session (Session) - The settings for this batch of tests.
+    * import_cov_data (coverage.CoverageData|None) - If set, the already
+      collected coverage for the import of the main repo's recipe modules.
+  """
   main_repo = recipe_deps.main_repo
+  cov_file = session.cov_file
 
   cov_data = coverage.CoverageData(basename=cov_file)
-  if cover_module_imports:
-    cov_data.update(_cover_all_imports(main_repo))
+  if cov_file and session.cover_module_imports:
+    if import_cov_data is None:
+      import_cov_data = _cover_all_imports(main_repo)
+    cov_data.update(import_cov_data)
 
   test_data_cache = {}
 
   path_cleaner = _make_path_cleaner(recipe_deps)
 
-  fatal = False
-
-  while True:
-    test_desc = _read_test_desc()
-    if not test_desc:
-      break  # EOF or error
-
-    result = Outcome()
-    try:
-      full_name = '%s.%s' % (test_desc.recipe_name, test_desc.test_name)
-      test_result = result.test_results[full_name]
+  collector = None
+  if cov_file:
+    # A single collector for all tests; each test only covers the files
+    # matching its recipe's coverage_patterns (see `collector.switch` below).
+    # The coverage of each test is written with the test's full name as its
+    # context, so that it can be cached along with the test's result.
+    collector = make_collector([
+      os.path.join(main_repo.recipes_dir, '*.py'),
+      os.path.join(main_repo.modules_dir, '*.py'),
+    ])
+    collector.start()
 
-      recipe = main_repo.recipes[test_desc.recipe_name]
+  fatal = False
 
-      if cov_file:
-        # We have to start coverage now because we want to cover the importation
-        # of the covered recipe and/or covered recipe modules.
-        cov = coverage.Coverage(config_file=False, concurrency='gevent',
-                                data_file=None,
-                                include=recipe.coverage_patterns)
-        cov.start()  # to cover execfile of recipe/module.__init__
-
-      test_data = _get_test_data(test_data_cache, recipe, test_desc.test_name)
+  try:
+    for test_desc in _read_test_descs(in_file, out_file):
+      result = Outcome()
       try:
-        _run_test(path_cleaner, test_result, recipe_deps, test_desc, test_data,
-                  is_train)
+        full_name = '%s.%s' % (test_desc.recipe_name, test_desc.test_name)
+        test_result = result.test_results[full_name]
+
+        recipe = main_repo.recipes[test_desc.recipe_name]
+
+        if collector:
+          # We have to switch coverage now because we want to cover the
+          # importation of the covered recipe and/or covered recipe modules.
+          collector.switch(full_name, recipe.coverage_patterns)
+
+        test_data = _get_test_data(test_data_cache, recipe, test_desc.test_name)
+        try:
+          _run_test(path_cleaner, test_result, recipe_deps, test_desc,
+                    test_data, session.train)
+        except Exception as ex:  # pylint: disable=broad-except
+          test_result.internal_error.append('Uncaught exception: %r' % (ex,))
+          test_result.internal_error.extend(
+              traceback.format_exc().splitlines())
       except Exception as ex:  # pylint: disable=broad-except
-        test_result.internal_error.append('Uncaught exception: %r' % (ex,))
-        test_result.internal_error.extend(traceback.format_exc().splitlines())
-      if cov_file:
-        cov.stop()
-        cov_data.update(cov.get_data())
-
-    except Exception as ex:  # pylint: disable=broad-except
-      result.internal_error.append('Uncaught exception: %r' % (ex,))
-      result.internal_error.extend(traceback.format_exc().splitlines())
-      fatal = True
-
-    if (not write_message(sys.stdout.buffer, result)
-        or fatal):
-      break  # EOF
+        result.internal_error.append('Uncaught exception: %r' % (ex,))
+        result.internal_error.extend(traceback.format_exc().splitlines())
+        fatal = True
+
+      if (not write_message(out_file, result)
+          or fatal):
+        break  # EOF
+  finally:
+    if collector:
+      for name, lines in sorted(iteritems(collector.stop())):
+        cov_data.set_context(name)
+        cov_data.add_lines(lines)
 
   if cov_file:
     # Write data to the cov_file.
     cov_data.write()
 
 
-def _read_test_desc():
-  try:
-    return read_message(sys.stdin.buffer, Description)
-  except Exception as ex:  # pylint: disable=broad-except
-    write_message(sys.stdout.buffer, Outcome(internal_error=[
-          'while reading: %r' % (ex,)
-        ]+traceback.format_exc().splitlines()))
-    return None
+def _read_test_descs(in_file, out_file):
+  """Yields the Descriptions of all DescriptionBatch messages in `in_file`,
+  until EOF or error."""
+  while True:
+    try:
+      batch = read_message(in_file, DescriptionBatch)
+    except Exception as ex:  # pylint: disable=broad-except
+      write_message(out_file, Outcome(internal_error=[
+            'while reading: %r' % (ex,)
+          ]+traceback.format_exc().splitlines()))
+      return
+    if not batch:
+      return
+    for test_desc in batch.descriptions:
+      yield test_desc
 
 def _get_test_data(cache, recipe, test_name):
   key = (recipe.name, test_name)
@@ -478,24 +563,6 @@ def _get_test_data(cache, recipe, test_name):
   return cache[key]
 
 
-# TODO(iannucci): fix test system so that non-JSONish types cannot leak into
-# raw_expectations.
-def _encode_decode(obj):
-  """For py3: ensure any bytes are decoded to str"""
-  if isinstance(obj, basestring):
-    if isinstance(obj, bytes):
-      obj = obj.decode('utf-8', 'replace')
-    return obj
-
-  if isinstance(obj, collections.Mapping):
-    return {_encode_decode(k): _encode_decode(v) for k, v in iteritems(obj)}
-
-  if isinstance(obj, collections.Iterable):
-    return [_encode_decode(i) for i in obj]
-
-  return obj
-
-
 def _make_path_cleaner(recipe_deps):
   """Returns a filtering function which substitutes real paths-on-disk with
   expectation-compatible `RECIPE_REPO[repo name]` mock paths. This only works
@@ -564,12 +631,59 @@ class DescriptionWithCallback(object):
 
 class RunnerThread(gevent.Greenlet):
   def __init__(self, recipe_deps, description_queue, outcome_queue, is_train,
-               filtered_stacks, cov_file, cover_module_imports):
+               filtered_stacks, cov_file, cover_module_imports,
+               daemon_pool=None, worker_id=0, idle_timeout=None,
+               fork_server=None):
     super(RunnerThread, self).__init__()
 
     self.cov_file = cov_file
     self.exit_code = None
+    # Total seconds spent waiting on the runner subprocess for test results.
+    self.busy_time = 0.
+    # The number of tests to keep queued in the runner subprocess; adjusted as
+    # test results come in (see _adapt_batch_size).
+    self._batch_size = 2
+    self._avg_duration = None
+
+    cmd = self.runner_cmd(recipe_deps, filtered_stacks)
+
+    self._runner_proc = None
+    self._runner_stdin = self._runner_stdout = None
+    # For warm and forked runners; a function returning a socket connected to
+    # the runner, and the Session to send to it.
+    self._connect = self._session = None
+    if daemon_pool or fork_server:
+      # These runners get their per-invocation settings from the Session
+      # message instead of their command line. We connect to them in _run so
+      # that all runners of the pool are started concurrently.
+      if daemon_pool:
+        from .daemon import connect
+        cmd.extend(['--idle-timeout', str(idle_timeout)])
+        self._connect = functools.partial(connect, daemon_pool, worker_id, cmd)
+      else:
+        self._connect = fork_server.connect
+      self._session = Session(
+          train=is_train, cov_file=cov_file or '',
+          cover_module_imports=bool(cov_file and cover_module_imports))
+    else:
+      if is_train:
+        cmd.append('--train')
+      if cov_file:
+        cmd.extend(['--cov-file', cov_file])
+        if cover_module_imports:
+          cmd.append('--cover-module-imports')
+
+      self._runner_proc = subprocess.Popen(
+          cmd, bufsize=0, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+          stderr=None)
+      self._runner_stdin = self._runner_proc.stdin
+      self._runner_stdout = self._runner_proc.stdout
+    self._description_queue = description_queue
+    self._outcome_queue = outcome_queue
 
+  @staticmethod
+  def runner_cmd(recipe_deps, filtered_stacks):
+    """Returns the `recipes.py ... test _runner` command line (List[str])."""
     cmd = [
       'vpython3', '-u', sys.argv[0],
       '--package', os.path.join(
@@ -584,27 +698,19 @@ class RunnerThread(gevent.Greenlet):
       cmd.extend(['-O', '%s=%s' % (repo_name, repo.path)])
 
     cmd.extend(['test', '_runner'])
-    if is_train:
-      cmd.append('--train')
-    if cov_file:
-      cmd.extend(['--cov-file', cov_file])
-      if cover_module_imports:
-        cmd.append('--cover-module-imports')
     if not filtered_stacks:
       cmd.append('--full-stacks')
-
-    self._runner_proc = subprocess.Popen(cmd, bufsize=0, stdin=subprocess.PIPE,
-                                         stdout=subprocess.PIPE, stderr=None)
-    self._description_queue = description_queue
-    self._outcome_queue = outcome_queue
+    return cmd
 
   @classmethod
   def make_pool(cls, recipe_deps, description_queue, outcome_queue, is_train,
-                filtered_stacks, collect_coverage, jobs):
+                filtered_stacks, collect_coverage, jobs, daemon=False,
+                idle_timeout=None, fork_server=False):
     """Returns a pool (list) of started RunnerThread instances.
 
-    Each RunnerThread owns a `recipes.py test _runner` subprocess and
-    coordinates communication to and from that subprocess.
+    Each RunnerThread owns a `recipes.py test _runner` subprocess (or, if
+    `daemon` is set, a connection to a persistent one) and coordinates
+    communication to and from that subprocess.
 
     This makes `jobs` runners.
 
@@ -623,9 +729,20 @@ class RunnerThread(gevent.Greenlet):
       * collect_coverage (bool) - Whether or not to collect coverage. May be
         false if the user specified a test filter.
       * jobs (int) - The number of workers to use for running tests.
+      * daemon (bool) - Whether to use persistent ("warm") runner subprocesses
+        which are reused across invocations. See daemon.py.
+      * idle_timeout (float|None) - If `daemon` is set, the number of seconds
+        newly spawned warm runners wait for a new session before exiting.
+      * fork_server (bool) - Whether to fork all runner subprocesses from
+        a single one which already loaded everything. See fork_server.py.
 
     Returns List[RunnerThread].
     """
+    daemon_pool = None
+    if daemon:
+      from .daemon import pool_dir
+      daemon_pool = pool_dir(recipe_deps, filtered_stacks)
+
     if collect_coverage:
       cov_dir = tempfile.mkdtemp('.recipe_test_coverage')
       cov_file = lambda tid: os.path.join(cov_dir, 'thread-%d.coverage' % tid)
@@ -633,6 +750,14 @@ class RunnerThread(gevent.Greenlet):
       cov_dir = None
       cov_file = lambda tid: None
 
+    server = None
+    if fork_server:
+      from .fork_server import ForkServer
+      cmd = cls.runner_cmd(recipe_deps, filtered_stacks)
+      if collect_coverage:
+        cmd.append('--cover-module-imports')
+      server = ForkServer(cmd, jobs)
+
     # We assign import coverage to (only) the first runner subprocess; there's
     # no need to duplicate this work to all runners.
     pool = [
@@ -642,18 +767,115 @@ class RunnerThread(gevent.Greenlet):
             is_train,
             filtered_stacks,
             cov_file(i),
-            cover_module_imports=(i == 0)) for i in range(jobs)
+            cover_module_imports=(i == 0),
+            daemon_pool=daemon_pool,
+            worker_id=i,
+            idle_timeout=idle_timeout,
+            fork_server=server) for i in range(jobs)
     ]
     for thread in pool:
       thread.start()
     return cov_dir, pool
 
+  def _take_batch(self, max_size, block):
+    """Takes up to `max_size` tests from the description queue.
+
+    Args:
+
+      * max_size (int) - The maximum number of tests to take.
+      * block (bool) - If True, waits for the first test to become available.
+        Otherwise only takes tests which are already queued.
+
+    Returns (List[(Description, callback|None)], bool) - The tests, and whether
+    we got the poison pill (i.e. there will be no more tests).
+    """
+    batch = []
+    while len(batch) < max_size:
+      if block and not batch:
+        test_desc = self._description_queue.get()
+      else:
+        try:
+          test_desc = self._description_queue.get_nowait()
+        except gevent.queue.Empty:
+          break
+      if not test_desc:
+        return batch, True
+
+      callback = None
+      if isinstance(test_desc, DescriptionWithCallback):
+        callback = test_desc.callback
+        test_desc = test_desc.description
+      batch.append((test_desc, callback))
+    return batch, False
+
+  def _adapt_batch_size(self, result):
+    """Updates the number of tests to keep queued in the runner subprocess,
+    based on the duration of the test in `result` (an Outcome)."""
+    for test_result in itervalues(result.test_results):
+      if not test_result.HasField('duration'):
+        continue
+      duration = test_result.duration.ToTimedelta().total_seconds()
+      if self._avg_duration is None:
+        self._avg_duration = duration
+      else:
+        self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+      self._batch_size = max(1, min(
+          _MAX_BATCH_SIZE, int(_BATCH_SECONDS / max(self._avg_duration, 1e-3))))
+
   # pylint: disable=method-hidden
   def _run(self):
     try:
+      if self._connect:
+        from .daemon import SocketFile
+        self._runner_stdin = self._runner_stdout = SocketFile(self._connect())
+        write_message(self._runner_stdin, self._session)
+
+      # (Description, callback) pairs which were sent to the runner subprocess,
+      # but which haven't produced an Outcome yet.
+      in_flight = collections.deque()
+      draining = False
+      busy_start = None
       while True:
-        test_desc = self._description_queue.get()
-        if not test_desc:
+        # Top up the runner's queue once half of the in-flight tests are done,
+        # so that it always has work to do without waiting on us.
+        if not draining and len(in_flight) <= self._batch_size // 2:
+          batch, draining = self._take_batch(
+              self._batch_size - len(in_flight), block=not in_flight)
+          if batch:
+            if not in_flight:
+              busy_start = time.time()
+            if not write_message(self._runner_stdin, DescriptionBatch(
+                descriptions=[test_desc for test_desc, _ in batch])):
+              test_desc = batch[0][0]
+              self._outcome_queue.put(Outcome(internal_error=[
+                'Unable to send test description for (%s.%s) from %r' % (
+                  test_desc.recipe_name, test_desc.test_name, self.name
+                )
+              ]))
+              return
+            in_flight.extend(batch)
+
+        if in_flight:
+          _, callback = in_flight.popleft()
+          result = read_message(self._runner_stdout, Outcome)
+          if not in_flight:
+            self.busy_time += time.time() - busy_start
+          if callback:
+            callback()
+          if result is None:
+            return
+
+          self._adapt_batch_size(result)
+          self._outcome_queue.put(result)
+        else:
+          # We got the poison pill, and all in-flight tests are done.
+          if self._connect:
+            # End the session, and wait for the runner to acknowledge it (i.e.
+            # finish writing out coverage data).
+            self._runner_stdin.write(END_OF_SESSION)
+            read_message(self._runner_stdout, Outcome)
+            return
+
           self._runner_proc.stdout.close()
           try:
             self._runner_proc.stdin.write(b'\0')
@@ -664,27 +886,6 @@ class RunnerThread(gevent.Greenlet):
               pass
           self._runner_proc.wait()
           return
-
-        callback = None
-        if isinstance(test_desc, DescriptionWithCallback):
-          callback = test_desc.callback
-          test_desc = test_desc.description
-
-        if not write_message(self._runner_proc.stdin, test_desc):
-          self._outcome_queue.put(Outcome(internal_error=[
-            'Unable to send test description for (%s.%s) from %r' % (
-              test_desc.recipe_name, test_desc.test_name, self.name
-            )
-          ]))
-          return
-
-        result = read_message(self._runner_proc.stdout, Outcome)
-        if callback:
-          callback()
-        if result is None:
-          return
-
-        self._outcome_queue.put(result)
     except KeyboardInterrupt:
       pass
     except gevent.GreenletExit:
@@ -694,11 +895,14 @@ class RunnerThread(gevent.Greenlet):
         'Uncaught exception in %r: %s' % (self.name, ex)
       ]+traceback.format_exc().splitlines()))
     finally:
-      try:
-        self._runner_proc.kill()
-      except OSError:
-        pass
-      self.exit_code = self._runner_proc.wait()
+      if self._runner_proc:
+        try:
+          self._runner_proc.kill()
+        except OSError:
+          pass
+        self.exit_code = self._runner_proc.wait()
+      elif self._runner_stdin:
+        self._runner_stdin.close()
       # We rely on the thread to dump coverage information to disk; if we don't
       # wait for the process to die, then our main thread will race with the
       # runner thread for the coverage information. On windows this almost
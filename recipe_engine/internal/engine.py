@@ -37,6 +37,7 @@ from ..engine_types import StepPresentation, thaw
 from ..engine_types import PerGreenletState, PerGreentletStateRegistry
 from ..third_party import luci_context
 
+from . import startup_profile
 from .engine_env import merge_envs
 from .exceptions import RecipeUsageError, CrashEngine
 from .global_shutdown import GLOBAL_SHUTDOWN
@@ -57,13 +58,17 @@ class _ActiveStep(object):
   children_presentations = attr.ib(factory=list)  # type: List[StepPresentation]
   greenlets = attr.ib(factory=list)               # type: List[gevent.Greenlet]
 
+  # Used to warn about presentations which are too big for the Build.
+  warning_client = attr.ib(default=None)  # type: recipe_api.WarningClient
+
   def close(self):
     """If step_data is set, finalizes its StepPresentation with
     self.step_stream, then closes self.step_stream.
     """
     gevent.wait(self.greenlets)
     if self.step_data:
-      self.step_data.presentation.finalize(self.step_stream)
+      self.step_data.presentation.finalize(
+          self.step_stream, self.warning_client)
       self.step_stream.close()
 
 class _MemoryProfiler(object):
@@ -134,7 +139,7 @@ class RecipeEngine(object):
     self._step_runner = step_runner
     self._stream_engine = stream_engine  # type: StreamEngine
     self._properties = properties
-    self._engine_properties = _get_engine_properties(properties)
+    self._engine_properties = get_engine_properties(properties)
     self._environ = environ.copy()
     self._start_dir = start_dir
     self._clients = {client.IDENT: client for client in (
@@ -204,7 +209,7 @@ class RecipeEngine(object):
       return self._clients.get(req._name)
     raise ValueError('Unknown requirement type [%s]' % (req._typ,))
 
-  def initialize_path_client_HACK(self, root_api):
+  def initialize_path_client_HACK(self, root_api, load_order=()):
     """This is a hack; the "PathsClient" currently works to provide a reverse
     string->Path lookup by walking down the recipe's `api` object and calling
     the various 'root' path methods (like .resource(), etc.).
@@ -217,8 +222,13 @@ class RecipeEngine(object):
     Args:
       * root_api (RecipeScriptApi): The root `api` object which would be passed
         to the recipe's RunSteps function.
+      * load_order (Tuple[_ModuleLoader]): The loaders of every module the
+        recipe (transitively) depends on. With lazy_module_init, most of these
+        modules aren't instantiated yet, so their resource paths can't be found
+        by walking `root_api`.
     """
-    self._clients['paths']._initialize_with_recipe_api(root_api)
+    self._clients['paths']._initialize_with_recipe_api(
+        root_api, [loader.imported_module for loader in load_order])
 
   def record_import_warning(self, warning, importer):
     """Records an import warning."""
@@ -346,7 +356,7 @@ class RecipeEngine(object):
       active_step = _ActiveStep(
           step_data,
           self._stream_engine.new_step_stream(name_tokens, False),
-          True)
+          True, warning_client=self._clients['warning'])
       active_step.step_stream.mark_running()
       self._step_stack.append(active_step)
     except:
@@ -403,7 +413,8 @@ class RecipeEngine(object):
       # Add `presentation` to the parents of the active step.
       self._step_stack[-1].children_presentations.append(ret.presentation)
 
-      self._step_stack.append(_ActiveStep(ret, step_stream, False))
+      self._step_stack.append(_ActiveStep(
+          ret, step_stream, False, warning_client=self._clients['warning']))
 
       # NOTE: It's important to not open debug_log until:
       #   1) We know we're going to have to quit due to GLOBAL_SHUTDOWN; OR
@@ -552,14 +563,16 @@ class RecipeEngine(object):
       # RecipeUsageError exceptions which exec'ing it may cause.
       # TODO(iannucci): Make this @cached_property more explicit (e.g.
       # 'load_global_symbols' and 'cached_global_symbols' or something).
-      _ = recipe_obj.global_symbols
+      with startup_profile.phase('load recipe'):
+        _ = recipe_obj.global_symbols
 
       engine = cls(
           recipe_deps, step_runner, stream_engine, warning_recorder,
           properties, environ, cwd, initial_luci_context, num_logical_cores,
           memory_mb)
-      api = recipe_obj.mk_api(engine, test_data)
-      engine.initialize_path_client_HACK(api)
+      with startup_profile.phase('instantiate module APIs'):
+        api = recipe_obj.mk_api(engine, test_data)
+        engine.initialize_path_client_HACK(api, recipe_obj._load_order)
     except (RecipeUsageError, ImportError, AssertionError) as ex:
       _log_crash(stream_engine, 'loading recipe')
       # TODO(iannucci): differentiate infra failure and user failure; will
@@ -572,13 +585,15 @@ class RecipeEngine(object):
     # expectations).
     if not skip_setup_build:
       try:
-        engine._setup_build_step(recipe, emit_initial_properties)
+        with startup_profile.phase('setup_build'):
+          engine._setup_build_step(recipe, emit_initial_properties)
       except Exception as ex:
         _log_crash(stream_engine, 'setup_build')
         result.status = common_pb2.INFRA_FAILURE
         result.summary_markdown = 'Uncaught Exception: ' + util.format_ex(ex)
         return result, uncaught_exception
 
+    startup_profile.finish()
     try:
       try:
         try:
@@ -713,7 +728,7 @@ def _update_merge_step_presentation(presentation, sub_build,
           merged_log.url = '/'.join((user_namespace, log.url))
         presentation.logs[log.name] = merged_log
 
-def _get_engine_properties(properties):
+def get_engine_properties(properties):
   """Retrieve and resurrect JSON serialized engine properties from all
   properties passed to recipe.
 
@@ -2,7 +2,9 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import contextlib
 import errno
+import hashlib
 import logging
 import os
 import re
@@ -10,8 +12,14 @@ import sys
 
 from collections import namedtuple
 
+import gevent
 from gevent import subprocess
 
+if sys.platform == 'win32':
+  import msvcrt  # pylint: disable=import-error
+else:
+  import fcntl
+
 from . import gitattr_checker
 from . import simple_cfg
 from .exceptions import GitFetchError, UnresolvedRefspec
@@ -33,6 +41,55 @@ CommitMetadata = namedtuple(
   'revision author_email commit_timestamp message_lines spec roll_candidate')
 
 
+# If set, the directory to keep a shared cache of git objects in; see
+# GitBackend.
+GIT_CACHE_ENV_VAR = 'RECIPES_GIT_CACHE'
+
+# How often to retry taking a lock in the git cache.
+_LOCK_POLL_SECONDS = 0.1
+
+
+def git_cache_from_env():
+  """Returns the absolute path of the shared git cache set in the environment,
+  or None."""
+  path = os.environ.get(GIT_CACHE_ENV_VAR)
+  return os.path.abspath(path) if path else None
+
+
+def _cache_dir_name(repo_url):
+  """Returns the name of the git cache directory for `repo_url`."""
+  readable = re.sub(r'[^\w.-]+', '-', repo_url.split('://', 1)[-1])
+  return '%s-%s' % (readable.strip('-')[-64:],
+                    hashlib.sha1(repo_url.encode('utf-8')).hexdigest()[:8])
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+  """Holds an exclusive lock on the file at `path` (creating it if needed).
+
+  The lock is taken without blocking and retried, so other greenlets in this
+  process (including ones waiting on the same lock) keep running.
+  """
+  with open(path, 'a') as lock_file:
+    lock_file.seek(0)
+    while True:
+      try:
+        if sys.platform == 'win32':
+          msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+          fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        break
+      except (IOError, OSError):
+        gevent.sleep(_LOCK_POLL_SECONDS)
+    try:
+      yield
+    finally:
+      if sys.platform == 'win32':
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+      else:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 class Backend(object):
   def __init__(self, checkout_dir, repo_url):
     """
@@ -183,19 +240,43 @@ class Backend(object):
 
 
 class GitBackend(Backend):
-  """GitBackend uses a local git checkout."""
+  """GitBackend uses a local git checkout.
+
+  If a `git_cache` directory is given, objects are fetched into a repo shared
+  by all checkouts of the same url (`{git_cache}/{url-ish}`), instead of into
+  the checkout itself. The checkout borrows the objects through its
+  `.git/objects/info/alternates` file, so checking out a revision which is
+  already in the cache needs no network access at all. Engines fetching into the
+  same cache repo take turns using a lock file next to it.
+
+  Every commit fetched into a cache repo is kept in a `refs/cache/<sha>` ref, so
+  the objects which checkouts borrow stay reachable there.
+  """
 
   if sys.platform.startswith(('win', 'cygwin')):
     GIT_BINARY = 'git.bat'
   else:
     GIT_BINARY = 'git'
 
-  def __init__(self, *args, **kwargs):
-    super(GitBackend, self).__init__(*args, **kwargs)
+  def __init__(self, checkout_dir, repo_url, git_cache=None):
+    """
+    Args:
+      checkout_dir (str): See Backend.
+      repo_url (str|None): See Backend.
+      git_cache (str|None): native absolute path to the shared git cache
+        directory, if any. Ignored if repo_url is None.
+    """
+    super(GitBackend, self).__init__(checkout_dir, repo_url)
     self._did_ensure = False
+    self._did_link_cache = False
     self._resolved_refspecs = {}
     self._gitattr_checker = gitattr_checker.AttrChecker(self.checkout_dir)
 
+    self._cache = None
+    if git_cache and repo_url is not None:
+      self._cache = GitBackend(
+          os.path.join(git_cache, _cache_dir_name(repo_url)), repo_url)
+
   def _git(self, *args):
     """Runs a git command.
 
@@ -252,9 +333,8 @@ class GitBackend(Backend):
     Raises GitFetchError if it detected that checkout_dir is likely not a valid
     git repo.
     """
-    if self._did_ensure:
-      return
-    if not os.path.isdir(os.path.join(self.checkout_dir, '.git')):
+    if (not self._did_ensure and
+        not os.path.isdir(os.path.join(self.checkout_dir, '.git'))):
       try:
         # Note that it's safe to re-init an existing git repo. This should allow
         # us to switch between GitBackend and other Backends.
@@ -262,6 +342,66 @@ class GitBackend(Backend):
         self._did_ensure = True
       except subprocess.CalledProcessError as e:
         raise GitFetchError(False, 'Git "init" failed: %s' % e)
+    if self._cache:
+      self._link_cache()
+
+  @contextlib.contextmanager
+  def _locked_cache(self):
+    """Holds the lock of the shared cache repo, creating the repo if needed."""
+    cache_dir = self._cache.checkout_dir
+    parent = os.path.dirname(cache_dir)
+    if not os.path.isdir(parent):
+      try:
+        os.makedirs(parent)
+      except OSError as ex:
+        if ex.errno != errno.EEXIST:
+          raise
+    with _file_lock(cache_dir + '.lock'):
+      if not os.path.isdir(os.path.join(cache_dir, '.git')):
+        self._cache._ensure_local_repo_exists()
+      yield
+
+  def _fetch_into_cache(self, refspec):
+    """Fetches `refspec` into the shared cache repo (with its lock held).
+
+    `git fetch` only records what it fetched in FETCH_HEAD, so this keeps the
+    fetched commit in a ref to stop `git gc` from treating it as unreachable.
+    """
+    self._cache.fetch(refspec)
+    fetched = self._cache._git('rev-parse', 'FETCH_HEAD^{commit}').strip()
+    self._cache._git('update-ref', 'refs/cache/%s' % (fetched,), fetched)
+
+  def _link_cache(self):
+    """Makes the objects in the shared cache repo visible to this checkout."""
+    if self._did_link_cache:
+      return
+    # Git complains about alternates which don't exist, so make sure the cache
+    # repo does.
+    with self._locked_cache():
+      pass
+    self._did_link_cache = True
+
+    objects = os.path.join(self._cache.checkout_dir, '.git', 'objects')
+    alternates = os.path.join(
+        self.checkout_dir, '.git', 'objects', 'info', 'alternates')
+    try:
+      with open(alternates) as alt_file:
+        if objects in alt_file.read().splitlines():
+          return
+    except IOError:
+      pass
+    LOGGER.info('using git cache %s for %s', objects, self.checkout_dir)
+    if not os.path.isdir(os.path.dirname(alternates)):
+      os.makedirs(os.path.dirname(alternates))
+    with open(alternates, 'a') as alt_file:
+      alt_file.write(objects + '\n')
+
+  def _cache_has_rev(self, revision):
+    try:
+      self._cache._git('cat-file', '-e', '%s^{commit}' % (revision,))
+      return True
+    except GitFetchError:
+      return False
 
   def _has_rev(self, revision):
     """Returns True iff the on-disk repo has the given revision."""
@@ -282,6 +422,12 @@ class GitBackend(Backend):
       raise ValueError('cannot call GitBackend.fetch without a `repo_url`')
     self._ensure_local_repo_exists()
 
+    if self._cache:
+      # This checkout sees everything fetched into the cache (see _link_cache).
+      with self._locked_cache():
+        self._fetch_into_cache(refspec)
+      return
+
     args = ['fetch', self.repo_url]
     if not self.is_resolved_revision(refspec):
       args.append(refspec)
@@ -298,7 +444,13 @@ class GitBackend(Backend):
     self._ensure_local_repo_exists()
 
     if not self._has_rev(revision):
-      self.fetch(refspec)
+      if self._cache:
+        with self._locked_cache():
+          # Some other engine may have fetched it while we waited for the lock.
+          if not self._cache_has_rev(revision):
+            self._fetch_into_cache(refspec)
+      else:
+        self.fetch(refspec)
 
     # reset touches index.lock which is problematic when multiple processes are
     # accessing the recipes at the same time. To allieviate this, we do a quick
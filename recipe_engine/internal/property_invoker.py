@@ -4,6 +4,7 @@
 
 import inspect
 import sys
+import weakref
 
 from future.utils import iteritems
 
@@ -55,6 +56,28 @@ def _invoke_with_properties(callable_obj, all_props, environ, prop_defs,
   return callable_obj(*props, **additional_args)
 
 
+# Maps callables (RunSteps functions and RecipeApi classes) to their argument
+# names; see _arg_names. Weak, so that the callables (and with them the globals
+# of their recipe or module) can go away when their RecipeDeps is reloaded,
+# e.g. in warm test runners.
+_ARG_NAMES_CACHE = weakref.WeakKeyDictionary()
+
+
+def _arg_names(callable_obj):
+  """Returns the argument names of `callable_obj` as a tuple.
+
+  If `callable_obj` is a class, this returns the arguments of its __init__
+  method (minus 'self').
+  """
+  if sys.version_info.major == 3:
+    getargspec = inspect.getfullargspec
+  else:
+    getargspec = inspect.getargspec
+  if inspect.isclass(callable_obj):
+    return tuple(getargspec(callable_obj.__init__).args[1:])
+  return tuple(getargspec(callable_obj).args)
+
+
 def invoke_with_properties(callable_obj, all_props, environ, prop_defs,
                            **additional_args):
   """
@@ -78,19 +101,15 @@ def invoke_with_properties(callable_obj, all_props, environ, prop_defs,
     The result of calling callable with the filtered properties
     and additional arguments.
   """
-  if sys.version_info.major == 3:
-    getargspec = inspect.getfullargspec
-  else:
-    getargspec = inspect.getargspec
   # To detect when they didn't specify a property that they have as a
   # function argument, list the arguments, through inspection,
-  # and then comparing this list to the provided properties. We use a list
-  # instead of a dict because getargspec returns a list which we would have to
-  # convert to a dictionary, and the benefit of the dictionary is pretty small.
-  if inspect.isclass(callable_obj):
-    arg_names = getargspec(callable_obj.__init__).args
-    arg_names.pop(0)  # 'self'
-  else:
-    arg_names = getargspec(callable_obj).args
+  # and then comparing this list to the provided properties.
+  try:
+    arg_names = _ARG_NAMES_CACHE.get(callable_obj)
+    if arg_names is None:
+      arg_names = _ARG_NAMES_CACHE[callable_obj] = _arg_names(callable_obj)
+  except TypeError:
+    # Not weakly referenceable (e.g. a builtin).
+    arg_names = _arg_names(callable_obj)
   return _invoke_with_properties(callable_obj, all_props, environ, prop_defs,
                                  arg_names, **additional_args)
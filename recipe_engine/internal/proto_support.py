@@ -8,6 +8,8 @@ import ast
 import errno
 import hashlib
 import inspect
+import json
+import logging
 import os
 import posixpath
 import re
@@ -15,6 +17,11 @@ import shutil
 import sys
 import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
+
+from future.utils import iteritems, itervalues
+
+import gevent
 from gevent import subprocess
 
 import attr
@@ -23,12 +30,26 @@ import google.protobuf  # pinned in .vpython
 import google.protobuf.message
 from google.protobuf import descriptor_pb2
 
+from . import startup_profile
 from .attr_util import attr_type
 from .exceptions import BadProtoDefinitions
+from .recipe_index import is_racy
 
 
+LOG = logging.getLogger(__name__)
+
 PROTOC_VERSION = google.protobuf.__version__.encode('utf-8')
 
+# The name of the _DigestCache file, within the compiled proto package.
+_DIGEST_CACHE_FILE = 'src_digests.json'
+
+# Bump this to invalidate all existing _DigestCache files.
+_DIGEST_CACHE_VERSION = 1
+
+# The number of threads used to hash proto source files which aren't in the
+# _DigestCache.
+_HASH_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
 
 if sys.platform.startswith('win'):
   _BAT = '.bat'
@@ -68,7 +89,7 @@ class _SrcInfo(object):
   kind = attr.ib(validator=attr_type(str))
 
   @classmethod
-  def create(cls, repo, scan_relpath, dest_namespace, relpath):
+  def create(cls, repo, scan_relpath, dest_namespace, relpath, blobhash):
     """Creates a _SrcInfo.
 
     This will convert `relpath` into a global relpath for the output PB folder,
@@ -87,6 +108,7 @@ class _SrcInfo(object):
       * relpath (str) - The fwd-slash-delimited relative path from `repo.path`
         to where we found the proto. e.g.
         'scripts/slave/recipes/subdir/something.proto'.
+      * blobhash (str) - The git blob hash of the file (see _blobhash).
 
     Returns a fully populated _SrcInfo.
     """
@@ -105,31 +127,130 @@ class _SrcInfo(object):
         reserved = True
     dest_relpath = dest_namespace + subpath
 
-    src_abspath = os.path.normpath(os.path.join(repo.path, relpath))
-
-    # Compute the file's blobhash
-    csum = hashlib.sha1()
-    with open(src_abspath, 'rb') as src:
-      csum.update(
-          b'blob %d\0' % (os.fstat(src.fileno()).st_size,))
-      while True:
-        data = src.read(4 * 1024)
-        if not data:
-          break
-        csum.update(data)
-    blobhash = csum.hexdigest()
+    src_abspath = _src_abspath(repo, relpath)
 
     return cls(src_abspath, relpath, dest_relpath, reserved, blobhash,
                'proto' if src_abspath.endswith('.proto') else 'py')
 
 
-def _gather_src_info_from_repo(repo):
-  """Gathers all protos from the given repo.
+def _src_abspath(repo, relpath):
+  return os.path.normpath(os.path.join(repo.path, relpath))
+
+
+def _blobhash(src_abspath):
+  """Returns the git blob hash (hex) of the file at `src_abspath`."""
+  csum = hashlib.sha1()
+  with open(src_abspath, 'rb') as src:
+    csum.update(
+        b'blob %d\0' % (os.fstat(src.fileno()).st_size,))
+    while True:
+      data = src.read(64 * 1024)
+      if not data:
+        break
+      csum.update(data)
+  return csum.hexdigest()
+
+
+@attr.s
+class _DigestCache(object):
+  """Caches the blobhash of every proto source file, so that (re)computing the
+  overall digest of the protos on every engine startup only needs to stat them.
+
+  Entries are keyed on the file's absolute path, and are only valid while the
+  file's (mtime, size, inode) stay the same. This is stored next to the
+  compiled protos (see ensure_compiled).
+  """
+
+  # Absolute path to the cache file.
+  path = attr.ib(validator=attr_type(str))  # type: str
+
+  # src_abspath -> [mtime_ns, size, inode, blobhash]
+  _entries = attr.ib(factory=dict)
+
+  _dirty = attr.ib(default=False)
+
+  @classmethod
+  def load(cls, path):
+    """Loads the cache at `path`.
+
+    Returns an empty cache if `path` is missing or unreadable.
+    """
+    ret = cls(path)
+    try:
+      with open(path) as f:
+        data = json.load(f)
+      if data.get('version') == _DIGEST_CACHE_VERSION:
+        ret._entries = data['entries']
+    except (IOError, ValueError, KeyError, AttributeError):
+      pass
+    return ret
+
+  def blobhashes(self, src_abspaths):
+    """Returns the blobhash of all of `src_abspaths`.
+
+    Files which changed since they were cached (or were never cached) are
+    hashed in parallel. Entries for files not in `src_abspaths` are dropped.
+
+    Args:
+      * src_abspaths (List[str]) - The absolute paths of the source files.
+
+    Returns Dict[src_abspath: str, blobhash: str].
+    """
+    ret = {}
+    stats = {}
+    for path in src_abspaths:
+      st = os.stat(path)
+      stats[path] = key = [st.st_mtime_ns, st.st_size, st.st_ino]
+      entry = self._entries.get(path)
+      if entry is not None and entry[:3] == key:
+        ret[path] = entry[3]
+
+    misses = [path for path in src_abspaths if path not in ret]
+    if len(misses) > 1:
+      with ThreadPoolExecutor(_HASH_WORKERS) as pool:
+        ret.update(zip(misses, pool.map(_blobhash, misses)))
+    elif misses:
+      ret[misses[0]] = _blobhash(misses[0])
+
+    entries = {
+      path: stats[path] + [blobhash]
+      for path, blobhash in iteritems(ret)
+      # Don't cache files which could still change within the same mtime tick.
+      if not is_racy([stats[path]])
+    }
+    if entries != self._entries:
+      self._entries = entries
+      self._dirty = True
+    return ret
+
+  def save(self):
+    """Writes the cache to disk, if anything changed.
+
+    Failures are only logged; this is just a cache.
+    """
+    if not self._dirty:
+      return
+    tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+    try:
+      with open(tmp_path, 'w') as f:
+        json.dump({
+          'version': _DIGEST_CACHE_VERSION,
+          'entries': self._entries,
+        }, f)
+      os.replace(tmp_path, self.path)
+    except (IOError, OSError) as ex:
+      LOG.info('unable to write proto digest cache %r: %s', self.path, ex)
+    self._dirty = False
+
+
+def _find_srcs_in_repo(repo):
+  """Finds all protos in the given repo.
 
   Args:
     * repo (RecipeRepo) - The repo to gather all protos from.
 
-  Returns List[_SrcInfo]
+  Returns List[Tuple[scan_relpath, dest_namespace, relpath]], suitable for
+  _SrcInfo.create.
   """
   # Tuples of
   #   * fwd-slash path relative to repo.path of where to look for protos.
@@ -161,11 +282,10 @@ def _gather_src_info_from_repo(repo):
         fname = str(fname)  # fname can be unicode
         if not fname.endswith(('.proto', '.proto.py')):
           continue
-        ret.append(_SrcInfo.create(
-            repo, scan_relpath, dest_namespace, posixpath.join(relbase, fname)
-        ))
+        ret.append(
+            (scan_relpath, dest_namespace, posixpath.join(relbase, fname)))
 
-  return sorted(ret)
+  return ret
 
 
 # This is the version # of the proto generation algorithm, and is mixed into the
@@ -175,34 +295,109 @@ def _gather_src_info_from_repo(repo):
 RECIPE_PB_VERSION = b'4'
 
 
-def _gather_sources(deps):
+@attr.s(frozen=True)
+class _CompileUnit(object):
+  """The protos of a single repo, which are compiled (and cached) together.
+
+  Compiled units are cached in `{proto_package_path}/units/{digest}`, so that
+  changing the protos of one repo only recompiles the units whose digest
+  changed.
+  """
+  # The name of the repo the protos come from.
+  repo_name = attr.ib(validator=attr_type(str))
+
+  # The checksum (as hex) of everything the compiled unit depends on; see
+  # _unit_digests.
+  digest = attr.ib(validator=attr_type(str))
+
+  # The source abspath and dest_relpath of the unit's proto files (i.e. copy
+  # from source to $tmpdir/dest_relpath when constructing the to-be-compiled
+  # proto tree).
+  proto_files = attr.ib(validator=attr_type(tuple))
+
+  # The source abspath and dest_relpath of the unit's python files.
+  py_files = attr.ib(validator=attr_type(tuple))
+
+
+def _unit_digests(deps, all_srcs):
+  """Computes the digest of every repo's _CompileUnit.
+
+  The protos of a repo may import protos from any repo it (transitively)
+  depends on, so a unit's digest covers its own source files, as well as the
+  digests of the repos it depends on.
+
+  Args:
+    * deps (RecipeDeps) - The loaded recipe dependencies.
+    * all_srcs (Dict[repo_name: str, List[_SrcInfo]]) - The sorted source files
+      of every repo.
+
+  Returns Dict[repo_name: str, digest: str].
+  """
+  ret = {}
+
+  def _digest(repo_name):
+    if repo_name in ret:
+      return ret[repo_name] or ''
+    ret[repo_name] = None  # guards against dependency cycles
+
+    csum = hashlib.sha256(RECIPE_PB_VERSION)
+    csum.update(b'\0')
+    csum.update(PROTOC_VERSION)
+    csum.update(b'\0')
+    csum.update(repo_name.encode('utf-8'))
+    csum.update(b'\0\0')
+    for info in all_srcs.get(repo_name, ()):
+      for field in (info.relpath, info.dest_relpath, info.blobhash):
+        csum.update(field.encode('utf-8'))
+        csum.update(b'\0')
+
+    # Every repo can import the engine's protos.
+    dep_names = {'recipe_engine'} | set(deps.repos[repo_name].simple_cfg.deps)
+    dep_names.discard(repo_name)
+    for dep_name in sorted(dep_names.intersection(deps.repos)):
+      csum.update(b'\0')
+      csum.update(dep_name.encode('utf-8'))
+      csum.update(b'\0')
+      csum.update(_digest(dep_name).encode('utf-8'))
+
+    ret[repo_name] = csum.hexdigest()
+    return ret[repo_name]
+
+  for repo_name in deps.repos:
+    _digest(repo_name)
+  return ret
+
+
+def _gather_sources(deps, digest_cache):
   """Gathers all .proto and .proto.py files from all repos, and calculates their
   collective hash.
 
   Args:
     * deps (RecipeDeps) - The loaded recipe dependencies.
+    * digest_cache (_DigestCache) - The cache of the files' blobhashes.
 
-  Returns Tuple[
-    dgst: str,
-    proto_files: List[Tuple[str, str]],
-    py_files: List[Tuple[str, str]],
-  ]
+  Returns Tuple[dgst: str, units: List[_CompileUnit]]
     * dgst: The 'overall' checksum for all protos which we ought to to have
       installed (as hex)
-    * proto_files: a list of source abspath to dest_relpath for these proto
-      files (i.e. copy from source to $tmpdir/dest_relpath when constructing the
-      to-be-compiled proto tree).
-    * py_files: a list of source abspath to dest_relpath for these python
-      files (i.e. copy from source to $tmpdir/dest_relpath when constructing the
-      to-be-compiled proto tree).
+    * units: The protos of every repo which has any, see _CompileUnit.
 
   Raises BadProtoDefinitions if this finds conflicting or reserved protos.
   """
-  all_srcs = {}  # Dict[repo_name : str, List[_SrcInfo]]
+  # List[Tuple[RecipeRepo, scan_relpath, dest_namespace, relpath]]
+  found = []
   for repo in deps.repos.values():
-    src_info = _gather_src_info_from_repo(repo)
-    if src_info:
-      all_srcs[repo.name] = src_info
+    found.extend((repo,) + src for src in _find_srcs_in_repo(repo))
+
+  blobhashes = digest_cache.blobhashes([
+    _src_abspath(repo, relpath) for repo, _, _, relpath in found])
+
+  all_srcs = {}  # Dict[repo_name : str, List[_SrcInfo]]
+  for repo, scan_relpath, dest_namespace, relpath in found:
+    all_srcs.setdefault(repo.name, []).append(_SrcInfo.create(
+        repo, scan_relpath, dest_namespace, relpath,
+        blobhashes[_src_abspath(repo, relpath)]))
+  for src_infos in itervalues(all_srcs):
+    src_infos.sort()
 
   csum = hashlib.sha256(RECIPE_PB_VERSION)
   csum.update(b'\0')
@@ -212,8 +407,6 @@ def _gather_sources(deps):
   # dups has keys where len(rel_to_projs[dest_relpath]) > 1
   dups = set()       # type: Set[key: str]
   reserved = set()   # type: Set[key: str]
-  proto_files = []   # type: List[Tuple[src_abspath: str, dest_relpath: str]]
-  py_files = []      # type: List[Tuple[src_abspath: str, dest_relpath: str]]
   for repo_name, src_infos in sorted(all_srcs.items()):
     csum.update(repo_name.encode('utf-8'))
     csum.update(b'\0\0')
@@ -226,11 +419,6 @@ def _gather_sources(deps):
       if info.reserved:
         reserved.add(info.dest_relpath)
 
-      if info.kind == 'proto':
-        proto_files.append((info.src_abspath, info.dest_relpath))
-      else:
-        py_files.append((info.src_abspath, info.dest_relpath))
-
       csum.update(info.relpath.encode('utf-8'))
       csum.update(b'\0')
       csum.update(info.dest_relpath.encode('utf-8'))
@@ -257,7 +445,18 @@ def _gather_sources(deps):
 
     raise BadProtoDefinitions(msg)
 
-  return csum.hexdigest(), proto_files, py_files
+  unit_digests = _unit_digests(deps, all_srcs)
+  units = [
+    _CompileUnit(
+        repo_name, unit_digests[repo_name],
+        tuple((info.src_abspath, info.dest_relpath)
+              for info in src_infos if info.kind == 'proto'),
+        tuple((info.src_abspath, info.dest_relpath)
+              for info in src_infos if info.kind == 'py'))
+    for repo_name, src_infos in sorted(all_srcs.items())
+  ]
+
+  return csum.hexdigest(), units
 
 
 @attr.s
@@ -443,45 +642,56 @@ def _rel_to_abs_replacer(proto_files):
       lambda match: rel_to_abs[match.group(0)], to_replace)
 
 
-def _collect_protos(argfile_fd, proto_files, dest):
+def _collect_protos(proto_files, dest):
   """Copies all proto_files into dest.
 
-  Writes this list of files to `argfile_fd` which will be passed to protoc.
-
   Args:
-    * argfile_fd (int): An open writable file descriptor for the argfile.
     * proto_files (List[Tuple[src_abspath: str, dest_relpath: str]])
     * dest (str): Path to the directory where we should collect the .proto
     files.
+  """
+  _makedirs = _DirMaker()
+  for src_abspath, dest_relpath in proto_files:
+    destpath = os.path.join(dest, dest_relpath)
+    _makedirs(os.path.dirname(destpath))
+    shutil.copyfile(src_abspath, destpath)
+
+
+def _write_argfile(argfile_fd, proto_files):
+  """Writes the list of proto_files to `argfile_fd`, to be passed to protoc.
+
+  Args:
+    * argfile_fd (int): An open writable file descriptor for the argfile.
+    * proto_files (List[Tuple[src_abspath: str, dest_relpath: str]])
 
   Side-effects:
     * Each dest_relpath is written to `argfile_fd` on its own line.
     * Closes `argfile_fd`.
   """
   try:
-    _makedirs = _DirMaker()
-    for src_abspath, dest_relpath in proto_files:
-      destpath = os.path.join(dest, dest_relpath)
-      _makedirs(os.path.dirname(destpath))
-      shutil.copyfile(src_abspath, destpath)
+    for _, dest_relpath in proto_files:
       os.write(argfile_fd, dest_relpath.encode('utf-8'))
       os.write(argfile_fd, b'\n')
   finally:
     os.close(argfile_fd)  # for windows
 
 
-def _compile_protos(proto_files, proto_tree, protoc, argfile, dest):
+def _compile_protos(replacer, proto_tree, protoc, argfile, dest):
   """Runs protoc over the collected protos, renames them and rewrites their
   imports to make them import from `PB`.
 
   Args:
-    * proto_files (List[Tuple[src_abspath: str, dest_relpath: str]])
+    * replacer (func(str) -> str): The _rel_to_abs_replacer for all collected
+      proto files.
     * proto_tree (str): Path to the directory with all the collected .proto
       files.
     * protoc (str): Path to the protoc binary to use.
     * argfile (str): Path to a protoc argfile containing a relative path to
-      every .proto file in proto_tree on its own line.
+      every .proto file in proto_tree which should be compiled, on its own line.
     * dest (str): Path to the destination where the compiled protos should go.
+
+  Returns None if this was successful, or returns a string with an error message
+  if this failed.
   """
   protoc_proc = subprocess.Popen(
       [protoc, '--python_out', dest, '@'+argfile],
@@ -491,10 +701,8 @@ def _compile_protos(proto_files, proto_tree, protoc, argfile, dest):
 
 
   if protoc_proc.returncode != 0:
-    replacer = _rel_to_abs_replacer(proto_files)
-    print("Error while compiling protobufs. Output:\n", file=sys.stderr)
-    sys.stderr.write(replacer(output.decode('utf-8')))
-    sys.exit(1)
+    return 'Error while compiling protobufs. Output:\n\n%s' % (
+        replacer(output.decode('utf-8')),)
 
   rewrite_errors = []
   for base, _, fnames in os.walk(dest):
@@ -506,11 +714,9 @@ def _compile_protos(proto_files, proto_tree, protoc, argfile, dest):
       pass
 
   if rewrite_errors:
-    print("Error while rewriting generated protos. Output:\n", file=sys.stderr)
-    replacer = _rel_to_abs_replacer(proto_files)
-    for error in rewrite_errors:
-      print(replacer(error), file=sys.stderr)
-    sys.exit(1)
+    return 'Error while rewriting generated protos. Output:\n\n%s' % (
+        '\n'.join(replacer(error) for error in rewrite_errors),)
+  return None
 
 
 def _copy_py_files(py_files, dest):
@@ -525,60 +731,133 @@ def _copy_py_files(py_files, dest):
       converts.
     * dest (str): Path to the destination where the py files should go.
   """
+  _makedirs = _DirMaker()
   for src_abspath, dest_relpath in py_files:
     dirname, filename = os.path.split(dest_relpath)
+    dest_dirname = os.path.join(dest, dirname.replace('.', os.path.sep))
+    _makedirs(dest_dirname)
     shutil.copyfile(src_abspath, os.path.join(
-        dest,
-        dirname.replace('.', os.path.sep),
-        filename[:-len('.proto.py')]+'.py'))
+        dest_dirname, filename[:-len('.proto.py')]+'.py'))
+
+
+def _compile_unit(unit, replacer, proto_tree, protoc, tmp_base, units_dir):
+  """Compiles a _CompileUnit into `{units_dir}/{unit.digest}`.
+
+  Args:
+    * unit (_CompileUnit) - The unit to compile.
+    * replacer (func(str) -> str) - The _rel_to_abs_replacer for all collected
+      proto files.
+    * proto_tree (str) - Path to the directory with all the collected .proto
+      files (of all units).
+    * protoc (str) - Path to the protoc binary to use.
+    * tmp_base (str) - Path to the directory to use for temporary files.
+    * units_dir (str) - Path to the directory with all compiled units.
+
+  Returns None if this was successful, or returns a string with an error message
+  if this failed.
+  """
+  unit_temp = tempfile.mkdtemp(dir=tmp_base)
+  if unit.proto_files:
+    argfile_fd, argfile = tempfile.mkstemp(dir=tmp_base)
+    _write_argfile(argfile_fd, unit.proto_files)
+    err = _compile_protos(replacer, proto_tree, protoc, argfile, unit_temp)
+    if err:
+      return err
+  _copy_py_files(unit.py_files, unit_temp)
+
+  try:
+    os.rename(unit_temp, os.path.join(units_dir, unit.digest))
+  except OSError:
+    # Another engine may have compiled the same unit at the same time as us.
+    if not os.path.isdir(os.path.join(units_dir, unit.digest)):
+      raise
+  return None
 
 
-def _install_protos(proto_package_path, dgst, proto_files, py_files):
+def _merge_tree(src, dest):
+  """Copies all files in the `src` tree into the `dest` tree."""
+  _makedirs = _DirMaker()
+  for base, _, fnames in os.walk(src):
+    dest_base = os.path.join(dest, os.path.relpath(base, src))
+    _makedirs(dest_base)
+    for name in fnames:
+      shutil.copyfile(os.path.join(base, name), os.path.join(dest_base, name))
+
+
+def _install_protos(proto_package_path, dgst, units):
   """Installs protos to `{proto_package_path}/PB`.
 
+  Only the units which aren't already compiled in `{proto_package_path}/units`
+  are compiled (in parallel); PB is then assembled from the compiled units.
+
   Args:
     * proto_package_path (str) - The absolute path to the folder where:
       * We should install protoc as '.../protoc/...'
+      * We should cache the compiled units as '.../units/...'
       * We should install the compiled proto files as '.../PB/...'
       * We should use '.../tmp/...' as a tempdir.
     * dgst (str) - The hexadecimal (lowercase) checksum for the protos we're
       about to install.
-    * proto_files (List[Tuple[src_abspath: str, dest_relpath: str]])
+    * units (List[_CompileUnit]) - The protos to install.
 
   Side-effects:
     * Ensures that `{proto_package_path}/PB` exists and is the correct
       version (checksum).
     * Ensures that `{proto_package_path}/protoc` contains the correct
-      `protoc` compiler from CIPD.
+      `protoc` compiler from CIPD, if anything needs to be compiled.
+    * Removes units from `{proto_package_path}/units` which are not in `units`.
   """
-  cipd_proc = subprocess.Popen([
-    'cipd'+_BAT, 'ensure', '-root', os.path.join(proto_package_path, 'protoc'),
-    '-ensure-file', '-'], stdin=subprocess.PIPE)
-  protoc_version = PROTOC_VERSION.split(b'.', 1)[1]
-  cipd_proc.communicate(b'infra/3pp/tools/protoc/${platform} version:2@' +
-                        protoc_version)
-  if cipd_proc.returncode != 0:
-    raise ValueError(
-        'failed to install protoc: retcode %d' % cipd_proc.returncode)
-
   # This tmp folder is where all the temporary garbage goes. Future recipe
   # engine invocations will attempt to clean this up as long as PB is
   # up-to-date.
   tmp_base = os.path.join(proto_package_path, 'tmp')
-
-  # proto_tree holds a tree of all the collected .proto files, to be passed to
-  # `protoc`
-  # pb_temp is the destination of all the generated files; it will be renamed to
-  # `{proto_package_path}/dest` as the final step of the installation.
+  units_dir = os.path.join(proto_package_path, 'units')
   _DirMaker()(tmp_base)
-  proto_tree = tempfile.mkdtemp(dir=tmp_base)
-  pb_temp = tempfile.mkdtemp(dir=tmp_base)
-  argfile_fd, argfile = tempfile.mkstemp(dir=tmp_base)
-  _collect_protos(argfile_fd, proto_files, proto_tree)
+  _DirMaker()(units_dir)
 
-  protoc = os.path.join(proto_package_path, 'protoc', 'bin', 'protoc')
-  _compile_protos(proto_files, proto_tree, protoc, argfile, pb_temp)
-  _copy_py_files(py_files, pb_temp)
+  to_compile = [
+    unit for unit in units
+    if not os.path.isdir(os.path.join(units_dir, unit.digest))
+  ]
+  if to_compile:
+    cipd_proc = subprocess.Popen([
+      'cipd'+_BAT, 'ensure', '-root',
+      os.path.join(proto_package_path, 'protoc'), '-ensure-file', '-'],
+      stdin=subprocess.PIPE)
+    protoc_version = PROTOC_VERSION.split(b'.', 1)[1]
+    cipd_proc.communicate(b'infra/3pp/tools/protoc/${platform} version:2@' +
+                          protoc_version)
+    if cipd_proc.returncode != 0:
+      raise ValueError(
+          'failed to install protoc: retcode %d' % cipd_proc.returncode)
+
+    # proto_tree holds a tree of all the collected .proto files (of all units,
+    # since they may import each other), to be passed to `protoc`.
+    all_proto_files = [pf for unit in units for pf in unit.proto_files]
+    proto_tree = tempfile.mkdtemp(dir=tmp_base)
+    _collect_protos(all_proto_files, proto_tree)
+
+    protoc = os.path.join(proto_package_path, 'protoc', 'bin', 'protoc')
+    replacer = _rel_to_abs_replacer(all_proto_files)
+    workers = [
+      gevent.spawn(_compile_unit, unit, replacer, proto_tree, protoc,
+                   tmp_base, units_dir)
+      for unit in to_compile
+    ]
+    gevent.joinall(workers, raise_error=True)
+    errors = [worker.value for worker in workers if worker.value]
+    if errors:
+      for err in errors:
+        print(err, file=sys.stderr)
+      sys.exit(1)
+
+  # pb_temp is the destination of all the compiled units; it will be renamed to
+  # `{proto_package_path}/PB` as the final step of the installation.
+  pb_temp = tempfile.mkdtemp(dir=tmp_base)
+  for unit in units:
+    _merge_tree(os.path.join(units_dir, unit.digest), pb_temp)
+  with open(os.path.join(pb_temp, '__init__.py'), 'wb'):
+    pass
   with open(os.path.join(pb_temp, 'csum'), 'w') as csum_f:
     csum_f.write(dgst)
 
@@ -590,6 +869,13 @@ def _install_protos(proto_package_path, dgst, proto_files, py_files):
     _try_rename(dest, os.path.join(old, 'PB'))
     _try_rename(pb_temp, dest)
 
+  # Move stale units into tmp, which is removed once PB is up-to-date.
+  current = set(unit.digest for unit in units)
+  for name in os.listdir(units_dir):
+    if name not in current:
+      _try_rename(os.path.join(units_dir, name),
+                  os.path.join(tempfile.mkdtemp(dir=tmp_base), name))
+
 
 def _check_digest(proto_package, dgst):
   """Checks protos installed in `{proto_package_path}/PB`.
@@ -633,13 +919,18 @@ def ensure_compiled(deps, proto_override):
     proto_package = os.path.join(deps.recipe_deps_path, '_pb3')
     _DirMaker()(proto_package)
 
-    dgst, proto_files, py_files = _gather_sources(deps)
+    digest_cache = _DigestCache.load(
+        os.path.join(proto_package, _DIGEST_CACHE_FILE))
+    with startup_profile.phase('proto digest'):
+      dgst, units = _gather_sources(deps, digest_cache)
+      digest_cache.save()
 
     # If the digest already matches, we're done
     if not _check_digest(proto_package, dgst):
       # Otherwise, try to compile
       try:
-        _install_protos(proto_package, dgst, proto_files, py_files)
+        with startup_profile.phase('proto compile'):
+          _install_protos(proto_package, dgst, units)
       except:  # pylint: disable=bare-except
         # If some other recipe engine compiled at the same time as us, it may
         # have broken our compilation (e.g. if the other engine cleared tmp out
@@ -664,9 +955,14 @@ def ensure_compiled(deps, proto_override):
 def append_to_syspath(proto_package):
   """Append proto package to sys.path.
 
+  This is a no-op if `proto_package` is already on sys.path (e.g. when
+  a long-lived process reloads its RecipeDeps).
+
   Raises an AssertionError if another package with the same basename is already
   on sys.path.
   """
+  if proto_package in sys.path:
+    return
   for path in sys.path:
     assert os.path.basename(proto_package) != os.path.basename(path)
   sys.path.append(proto_package)
@@ -33,6 +33,7 @@ respectively).
 All DEPS evaluation is also handled in this file.
 """
 
+import functools
 import importlib
 import logging
 import os
@@ -44,6 +45,8 @@ from collections import namedtuple
 from future.utils import iteritems, itervalues, raise_
 
 import attr
+import gevent.event
+import gevent.pool
 
 from attr.validators import optional
 
@@ -58,12 +61,15 @@ from ..util import RecipeAbort
 
 from . import fetch
 from . import proto_support
+from . import startup_profile
+from . import static_symbols
 
-from .attr_util import attr_type, attr_value_is, attr_superclass, attr_dict_type
+from .attr_util import attr_type, attr_value_is, attr_dict_type
 from .class_util import cached_property
 from .exceptions import CyclicalDependencyError, UnknownRecipe, UnknownRepoName
 from .exceptions import RecipeLoadError, RecipeSyntaxError, MalformedRecipeError
-from .exceptions import UnknownRecipeModule
+from .exceptions import GitFetchError, UnknownRecipeModule
+from .recipe_index import RecipeIndex, stat_key
 from .simple_cfg import SimpleRecipesCfg, RECIPES_CFG_LOCATION_REL
 from .test.test_util import filesystem_safe
 from .warn.definition import (parse_warning_definitions,
@@ -75,6 +81,40 @@ LOG = logging.getLogger(__name__)
 # Subdirectories of a recipe module that may contain recipes.
 MODULE_RECIPE_SUBDIRS = ('tests', 'examples', 'run')
 
+# The default maximum number of dependency repos to check out concurrently.
+DEFAULT_FETCH_JOBS = 8
+
+
+def _checkout_all(backends, deps, jobs):
+  """Checks out dependency repos concurrently.
+
+  Every checkout runs to completion, even if some of them fail.
+
+  Args:
+    * backends (Dict[str, GitBackend]) - The backend for each repo to check out.
+    * deps (Dict[str, DepSpec]) - The recipes.cfg entry for each repo.
+    * jobs (int) - The maximum number of repos to check out concurrently.
+
+  Raises GitFetchError describing every failed checkout, if any failed.
+  """
+  def _checkout(repo_name):
+    """Returns the exception raised by the checkout, if any."""
+    dep = deps[repo_name]
+    try:
+      with startup_profile.phase('checkout %s' % (repo_name,)):
+        backends[repo_name].checkout(dep.branch, dep.revision)
+    except Exception as ex:  # pylint: disable=broad-except
+      return ex
+    return None
+
+  pool = gevent.pool.Pool(max(1, jobs))
+  results = zip(sorted(backends), pool.map(_checkout, sorted(backends)))
+  failures = [(repo_name, ex) for repo_name, ex in results if ex is not None]
+  if failures:
+    raise GitFetchError('failed to check out %s:\n%s' % (
+        ', '.join(repr(repo_name) for repo_name, _ in failures),
+        '\n'.join('  %s: %s' % (repo_name, ex) for repo_name, ex in failures)))
+
 
 @attr.s(frozen=True)
 class RecipeDeps(object):
@@ -102,6 +142,12 @@ class RecipeDeps(object):
   # This repo is guaranteed to be a member of `repos`.
   main_repo_id = attr.ib(validator=attr_type(str))  # type: str
 
+  # The persistent index of the contents of `repos`, if any. It's a cache, so
+  # it doesn't take part in comparisons.
+  index = attr.ib(
+      default=None, eq=False,
+      validator=optional(attr_type(RecipeIndex)))  # type: RecipeIndex
+
   def __attrs_post_init__(self):
     def _raise_unknown_rname(repo_name):
       raise UnknownRepoName(
@@ -124,6 +170,16 @@ class RecipeDeps(object):
     """Returns the location of the .previous_failures file."""
     return os.path.join(self.recipe_deps_path, '.previous_test_failures')
 
+  @cached_property
+  def test_durations_path(self):
+    """Returns the location of the .test_durations file."""
+    return os.path.join(self.recipe_deps_path, '.test_durations')
+
+  @cached_property
+  def test_result_cache_path(self):
+    """Returns the location of the .test_result_cache file."""
+    return os.path.join(self.recipe_deps_path, '.test_result_cache')
+
   @cached_property
   def warning_definitions(self):
     """Returns warning definitions for all repos in this RecipeDeps.
@@ -136,8 +192,15 @@ class RecipeDeps(object):
         for warning_name, definition in iteritems(repo.warning_definitions)
     }
 
+  def save_index(self):
+    """Writes anything added to the persistent index (e.g. the DEPS evaluated
+    since loading) to disk."""
+    if self.index:
+      self.index.save()
+
   @classmethod
-  def create(cls, main_repo_path, overrides, proto_override, minimal_protoc=False):
+  def create(cls, main_repo_path, overrides, proto_override, minimal_protoc=False,
+             fetch_jobs=DEFAULT_FETCH_JOBS):
     """Creates a RecipeDeps.
 
     This will possibly do network operations to fetch recipe repos from git if
@@ -155,6 +218,8 @@ class RecipeDeps(object):
       * minimal_protoc (bool) - If True, skips all proto compiliation. This is used
         for subcommands (like manual_roll) where we don't need this, and it can
         actively interfere with the subcommand's functionality.
+      * fetch_jobs (int) - The maximum number of dependency repos to check out
+        concurrently.
 
     Returns a RecipeDeps.
     """
@@ -167,9 +232,16 @@ class RecipeDeps(object):
         'attempted to override %r, which do not appear in recipes.cfg' %
         (extra,))
 
+    recipe_deps_path = os.path.join(
+      main_repo_path,
+      simple_cfg.recipes_path,
+      '.recipe_deps'
+    )
+
     # A bit hacky; RecipeRepo objects have a backreference to the RecipeDeps, so
     # we have to create it first.
-    ret = cls({}, simple_cfg.repo_name)
+    ret = cls({}, simple_cfg.repo_name, RecipeIndex.load(
+        os.path.join(recipe_deps_path, '.recipe_index')))
 
     # Check that our repo doesn't depend on itself.
     if ret.main_repo_id in simple_cfg.deps:
@@ -189,20 +261,21 @@ class RecipeDeps(object):
         backend = fetch.GitBackend(path, None)
       repos[project_id] = RecipeRepo.create(ret, path, backend=backend)
 
-    recipe_deps_path = os.path.join(
-      main_repo_path,
-      simple_cfg.recipes_path,
-      '.recipe_deps'
-    )
-    for repo_name, dep in iteritems(simple_cfg.deps):
-      if repo_name in repos:
-        continue
-
-      dep_path = os.path.join(recipe_deps_path, repo_name)
-      backend = fetch.GitBackend(dep_path, dep.url)
-      backend.checkout(dep.branch, dep.revision)
-      repos[repo_name] = RecipeRepo.create(ret, dep_path, backend=backend)
-
+    git_cache = fetch.git_cache_from_env()
+    to_fetch = {
+      repo_name: fetch.GitBackend(
+          os.path.join(recipe_deps_path, repo_name), dep.url, git_cache)
+      for repo_name, dep in iteritems(simple_cfg.deps)
+      if repo_name not in repos
+    }
+    _checkout_all(to_fetch, simple_cfg.deps, fetch_jobs)
+    for repo_name, backend in sorted(iteritems(to_fetch)):
+      repos[repo_name] = RecipeRepo.create(
+          ret, backend.checkout_dir, backend=backend)
+
+    # Only validate the dependencies once everything is checked out, so that
+    # errors here aren't masked by (or interleaved with) fetch failures.
+    for repo_name in sorted(to_fetch):
       # Assert that any dependencies of `repo_name` are included (by name) in
       # our own simple_cfg. Otherwise the transitive dependency set is not
       # specified here, which is an error.
@@ -228,6 +301,8 @@ class RecipeDeps(object):
     repos.on_missing = ret.repos.on_missing
     object.__setattr__(ret, 'repos', repos)
 
+    ret.index.save()
+
     protoc_deps = ret
     if minimal_protoc:
       protoc_deps = RecipeDeps(
@@ -235,8 +310,9 @@ class RecipeDeps(object):
           'recipe_engine',
       )
 
-    proto_support.append_to_syspath(
-        proto_support.ensure_compiled(protoc_deps, proto_override))
+    with startup_profile.phase('protos'):
+      proto_support.append_to_syspath(
+          proto_support.ensure_compiled(protoc_deps, proto_override))
 
     return ret
 
@@ -369,15 +445,14 @@ class RecipeRepo(object):
     Includes even unused expectation files that don't have an associated
     test case or recipe.
     """
-
-    # This can be replaced by glob.glob(..., recursive=True) in Python 3.
     def find_expectations(directory, pattern):
       regex = re.compile(pattern)
-      for path, dirs, files in os.walk(
-          os.path.abspath(directory), topdown=True):
-        dirs[:] = [d for d in dirs if not d.endswith('.resources')]
-        for basename in files:
-          abspath = os.path.join(path, basename)
+      prefix = directory + os.path.sep
+      for exp_dir, fnames in iteritems(self._inventory['expected']):
+        if not exp_dir.startswith(prefix):
+          continue
+        for basename in fnames:
+          abspath = os.path.join(exp_dir, basename)
           relpath = os.path.relpath(abspath, directory)
           if regex.match(relpath):
             yield abspath
@@ -402,6 +477,12 @@ class RecipeRepo(object):
             ])))
     return paths
 
+  @property
+  def has_pyc(self):
+    """Returns True if any .pyc files were found under this repo's recipes and
+    recipe modules directories when it was loaded."""
+    return self._inventory['has_pyc']
+
   @classmethod
   def create(cls, recipe_deps, path, backend=None, simple_cfg=None):
     """Creates a RecipeRepo.
@@ -425,27 +506,24 @@ class RecipeRepo(object):
     # RecipeRepo, so we have to create it first.
     ret = cls(recipe_deps, path, simple_cfg, {}, {}, backend)
 
+    scan = lambda: _scan_repo(ret.recipes_dir, ret.modules_dir)
+    if recipe_deps.index:
+      inventory = recipe_deps.index.get_repo(ret.recipes_root_path, scan)
+    else:
+      inventory = scan()[1]
+    # object.__setattr__ is needed to get around attrs' frozen attributes.
+    object.__setattr__(ret, '_inventory', inventory)
+
     modules = {}
     recipes = {}
 
-    if not os.path.exists(ret.modules_dir):
-      LOG.info('ignoring %r: does not exist', ret.modules_dir)
-    elif not os.path.isdir(ret.modules_dir):
-      LOG.warn('ignoring %r: not a directory', ret.modules_dir)
-    else:
-      for entry_name in os.listdir(ret.modules_dir):
-        possible_mod_path = os.path.join(ret.modules_dir, entry_name)
-        if not os.path.isdir(possible_mod_path):
-          LOG.info('ignoring %r: not a directory', possible_mod_path)
-        elif os.path.isfile(os.path.join(possible_mod_path, '__init__.py')):
-          mod = RecipeModule.create(ret, entry_name)
-          modules[entry_name] = mod
-          for recipe in itervalues(mod.recipes):
-            recipes[recipe.name] = recipe
-        else:
-          LOG.warn('ignoring %r: missing __init__.py', possible_mod_path)
-
-    for recipe_name in _scan_recipe_directory(ret.recipes_dir):
+    for module_name, module_recipes in iteritems(inventory['modules']):
+      mod = RecipeModule.create(ret, module_name, module_recipes)
+      modules[module_name] = mod
+      for recipe in itervalues(mod.recipes):
+        recipes[recipe.name] = recipe
+
+    for recipe_name in inventory['recipes']:
       recipes[recipe_name] = Recipe(
         ret,
         recipe_name,
@@ -512,9 +590,11 @@ class RecipeModule(object):
 
        {"local_name": ("repo_name", "module_name")}
 
-    This imports the module code.
+    This only imports the module code if its DEPS aren't a simple literal.
     """
-    return parse_deps_spec(self.repo.name, self.do_import().DEPS)
+    return _get_normalized_DEPS(
+        self.repo, os.path.join(self.path, '__init__.py'),
+        lambda: self.do_import().DEPS)
 
   @cached_property
   def transitive_DEPS(self):
@@ -526,6 +606,15 @@ class RecipeModule(object):
       ret.update(d.repos[repo_name].modules[module_name].transitive_DEPS)
     return frozenset(ret)
 
+  @cached_property
+  def _loader(self):
+    """The _ModuleLoader for this module.
+
+    This is computed at most once per process, and shared by all recipes (and
+    test cases) which depend on this module.
+    """
+    return _ModuleLoader.create(self)
+
   @cached_property
   def warnings(self):
     """Returns a tuple of warnings issued against this recipe module."""
@@ -571,12 +660,14 @@ class RecipeModule(object):
   effective_python_compatibility = 'PY3'
 
   @classmethod
-  def create(cls, repo, name):
+  def create(cls, repo, name, recipe_names):
     """Creates a RecipeModule.
 
     Args:
       * repo (RecipeRepo) - The recipe repo to which this module belongs.
       * name (str) - The name of this recipe module.
+      * recipe_names (List[str]) - The module-scoped names (e.g.
+        `examples/full`) of the recipes in this module.
 
     Returns a RecipeModule.
     """
@@ -586,15 +677,11 @@ class RecipeModule(object):
 
     recipes = {}
 
-    for subdir_name in MODULE_RECIPE_SUBDIRS:
-      subdir = os.path.join(ret.path, subdir_name)
-      if os.path.isdir(subdir):
-        for recipe_name in _scan_recipe_directory(subdir):
-          mod_scoped_name = '%s/%s' % (subdir_name, recipe_name)
-          recipes[mod_scoped_name] = Recipe(
-            repo,
-            '%s:%s' % (name, mod_scoped_name),
-            ret)
+    for mod_scoped_name in recipe_names:
+      recipes[mod_scoped_name] = Recipe(
+        repo,
+        '%s:%s' % (name, mod_scoped_name),
+        ret)
 
     # This makes `recipes` unmodifiable. object.__setattr__ is needed to get
     # around attrs' frozen attributes.
@@ -660,16 +747,10 @@ class Recipe(object):
 
     Returns a set of absolute paths to all discovered expectation files.
     """
-    ret = set()
-
-    if os.path.isdir(self.expectation_dir):
-      ret.update([
+    return set(
         os.path.join(self.expectation_dir, fname)
-        for fname in os.listdir(self.expectation_dir)
-        if fname.endswith('.json')
-      ])
-
-    return ret
+        for fname in self.repo._inventory['expected'].get(
+            self.expectation_dir, ()))
 
   @cached_property
   def coverage_patterns(self):
@@ -765,7 +846,7 @@ class Recipe(object):
     """
     api = RecipeTestApi(module=None)
     resolved_deps = _resolve(
-      self.repo.recipe_deps, self.normalized_DEPS, 'TEST_API', None, None)
+      self.normalized_DEPS, self._load_order, 'TEST_API', None, None)
     api.__dict__.update({
       local_name: resolved_dep
       for local_name, resolved_dep in iteritems(resolved_deps)
@@ -785,9 +866,11 @@ class Recipe(object):
 
        {"local_name": ("repo_name", "module_name")}
 
-    This reads the recipe code.
+    This reads the recipe code, but only executes it if its DEPS aren't a
+    simple literal.
     """
-    return parse_deps_spec(self.repo.name, self.global_symbols.get('DEPS', ()))
+    return _get_normalized_DEPS(
+        self.repo, self.path, lambda: self.global_symbols.get('DEPS', ()))
 
   @cached_property
   def transitive_DEPS(self):
@@ -799,6 +882,17 @@ class Recipe(object):
       ret.update(d.repos[repo_name].modules[module_name].transitive_DEPS)
     return frozenset(ret)
 
+  @cached_property
+  def _load_order(self):
+    """The _ModuleLoader of every module which needs to be instantiated to run
+    this recipe, in instantiation order (see _load_order)."""
+    return _load_order(self.repo.recipe_deps, self.normalized_DEPS)
+
+  @cached_property
+  def _import_warnings(self):
+    """The import warnings (see _collect_import_warnings) of this recipe."""
+    return tuple(_collect_import_warnings(self))
+
   def mk_api(self, engine, test_data=None):
     """Makes a RecipeScriptApi, suitable for use with run_steps.
 
@@ -826,14 +920,11 @@ class Recipe(object):
       module=fakeModule,
       test_data=test_data.get_module_test_data(None))
     resolved_deps = _resolve(
-      self.repo.recipe_deps, self.normalized_DEPS, 'API', engine, test_data)
-    for _, (warning, importer) in enumerate(_collect_import_warnings(self)):
+      self.normalized_DEPS, self._load_order, 'API', engine, test_data,
+      lazy=self.repo.recipes_cfg_pb2.lazy_module_init)
+    for warning, importer in self._import_warnings:
       engine.record_import_warning(warning, importer)
-    api.__dict__.update({
-      local_name: resolved_dep
-      for local_name, resolved_dep in iteritems(resolved_deps)
-      if resolved_dep is not None
-    })
+    _inject_deps(api, resolved_deps)
     return api
 
   def run_steps(self, api, engine):
@@ -888,18 +979,100 @@ class Recipe(object):
     return recipe_result
 
 
-def _scan_recipe_directory(path):
-  """Internal helper to yield recipe names for all recipe files under a path."""
-  for root, dirs, files in os.walk(path):
-    dirs[:] = [x for x in dirs
-               if not x.endswith(('.expected', '.resources'))]
-    for file_name in files:
-      if not file_name.endswith('.py'):
+def _scan_repo(recipes_dir, modules_dir):
+  """Internal helper to find all recipes, recipe modules and expectation files
+  of a repo.
+
+  Returns (dirs, inventory), where `dirs` maps the absolute path of every
+  directory which was looked at to its stat_key, and `inventory` is a dict of:
+    * 'modules' - {module name: [module-scoped recipe names]}
+    * 'recipes' - [names of the recipes in `recipes_dir`]
+    * 'expected' - {absolute path of a '*.expected' directory: [names of the
+      .json files in it]}, excluding any under '*.resources' directories.
+    * 'has_pyc' - True if any .pyc files were found.
+  """
+  dirs = {}
+  inventory = {'modules': {}, 'recipes': [], 'expected': {}, 'has_pyc': False}
+
+  def _scan_tree(root):
+    """Yields (path components relative to `root`, recipe name) for all
+    recipe files under `root`."""
+    for base, _, fnames in os.walk(root):
+      dirs[base] = stat_key(base)
+      rel_toks = []
+      if base != root:
+        rel_toks = base[len(root)+1:].split(os.path.sep)
+      if not inventory['has_pyc']:
+        inventory['has_pyc'] = any(f.endswith('.pyc') for f in fnames)
+      if any(tok.endswith('.resources') for tok in rel_toks):
+        continue
+      if base.endswith('.expected'):
+        inventory['expected'][base] = sorted(
+            f for f in fnames if f.endswith('.json'))
+      if any(tok.endswith('.expected') for tok in rel_toks):
+        continue
+      for file_name in fnames:
+        if file_name.endswith('.py'):
+          yield rel_toks, '/'.join(rel_toks + [file_name[:-len('.py')]])
+
+  dirs[modules_dir] = stat_key(modules_dir)
+  if dirs[modules_dir] is None:
+    LOG.info('ignoring %r: does not exist', modules_dir)
+  elif not os.path.isdir(modules_dir):
+    LOG.warn('ignoring %r: not a directory', modules_dir)
+  else:
+    for entry_name in os.listdir(modules_dir):
+      possible_mod_path = os.path.join(modules_dir, entry_name)
+      if not os.path.isdir(possible_mod_path):
+        LOG.info('ignoring %r: not a directory', possible_mod_path)
         continue
-      file_path = os.path.join(root, file_name)
-      # raw_recipe_name has native path separators (e.g. '\\' on windows)
-      raw_recipe_name = file_path[len(path)+1:-len('.py')]
-      yield raw_recipe_name.replace(os.path.sep, '/')
+      recipes = [
+        recipe_name
+        for rel_toks, recipe_name in _scan_tree(possible_mod_path)
+        if rel_toks and rel_toks[0] in MODULE_RECIPE_SUBDIRS
+      ]
+      if os.path.isfile(os.path.join(possible_mod_path, '__init__.py')):
+        inventory['modules'][entry_name] = recipes
+      else:
+        LOG.warn('ignoring %r: missing __init__.py', possible_mod_path)
+
+  dirs[recipes_dir] = stat_key(recipes_dir)
+  inventory['recipes'].extend(
+      recipe_name for _, recipe_name in _scan_tree(recipes_dir))
+
+  return dirs, inventory
+
+
+def _get_normalized_DEPS(repo, path, get_deps_spec):
+  """Returns the normalized DEPS of a recipe or recipe module.
+
+  Args:
+    * repo (RecipeRepo) - The repo containing the recipe or module.
+    * path (str) - The path of the file defining the DEPS.
+    * get_deps_spec (func() -> deps spec) - Evaluates the DEPS.
+
+  The DEPS are read from the AST of `path` if possible, and only evaluated
+  (executing the code) otherwise. The RecipeDeps' index, if any, is used to
+  avoid doing either.
+  """
+  def compute():
+    # Avoid executing the code if DEPS is a simple literal.
+    deps_spec = static_symbols.NOT_LITERAL
+    mod_ast = static_symbols.parse_file(path)
+    if mod_ast is not None:
+      deps_spec = static_symbols.literal_symbol(mod_ast, 'DEPS', ())
+    if deps_spec is static_symbols.NOT_LITERAL:
+      deps_spec = get_deps_spec()
+    return parse_deps_spec(repo.name, deps_spec)
+
+  index = repo.recipe_deps.index
+  if not index:
+    return compute()
+  deps = index.get_file_data(path, ['DEPS', repo.name], lambda: {
+    local_name: list(dep)
+    for local_name, dep in iteritems(compute())
+  })
+  return {local_name: tuple(dep) for local_name, dep in iteritems(deps)}
 
 
 def parse_deps_spec(repo_name, deps_spec):
@@ -997,8 +1170,7 @@ def _instantiate_test_api(imported_module, resolved_deps):
   return inst
 
 
-def _instantiate_api(engine, test_data, fqname, imported_module, test_api,
-                     resolved_deps):
+def _instantiate_api(engine, test_data, loader, test_api, resolved_deps):
   """Instantiates the RecipeApiPlain subclass from the given imported recipe
   module.
 
@@ -1006,19 +1178,18 @@ def _instantiate_api(engine, test_data, fqname, imported_module, test_api,
     * engine (run.RecipeEngine) - The recipe engine we're going to use to run
       the recipe.
     * test_data (TestData) - The test data for this run.
-    * fqname (string) - The fully qualified 'repo_name/module_name' of the
-      module we're instantiating.
-    * imported_module (raw imported python module) - The result of calling
-      RecipeRepo.import_recipe_module().
+    * loader (_ModuleLoader) - The loader of the module we're instantiating.
     * test_api (RecipeTestApi) - The instantiated recipe test api object for
       this module.
-    * resolved_deps ({local_name: None|instantiated recipe api}) - The resolved
-      RecipeApiPlain instances which this module has in its DEPS. Deps whose
-      value is None will be omitted. These deps will all be populated on
-      `retval.m` (the ModuleInjectionSite).
+    * resolved_deps ({local_name: None|_LazyApi|instantiated recipe api}) - The
+      resolved RecipeApiPlain instances which this module has in its DEPS.
+      These deps will all be populated on `retval.m` (the ModuleInjectionSite),
+      see _inject_deps.
 
   Returns the instantiated RecipeApiPlain subclass.
   """
+  fqname = loader.fqname
+  imported_module = loader.imported_module
   kwargs = {
     'module': imported_module,
     # TODO(luqui): test_data will need to use canonical unique names.
@@ -1073,35 +1244,168 @@ def _instantiate_api(engine, test_data, fqname, imported_module, test_api,
     inst = invoke_with_properties(imported_module.API, engine.properties,
                                   engine.environ, properties_def, **kwargs)
 
+  assert isinstance(inst, RecipeApiPlain)
   inst.test_api = test_api
 
-  inst.m.__dict__.update(resolved_deps)
+  _inject_deps(inst.m, resolved_deps)
   setattr(inst.m, imported_module.NAME, inst)
 
   # Replace class-level Requirements placeholders in the recipe API with
   # their instance-level real values.
-  for k, v in iteritems(imported_module.API.__dict__):
-    if isinstance(v, _UnresolvedRequirement):
-      setattr(inst, k, engine.resolve_requirement(v))
+  for k, v in loader.requirements:
+    setattr(inst, k, engine.resolve_requirement(v))
 
   inst.initialize()
   return inst
 
 
-def _resolve(recipe_deps, deps_spec, variant, engine, test_data):
-  """Resolves a deps_spec to a map of {local_name: api instance}
+@attr.s(frozen=True)
+class _ModuleLoader(object):
+  """Holds everything needed to instantiate the API classes of a recipe module
+  which doesn't depend on the run (i.e. on the engine or test data).
+
+  See RecipeModule._loader.
+  """
+  # The (repo_name, module_name) of the module.
+  key = attr.ib(validator=attr_type(tuple))
+
+  # The fully qualified 'repo_name/module_name' of the module.
+  fqname = attr.ib(validator=attr_type(str))
+
+  # The result of calling RecipeModule.do_import().
+  imported_module = attr.ib()
+
+  # The (local_name, (repo_name, module_name)) of the module's DEPS.
+  deps = attr.ib(validator=attr_type(tuple))
+
+  # The (attribute name, _UnresolvedRequirement) of the class-level
+  # Requirements placeholders in the module's RecipeApi class.
+  requirements = attr.ib(validator=attr_type(tuple))
+
+  # True if the module sets EAGER_INIT.
+  eager = attr.ib(validator=attr_type(bool))
+
+  @classmethod
+  def create(cls, module):
+    """Creates a _ModuleLoader for a RecipeModule.
+
+    Args:
+      * module (RecipeModule) - The module to load.
+
+    Returns a _ModuleLoader.
+    """
+    imported_module = module.do_import()
+    return cls(
+      (module.repo.name, module.name),
+      module.full_name,
+      imported_module,
+      tuple(iteritems(module.normalized_DEPS)),
+      tuple(
+        (k, v) for k, v in iteritems(imported_module.API.__dict__)
+        if isinstance(v, _UnresolvedRequirement)
+      ),
+      bool(imported_module.EAGER_INIT),
+    )
+
+
+def _load_order(recipe_deps, deps_spec):
+  """Computes the order in which modules need to be instantiated to resolve
+  a deps_spec.
 
   Args:
     * recipe_deps (RecipeDeps) - The loaded dependency repos.
-    * deps_spec (list|dict) - The normalized DEPS specification as provided by
-      the recipe/module.
+    * deps_spec (dict) - The normalized DEPS specification as provided by the
+      recipe/module.
+
+  Returns a tuple of the _ModuleLoader of every module transitively in
+  `deps_spec` (and the path module), where every module comes after all the
+  modules in its DEPS.
+
+  Raises CyclicalDependencyError if the DEPS have a cycle.
+  """
+  ret = []
+  # map of (repo_name, module_name) -> False while loading, True once loaded
+  loaded = {}
+
+  def _visit(key, loading_chain):
+    if key in loaded:
+      if not loaded[key]:
+        first = loading_chain.index(key)
+        raise CyclicalDependencyError(
+          '%r has a cyclical dependency. Loading chain %r.' %
+          ('%s/%s' % key, loading_chain[first:]))
+      return
+    loaded[key] = False
+
+    loader = recipe_deps.repos[key[0]].modules[key[1]]._loader
+    for _, dep_key in loader.deps:
+      _visit(dep_key, loading_chain + [key])
+
+    loaded[key] = True
+    ret.append(loader)
+
+  for key in itervalues(deps_spec):
+    _visit(key, [])
+
+  # Always instantiate the path module at least once so that string functions on
+  # Path objects work. This extra load doesn't actually attach the loaded path
+  # module to the api return, so if recipes want to use the path module, they
+  # still need to import it. If the recipe already loaded the path module
+  # (somewhere, could be transitively), then this extra load is a no-op.
+  # TODO(iannucci): The way paths work need to be reimplemented sanely :/
+  _visit(('recipe_engine', 'path'), [])
+
+  return tuple(ret)
+
+
+@attr.s(frozen=True)
+class _LazyApi(object):
+  """A module's api instance which is only instantiated on first access; see
+  _resolve and _inject_deps."""
+  # func() -> RecipeApiPlain; instantiates the api (at most once).
+  get = attr.ib()
+
+
+def _inject_deps(site, resolved_deps):
+  """Populates a ModuleInjectionSite with resolved DEPS.
+
+  Args:
+    * site (ModuleInjectionSite) - The injection site (i.e. the `m` of a recipe
+      module, or the `api` of a recipe).
+    * resolved_deps ({local_name: None|_LazyApi|api instance}) - The resolved
+      deps. Deps whose value is None will be omitted, and _LazyApi deps are
+      instantiated when they're first accessed on `site`.
+  """
+  for local_name, dep in iteritems(resolved_deps):
+    if isinstance(dep, _LazyApi):
+      site.__dict__.setdefault('_lazy_deps', {})[local_name] = dep.get
+    elif dep is not None:
+      site.__dict__[local_name] = dep
+
+
+def _resolve(deps_spec, load_order, variant, engine, test_data, lazy=False):
+  """Resolves a deps_spec to a map of {local_name: api instance}
+
+  Only the per-run state (i.e. the api instances) is created here; everything
+  else is computed once per process by _load_order.
+
+  Args:
+    * deps_spec (dict) - The normalized DEPS specification as provided by the
+      recipe/module.
+    * load_order (Tuple[_ModuleLoader]) - The result of calling _load_order
+      for `deps_spec`.
     * variant ('API'|'TEST_API') - Which variant of the dependencies to load.
     * engine (None|run.RecipeEngine) - The recipe engine which will be used to
       drive the recipe. Must be None if variant == 'TEST_API'.
     * test_data (None|TestData) - The test data which will be used for the
       recipe run. Must be None if variant == 'TEST_API'.
+    * lazy (bool) - If True, and variant == 'API', only the modules which set
+      EAGER_INIT (and their DEPS) are instantiated
+      immediately. All other modules are returned (and injected into the
+      modules depending on them) as _LazyApi, and are only instantiated when
+      they're first used.
 
-  Returns {'local_name': loaded api instance}.
+  Returns {'local_name': loaded api instance (or _LazyApi)}.
   """
   assert variant in ('API', 'TEST_API')
   if variant == 'TEST_API':
@@ -1114,66 +1418,60 @@ def _resolve(recipe_deps, deps_spec, variant, engine, test_data):
     assert isinstance(engine, RecipeEngine)
     assert isinstance(test_data, BaseTestData)
 
-  @attr.s(frozen=True)
-  class cache_entry(object):
-    api      = attr.ib(validator=optional(attr_superclass(RecipeApiPlain)))
-    test_api = attr.ib(validator=attr_superclass(RecipeTestApi))
-
-    def pick(self):
-      return self.api if variant == 'API' else self.test_api
-
-  # map of (repo_name, module_name) -> cache_entry
-  instance_cache = {}
-
-  def _inner(repo_name, module_name, loading_chain):
-    key = (repo_name, module_name)
-    if key in instance_cache:
-      cached = instance_cache[key]
-      if cached is None:
-        first = loading_chain.index(key)
-        raise CyclicalDependencyError(
-          '%r has a cyclical dependency. Loading chain %r.' %
-          ('%s/%s' % key, loading_chain[first:]))
-      return cached
-    instance_cache[key] = None
-    loading_chain += [key]
-
-    module = recipe_deps.repos[repo_name].modules[module_name]
-    deps_spec = module.normalized_DEPS
-
-    mod_imp = module.do_import()
-    test_api = _instantiate_test_api(mod_imp, {
-      local_name: _inner(d_repo_name, d_module, loading_chain).test_api
-      for local_name, (d_repo_name, d_module)
-      in iteritems(deps_spec)
+  # map of (repo_name, module_name) -> instance
+  test_apis = {}
+  for loader in load_order:
+    test_apis[loader.key] = _instantiate_test_api(loader.imported_module, {
+      local_name: test_apis[dep_key] for local_name, dep_key in loader.deps
     })
 
-    fqname = '%s/%s' % (repo_name, module_name)
-    api = None
-    if variant == 'API':
-      api = _instantiate_api(engine, test_data, fqname, mod_imp, test_api, {
-        local_name: _inner(d_repo_name, d_module, loading_chain).api
-        for local_name, (d_repo_name, d_module)
-        in iteritems(deps_spec)
-      })
-
-    result = cache_entry(api, test_api)
-
-    instance_cache[key] = result
-    return result
+  if variant == 'TEST_API':
+    return {
+      local_name: test_apis[key]
+      for local_name, key in iteritems(deps_spec)
+    }
 
-  ret = {
-    local_name: _inner(d_repo_name, d_module, []).pick()
-    for local_name, (d_repo_name, d_module)
-    in iteritems(deps_spec)
+  loaders = {loader.key: loader for loader in load_order}
+  apis = {}
+  # map of (repo_name, module_name) -> gevent.event.Event, for the modules
+  # which are currently being instantiated.
+  instantiating = {}
+
+  def _dep(key):
+    if key in apis or not lazy:
+      return apis[key]
+    return _LazyApi(functools.partial(_get_api, key))
+
+  def _get_api(key):
+    while key in instantiating:
+      # Another greenlet is instantiating this module (i.e. its initialize()
+      # is blocked).
+      instantiating[key].wait()
+    if key not in apis:
+      loader = loaders[key]
+      done = instantiating[key] = gevent.event.Event()
+      try:
+        apis[key] = _instantiate_api(
+            engine, test_data, loader, test_apis[key], {
+              local_name: _dep(dep_key) for local_name, dep_key in loader.deps
+            })
+      finally:
+        del instantiating[key]
+        done.set()
+    return apis[key]
+
+  eager = set()
+  for loader in reversed(load_order):
+    # Every module comes before its DEPS in reversed(load_order).
+    if not lazy or loader.eager or loader.key in eager:
+      eager.add(loader.key)
+      eager.update(dep_key for _, dep_key in loader.deps)
+
+  for loader in load_order:
+    if loader.key in eager:
+      _get_api(loader.key)
+
+  return {
+    local_name: _dep(key)
+    for local_name, key in iteritems(deps_spec)
   }
-
-  # Always instantiate the path module at least once so that string functions on
-  # Path objects work. This extra load doesn't actually attach the loaded path
-  # module to the api return, so if recipes want to use the path module, they
-  # still need to import it. If the recipe already loaded the path module
-  # (somewhere, could be transitively), then this extra load is a no-op.
-  # TODO(iannucci): The way paths work need to be reimplemented sanely :/
-  _inner('recipe_engine', 'path', [])
-
-  return ret
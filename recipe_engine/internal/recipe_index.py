@@ -0,0 +1,170 @@
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Persistent index of the contents of recipe repos.
+
+Every `recipes.py` invocation (including each test runner subprocess) loads a
+RecipeDeps, which walks the `recipes` and `recipe_modules` directories of every
+repo to find all recipes, recipe modules and expectation files, and evaluates
+the DEPS of recipes (executing their code) and recipe modules as needed.
+
+The index (stored in `.recipe_deps/.recipe_index`) remembers:
+  * For every repo, the results of scanning its directories, along with the
+    mtime and size of every directory which was scanned. Adding, removing or
+    renaming a file changes the mtime of its directory, so if none of the
+    directories changed the scan results are still accurate.
+  * For every recipe and recipe module, its normalized DEPS, along with the
+    mtime and size of the file which defines them.
+
+Anything modified within the last couple of seconds of being indexed is not
+stored, since a later modification within the same mtime tick would go
+unnoticed.
+"""
+
+import json
+import logging
+import os
+import time
+
+from future.utils import iteritems
+
+import attr
+
+from .attr_util import attr_type
+
+
+LOG = logging.getLogger(__name__)
+
+# Bump this to invalidate all existing indexes (e.g. if the format changes).
+_INDEX_VERSION = 1
+
+# Files and directories modified less than this many seconds before they're
+# indexed are not stored in the index.
+_RACY_SECONDS = 2
+
+
+def stat_key(path):
+  """Returns the [mtime_ns, size] of `path`, or None if it doesn't exist."""
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+  return [st.st_mtime_ns, st.st_size]
+
+
+def is_racy(keys):
+  """Returns True if any of the stat_key's in `keys` is too recent to be
+  indexed."""
+  threshold = (time.time() - _RACY_SECONDS) * 1e9
+  return any(key and key[0] >= threshold for key in keys)
+
+
+@attr.s
+class RecipeIndex(object):
+  """The persistent index for a RecipeDeps; see the module docstring."""
+
+  # Absolute path to the index file.
+  path = attr.ib(validator=attr_type(str))  # type: str
+
+  # recipes_root_path -> {'dirs': {relpath: stat_key}, 'data': jsonish}
+  _repos = attr.ib(factory=dict)
+
+  # file path -> {'stat': stat_key, 'key': jsonish, 'data': jsonish}
+  _files = attr.ib(factory=dict)
+
+  _dirty = attr.ib(default=False)
+
+  @classmethod
+  def load(cls, path):
+    """Loads the index at `path`.
+
+    Returns an empty index if `path` is missing or unreadable.
+    """
+    ret = cls(path)
+    try:
+      with open(path) as f:
+        data = json.load(f)
+      if data.get('version') == _INDEX_VERSION:
+        ret._repos = data['repos']
+        ret._files = data['files']
+    except (IOError, ValueError, KeyError, AttributeError):
+      pass
+    return ret
+
+  def get_repo(self, recipes_root_path, scan):
+    """Returns the scan results for a repo.
+
+    Args:
+      * recipes_root_path (str) - The absolute path to the directory containing
+        the repo's `recipes`, `recipe_modules`, etc. directories.
+      * scan (func() -> (Dict[str, stat_key], jsonish)) - Scans the repo,
+        returning the stat_key of every directory (absolute path) it looked at,
+        and the (jsonish) scan results.
+
+    Returns the scan results, from the index if none of the directories
+    changed since they were indexed.
+    """
+    entry = self._repos.get(recipes_root_path)
+    if entry is not None and all(
+        stat_key(os.path.join(recipes_root_path, relpath)) == key
+        for relpath, key in iteritems(entry['dirs'])):
+      return entry['data']
+
+    dirs, data = scan()
+    if is_racy(dirs.values()):
+      self._repos.pop(recipes_root_path, None)
+    else:
+      self._repos[recipes_root_path] = {
+        'dirs': {
+          os.path.relpath(path, recipes_root_path): key
+          for path, key in iteritems(dirs)
+        },
+        'data': data,
+      }
+    self._dirty = True
+    return data
+
+  def get_file_data(self, path, key, compute):
+    """Returns data derived from the file at `path`.
+
+    Args:
+      * path (str) - The absolute path of the file.
+      * key (jsonish) - Anything else the data depends on.
+      * compute (func() -> jsonish) - Computes the data from the file.
+
+    Returns the data, from the index if neither the file nor `key` changed
+    since it was indexed.
+    """
+    entry = self._files.get(path)
+    stat = stat_key(path)
+    if entry is not None and entry['stat'] == stat and entry['key'] == key:
+      return entry['data']
+
+    data = compute()
+    if stat is not None and not is_racy([stat]):
+      self._files[path] = {'stat': stat, 'key': key, 'data': data}
+      self._dirty = True
+    return data
+
+  def save(self):
+    """Writes the index to disk, if anything changed.
+
+    Failures are only logged; the index is just a cache.
+    """
+    if not self._dirty:
+      return
+    tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+    try:
+      if not os.path.isdir(os.path.dirname(self.path)):
+        os.makedirs(os.path.dirname(self.path))
+      with open(tmp_path, 'w') as f:
+        json.dump({
+          'version': _INDEX_VERSION,
+          'repos': self._repos,
+          'files': self._files,
+        }, f)
+      os.replace(tmp_path, self.path)
+    except (IOError, OSError) as ex:
+      LOG.info('unable to write recipe index %r: %s', self.path, ex)
+    self._dirty = False
@@ -46,6 +46,7 @@ from ..recipe_api import BoundProperty, RecipeApi, RecipeApiPlain
 from ..recipe_test_api import RecipeTestApi
 
 from . import proto_support
+from . import startup_profile
 
 
 class RecipeModuleImporter(object):
@@ -147,12 +148,13 @@ class RecipeModuleImporter(object):
     # We don't just look up stuff in sys.modules because `importlib` is the
     # correct api for accessing modules.
     parent_mod = importlib.import_module(parent_mod_name)
-    f, pathname, description = imp.find_module(to_load, parent_mod.__path__)
-    loaded = imp.load_module(fullname, f, pathname, description)
-    if f:
-      f.close()
-    if len(toks) == 3:  # RECIPE_MODULES.repo_name.module_name
-      self._patchup_module(loaded, repo.path)
+    with startup_profile.phase(fullname, cat='import'):
+      f, pathname, description = imp.find_module(to_load, parent_mod.__path__)
+      loaded = imp.load_module(fullname, f, pathname, description)
+      if f:
+        f.close()
+      if len(toks) == 3:  # RECIPE_MODULES.repo_name.module_name
+        self._patchup_module(loaded, repo.path)
 
     mod.__dict__.update(loaded.__dict__)
     return mod
@@ -185,6 +187,7 @@ class RecipeModuleImporter(object):
         engine can assume that there's ALWAYS a DEPS object for a module.
       * `WARNINGS`: A list of warnings issued against this recipe module.
       * `DISABLE_STRICT_COVERAGE`: Sets a default value of False.
+      * `EAGER_INIT`: Sets a default value of False.
 
     Args:
       * mod (python module type) - This will be the module loaded for e.g.
@@ -204,6 +207,10 @@ class RecipeModuleImporter(object):
     # TODO(iannucci, probably): remove DISABLE_STRICT_COVERAGE (crbug/693058).
     mod.DISABLE_STRICT_COVERAGE = getattr(mod, 'DISABLE_STRICT_COVERAGE', False)
 
+    # If set, the module is instantiated before RunSteps even if the recipe's
+    # repo enables `lazy_module_init`.
+    mod.EAGER_INIT = getattr(mod, 'EAGER_INIT', False)
+
     # TODO(iannucci): do these imports on-demand at the callsites needing these.
 
     # NOTE: late import to avoid early protobuf import
@@ -0,0 +1,170 @@
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Records how long each phase of engine startup takes.
+
+Startup covers everything between `recipes.py` being invoked and the recipe's
+first step: bootstrapping (`recipes.py` and `checkout_engine`), importing the
+engine, loading the RecipeDeps (fetching repos, digesting and compiling
+protos), importing recipe modules and instantiating their APIs, and the
+`setup_build` step.
+
+Phases are always recorded (this is just a few list appends), but are only
+written out when the engine is run with `--profile-startup PATH`. In that case
+`finish` writes a Chrome trace-event JSON file (viewable in chrome://tracing or
+https://ui.perfetto.dev) to PATH and prints a summary table to stderr.
+
+`recipes.py` exec's the engine, so it hands the timings of the bootstrap phases
+over in the $RECIPES_STARTUP_PROFILE environment variable.
+"""
+
+from __future__ import print_function
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+
+# Set by recipes.py to a JSON list of [name, start_us, end_us] for the
+# bootstrap phases.
+ENV_VAR = 'RECIPES_STARTUP_PROFILE'
+
+# Number of slowest recipe module imports to show in the summary table.
+_SLOWEST_IMPORTS = 10
+
+# Chrome trace events ('ph': 'X'), in the order they were started.
+_EVENTS = []
+
+# True until `finish` is called.
+_RECORDING = True
+
+# Where to write the trace, if enabled.
+_OUTPUT_PATH = None
+
+
+def _now_us():
+  return time.time() * 1e6
+
+
+def record(name, start, end=None, cat='phase', **args):
+  """Records a phase which already happened.
+
+  Args:
+    * name (str) - The name of the phase.
+    * start (float) - The start of the phase (from time.time()).
+    * end (float|None) - The end of the phase (from time.time()), or None for
+      now.
+    * cat (str) - The trace event category; 'phase' or 'import'.
+    * args (Dict[str, jsonish]) - Extra information to add to the trace event.
+  """
+  if not _RECORDING:
+    return
+  end = _now_us() if end is None else end * 1e6
+  _EVENTS.append({
+    'name': name,
+    'cat': cat,
+    'ph': 'X',
+    'ts': start * 1e6,
+    'dur': end - start * 1e6,
+    'pid': os.getpid(),
+    'tid': threading.current_thread().ident,
+    'args': args,
+  })
+
+
+@contextlib.contextmanager
+def phase(name, cat='phase', **args):
+  """Context manager which records the phase `name` around its body.
+
+  See `record` for the arguments.
+  """
+  if not _RECORDING:
+    yield
+    return
+  start = time.time()
+  try:
+    yield
+  finally:
+    record(name, start, cat=cat, **args)
+
+
+def enable(output_path):
+  """Makes `finish` write the startup profile to `output_path`.
+
+  This also picks up the bootstrap phases recorded by recipes.py.
+  """
+  global _OUTPUT_PATH
+  _OUTPUT_PATH = output_path
+
+  try:
+    bootstrap = json.loads(os.environ.pop(ENV_VAR, '[]'))
+  except ValueError:
+    bootstrap = []
+  if not bootstrap:
+    return
+  engine_start = min([ev['ts'] for ev in _EVENTS] or [_now_us()])
+  events = []
+  for name, start, end in bootstrap:
+    events.append({
+      'name': name, 'cat': 'phase', 'ph': 'X', 'ts': start, 'dur': end - start,
+      'pid': os.getpid(), 'tid': threading.current_thread().ident, 'args': {},
+    })
+  bootstrap_end = max(ev['ts'] + ev['dur'] for ev in events)
+  if bootstrap_end < engine_start:
+    events.append(dict(
+        events[-1], name='python startup', ts=bootstrap_end,
+        dur=engine_start - bootstrap_end))
+  _EVENTS[:0] = events
+
+
+def _summarize(events, out):
+  t0 = events[0]['ts']
+  phases = [ev for ev in events if ev['cat'] == 'phase']
+  print('Startup profile (ms):', file=out)
+  print('  %9s %9s  %s' % ('start', 'duration', 'phase'), file=out)
+  stack = []
+  for ev in phases:
+    while stack and ev['ts'] >= stack[-1]['ts'] + stack[-1]['dur']:
+      stack.pop()
+    print('  %9.1f %9.1f  %s%s' % (
+        (ev['ts'] - t0) / 1e3, ev['dur'] / 1e3, '  ' * len(stack), ev['name']),
+        file=out)
+    stack.append(ev)
+
+  imports = sorted(
+      (ev for ev in events if ev['cat'] == 'import'),
+      key=lambda ev: -ev['dur'])
+  if imports:
+    print(file=out)
+    print('Slowest recipe module imports (ms, including nested imports):',
+          file=out)
+    for ev in imports[:_SLOWEST_IMPORTS]:
+      print('  %9.1f  %s' % (ev['dur'] / 1e3, ev['name']), file=out)
+
+
+def finish():
+  """Ends startup profiling.
+
+  Phases are no longer recorded after this. If profiling was enabled, this
+  writes the trace file and prints the summary table (once).
+  """
+  global _RECORDING
+  if not _RECORDING:
+    return
+  _RECORDING = False
+  if not _OUTPUT_PATH or not _EVENTS:
+    return
+
+  events = sorted(_EVENTS, key=lambda ev: (ev['ts'], -ev['dur']))
+  t0 = events[0]['ts']
+  with open(_OUTPUT_PATH, 'w') as f:
+    json.dump({
+      'traceEvents': [dict(ev, ts=ev['ts'] - t0) for ev in events],
+      'displayTimeUnit': 'ms',
+    }, f, indent=2, sort_keys=True)
+  _summarize(events, sys.stderr)
+  sys.stderr.flush()
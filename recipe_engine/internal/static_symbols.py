@@ -0,0 +1,131 @@
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Reads the module-level symbols of recipe (and recipe module) code from its
+AST, without executing the code.
+
+Executing a recipe imports everything it imports (e.g. protobufs), so commands
+which only need e.g. the DEPS of recipes (`analyze`, `deps`, ...) use these
+helpers when possible, and only fall back to executing the code when a symbol
+isn't a simple literal.
+"""
+
+import ast
+
+
+# Returned by `literal_symbol` when the value can't be determined from the AST.
+NOT_LITERAL = object()
+
+
+def parse_file(path):
+  """Returns the parsed ast.Module for the python file at `path`, or None if it
+  can't be read or parsed."""
+  try:
+    with open(path, 'rb') as f:
+      return ast.parse(f.read(), path)
+  except (IOError, OSError, SyntaxError, ValueError):
+    return None
+
+
+def _find_assignment(mod_ast, target):
+  """Returns the first module-level `target = ...` ast.Assign, or None."""
+  for node in mod_ast.body:
+    if isinstance(node, ast.Assign):
+      if (len(node.targets) == 1 and
+          isinstance(node.targets[0], ast.Name) and
+          node.targets[0].id == target):
+        return node
+  return None
+
+
+def find_value_of(mod_ast, target):
+  """Looks for an assignment to `target`, returning the assignment value AST
+  node and the line number of the assignment.
+
+  Example:
+
+     some_var = 100
+     other = 20 + 10
+
+     find_value_of(<code>, 'some_var')  ->  ast.Num(100)
+
+  Args:
+    * mod_ast (ast.Module) - The parsed Python module code.
+    * target (str) - The variable name to look for an assignment to.
+
+  Returns the Python AST object which is the right-hand-side of an assignment to
+  `target`.
+  """
+  assert isinstance(mod_ast, ast.Module), type(mod_ast)
+  node = _find_assignment(mod_ast, target)
+  if node is None:
+    return None, None
+  return node.value, node.lineno
+
+
+def extract_jsonish_assignments(mod_ast):
+  """This extracts all single assignments where the target is a name, and the
+  value is a simple 'jsonish' statement (aka Python literal).
+
+  The result is returned as a dictionary of name to the decoded literal.
+
+  Example:
+    Foo = "hello"
+    Bar = [1, 2, "something"]
+    Other, Things = range(2)  # not single assignment
+    Bogus = object()  # not a Python literal
+    # returns: {"Foo": "hello", "Bar": [1, 2, "something"]}
+  """
+  ret = {}
+  for node in mod_ast.body:
+    if not isinstance(node, ast.Assign):
+      continue
+    if len(node.targets) != 1:
+      continue
+    if not isinstance(node.targets[0], ast.Name):
+      continue
+    try:
+      ret[node.targets[0].id] = ast.literal_eval(node.value)
+    except (KeyError, ValueError):
+      pass
+  return ret
+
+
+def _mentions(node, name):
+  """Returns True if `node` binds or refers to the symbol `name` (or could, in
+  the case of `from ... import *`)."""
+  for field in ('id', 'name', 'asname', 'arg', 'rest'):
+    value = getattr(node, field, None)
+    if value == name or (value == '*' and isinstance(node, ast.alias)):
+      return True
+  return isinstance(node, (ast.Global, ast.Nonlocal)) and name in node.names
+
+
+def literal_symbol(mod_ast, name, default):
+  """Returns the value of the module-level symbol `name`, if it's a literal.
+
+  This only trusts the AST if `name` is assigned exactly once, by a
+  module-level `name = <python literal>` statement, and isn't mentioned
+  anywhere else in the code (which could modify or rebind it).
+
+  Args:
+    * mod_ast (ast.Module) - The parsed Python module code.
+    * name (str) - The symbol to look up.
+    * default (object) - The value to return if the code never mentions `name`.
+
+  Returns the value of `name`, `default` or NOT_LITERAL.
+  """
+  assert isinstance(mod_ast, ast.Module), type(mod_ast)
+  mentions = [node for node in ast.walk(mod_ast) if _mentions(node, name)]
+  if not mentions:
+    return default
+
+  assignment = _find_assignment(mod_ast, name)
+  if (len(mentions) != 1 or assignment is None or
+      mentions[0] is not assignment.targets[0]):
+    return NOT_LITERAL
+  try:
+    return ast.literal_eval(assignment.value)
+  except ValueError:
+    return NOT_LITERAL
@@ -2,6 +2,9 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import codecs
+import errno
+import io
 import os
 import signal
 import sys
@@ -9,6 +12,9 @@ import time
 
 from future.utils import iteritems
 from gevent import subprocess
+from gevent.event import AsyncResult
+from gevent.fileobject import FileObject
+from gevent.hub import linkproxy
 
 import attr
 import gevent
@@ -23,6 +29,9 @@ from . import StepRunner
 
 _PY2 = sys.version_info.major == 2
 
+# The most output _copy_lines reads from a subprocess pipe at once.
+_COPY_CHUNK_SIZE = 64 * 1024
+
 if MSWINDOWS:
   # subprocess.Popen(close_fds) raises an exception when attempting to do this
   # and also redirect stdin/stdout/stderr. To be on the safe side, we just don't
@@ -54,10 +63,32 @@ else:
   CLOSE_FDS = True
   EXTRA_KWARGS = {'preexec_fn': lambda: os.setpgid(0, 0)}
 
+# os.posix_spawn (and its `setpgroup` argument) is new in python 3.8.
+HAVE_POSIX_SPAWN = not MSWINDOWS and hasattr(os, 'posix_spawn')
+
+# os.posix_spawn can't change the working directory of the child, so when the
+# step needs a different one we spawn this instead, with the cwd and the
+# command as its arguments (i.e. "$0" and "$@").
+_CHDIR_TRAMPOLINE = ('/bin/sh', '-c', 'cd -- "$0" && exec "$@"')
+
+# Python ignores these signals; like subprocess.Popen(restore_signals=True) we
+# reset them to their defaults in the child.
+_SPAWN_DEFAULT_SIGNALS = tuple(
+    getattr(signal, name) for name in ('SIGPIPE', 'SIGXFSZ')
+    if hasattr(signal, name))
+
 
 class SubprocessStepRunner(StepRunner):
   """Responsible for actually running steps as subprocesses, filtering their
   output into a stream."""
+  def __init__(self, use_posix_spawn=False):
+    """
+    Args:
+      * use_posix_spawn (bool) - If True, start steps with os.posix_spawn
+        (where available) instead of subprocess.Popen. See _SpawnedProcess.
+    """
+    self._use_posix_spawn = use_posix_spawn and HAVE_POSIX_SPAWN
+
   def isabs(self, _name_tokens, path):
     return os.path.isabs(path)
 
@@ -166,7 +197,7 @@ class SubprocessStepRunner(StepRunner):
       return file_path or os.environ.get(luci_context.ENV_KEY)
 
   def run(self, name_tokens, debug_log, step):
-    proc, gid, pipes = self._mk_proc(step, debug_log)
+    proc, gid, pipes = self._mk_proc(step, debug_log, self._use_posix_spawn)
 
     workers, to_close = self._mk_workers(step, proc, pipes)
 
@@ -187,16 +218,19 @@ class SubprocessStepRunner(StepRunner):
     return exc_result
 
   @staticmethod
-  def _mk_proc(step, debug_log):
+  def _mk_proc(step, debug_log, use_posix_spawn=False):
     """Makes a subprocess.Popen object from the Step.
 
     Args:
       * step (..step_runner.Step) - The Step object describing what we're
         supposed to run.
       * debug_log (..stream.StreamEngine.Stream)
+      * use_posix_spawn (bool) - Start the process with os.posix_spawn instead
+        (POSIX only).
 
     Returns (proc, gid, pipes):
-      * proc (subprocess.Popen) - The Popen object for the running subprocess.
+      * proc (subprocess.Popen|_SpawnedProcess) - The Popen object for the
+        running subprocess.
       * gid (int|None) - The (new) group-id of the process (POSIX only).
         TODO(iannucci): expand this from an int to a killable object to
         encapsulate JobObjects on Windows too.
@@ -219,6 +253,16 @@ class SubprocessStepRunner(StepRunner):
       'stderr': _fd_for_out(step.stderr),
     }
     debug_log.write_line('fhandles %r' % fhandles)
+
+    if use_posix_spawn:
+      proc = _SpawnedProcess.spawn(step, fhandles)
+      # The process leads its own (new) process group.
+      gid = proc.pid
+      UNKILLED_PROC_GROUPS.add(gid)
+      debug_log.write_line(
+          'launched pid:%r gid:%r with posix_spawn' % (proc.pid, gid))
+      return proc, gid, _close_fhandles(fhandles)
+
     extra_kwargs = fhandles.copy()
     extra_kwargs.update(EXTRA_KWARGS)
 
@@ -257,15 +301,7 @@ class SubprocessStepRunner(StepRunner):
 
     debug_log.write_line('launched pid:%r gid:%r' % (proc.pid, gid))
 
-    pipes = set()
-    for handle_name, handle in iteritems(fhandles):
-      # Close all closable file handles, since the subprocess has them now.
-      if hasattr(handle, 'close'):
-        handle.close()
-      elif handle == subprocess.PIPE:
-        pipes.add(handle_name)
-
-    return proc, gid, pipes
+    return proc, gid, _close_fhandles(fhandles)
 
   @staticmethod
   def _mk_workers(step, proc, pipes):
@@ -495,7 +531,180 @@ class SubprocessStepRunner(StepRunner):
       return ret
 
 
+def _close_fhandles(fhandles):
+  """Closes all closable file handles in `fhandles` (as made by _mk_proc), since
+  the subprocess has them now.
+
+  Returns the subset of {'stdout', 'stderr'} which are pipes.
+  """
+  pipes = set()
+  for handle_name, handle in iteritems(fhandles):
+    if hasattr(handle, 'close'):
+      handle.close()
+    elif handle == subprocess.PIPE:
+      pipes.add(handle_name)
+  return pipes
+
+
+class _SpawnedProcess(object):
+  """The parts of subprocess.Popen which SubprocessStepRunner needs, for a
+  process started with os.posix_spawn.
+
+  Unlike subprocess.Popen, this doesn't fork the (potentially large) recipe
+  engine process, doesn't run any python code in the child, and doesn't need
+  to modify os.environ to find the program: the step's cmd[0] is already
+  resolved to an absolute path (see resolve_cmd0) and the step's env is passed
+  to the child as-is. The child is put in a new process group whose id is its
+  pid.
+
+  All file descriptors which the engine opens are non-inheritable (PEP 446),
+  so only the child's stdin/stdout/stderr are passed to it, like
+  `close_fds=True` does.
+
+  Waiting for the process uses a gevent child watcher, so (like gevent's
+  Popen) this can be passed to gevent.wait.
+  """
+
+  def __init__(self, pid, stdout=None, stderr=None):
+    self.pid = pid
+    self.stdout = stdout
+    self.stderr = stderr
+    self.returncode = None
+    self._result = AsyncResult()
+    self._watcher = gevent.get_hub().loop.child(pid, False)
+    self._watcher.start(self._on_exit)
+
+  @classmethod
+  def spawn(cls, step, fhandles):
+    """Starts the process for `step`.
+
+    Args:
+      * step (..step_runner.Step) - The Step to run.
+      * fhandles (Dict[str, None|int|file]) - The std{in,out,err} handles for
+        the process (as made by _mk_proc).
+
+    Returns the _SpawnedProcess.
+    """
+    argv = list(step.cmd)
+    if step.cwd != os.getcwd():
+      if not os.path.isdir(step.cwd):
+        # Raise what subprocess.Popen would, rather than let the trampoline's
+        # `cd` fail with a regular exit code.
+        err = errno.ENOTDIR if os.path.exists(step.cwd) else errno.ENOENT
+        raise OSError(err, os.strerror(err), step.cwd)
+      argv = list(_CHDIR_TRAMPOLINE) + [step.cwd] + argv
+
+    file_actions = []
+    child_ends = []
+    parent_ends = {}
+    try:
+      for child_fd, handle_name in enumerate(('stdin', 'stdout', 'stderr')):
+        handle = fhandles[handle_name]
+        if handle is None:
+          continue
+        if handle == subprocess.PIPE:
+          read_fd, write_fd = os.pipe()
+          parent_ends[handle_name] = read_fd
+          child_ends.append(write_fd)
+          handle = write_fd
+        elif handle == subprocess.DEVNULL:
+          file_actions.append((
+              os.POSIX_SPAWN_OPEN, child_fd, os.devnull,
+              os.O_RDONLY if child_fd == 0 else os.O_WRONLY, 0))
+          continue
+        elif not isinstance(handle, int):
+          handle = handle.fileno()
+        file_actions.append((os.POSIX_SPAWN_DUP2, handle, child_fd))
+
+      pid = os.posix_spawn(
+          argv[0], argv, step.env, file_actions=file_actions, setpgroup=0,
+          setsigdef=_SPAWN_DEFAULT_SIGNALS)
+    except:
+      for read_fd in parent_ends.values():
+        os.close(read_fd)
+      raise
+    finally:
+      for write_fd in child_ends:
+        os.close(write_fd)
+
+    return cls(pid, **{
+      handle_name: FileObject(read_fd, 'r')
+      for handle_name, read_fd in iteritems(parent_ends)
+    })
+
+  def _on_exit(self):
+    self._watcher.stop()
+    status = self._watcher.rstatus
+    if os.WIFSIGNALED(status):
+      self.returncode = -os.WTERMSIG(status)
+    else:
+      self.returncode = os.WEXITSTATUS(status)
+    self._result.set(self.returncode)
+
+  def poll(self):
+    return self.returncode
+
+  def wait(self, timeout=None):
+    return self._result.get(timeout=timeout)
+
+  def rawlink(self, callback):
+    # This is what lets gevent.wait wait for us.
+    self._result.rawlink(linkproxy(callback, self))
+
+
 def _copy_lines(handle, outstream):
+  """Copies the output of a subprocess from `handle` (a text mode pipe) to
+  `outstream` (a Stream without a fileno, e.g. one which escapes
+  subannotations).
+
+  Rather than reading and writing line by line, this reads whatever the pipe
+  has (up to _COPY_CHUNK_SIZE bytes) into a reusable buffer, and hands all the
+  complete lines in it to `outstream.write_chunk` at once. Only streams which
+  need to look at individual lines pay for splitting the output into lines.
+  """
+  reader = getattr(handle, 'buffer', None)
+  if not hasattr(reader, 'readinto1'):
+    _copy_lines_slow(handle, outstream)
+    return
+
+  # Decode the same way the text mode `handle` would (i.e. with universal
+  # newlines).
+  decoder = io.IncrementalNewlineDecoder(
+      codecs.getincrementaldecoder(handle.encoding)(handle.errors),
+      translate=True)
+  buf = bytearray(_COPY_CHUNK_SIZE)
+  view = memoryview(buf)
+  partial_line = []
+  while True:
+    try:
+      # Like with readline, we could, technically, lose some data in the event
+      # of a timeout.
+      size = reader.readinto1(buf)
+    except RuntimeError:
+      # See NOTE(gevent) above.
+      return
+    data = decoder.decode(view[:size], final=not size)
+    if not size:
+      break
+    end = data.rfind('\n') + 1
+    if not end:
+      partial_line.append(data)
+      continue
+    partial_line.append(data[:end])
+    outstream.write_chunk(''.join(partial_line))
+    partial_line = [data[end:]]
+  # The final decode may still produce the newline for a trailing '\r'.
+  partial_line.append(data)
+  rest = ''.join(partial_line)
+  if rest and not rest.endswith('\n'):
+    rest += '\n'
+  if rest:
+    outstream.write_chunk(rest)
+
+
+def _copy_lines_slow(handle, outstream):
+  """Line by line version of _copy_lines, for handles which don't have a
+  binary buffer to read chunks from."""
   while True:
     try:
       # Because we use readline here we could, technically, lose some data in
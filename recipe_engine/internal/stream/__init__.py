@@ -25,6 +25,14 @@ import time
 from ..engine_step import StepConfig
 
 
+# The sizes (in bytes, once encoded) above which output property values and
+# step summaries bloat the Build message. Simulation tests warn about bigger
+# values. The LUCI stream engine only moves values into logs when given limits
+# (see luciexe's --max-output-property-bytes and --max-step-summary-bytes).
+DEFAULT_MAX_PROPERTY_BYTES = 64 * 1024
+DEFAULT_MAX_SUMMARY_BYTES = 16 * 1024
+
+
 class StreamEngine(object):
   class Stream(object):
     def write_line(self, line):
@@ -36,6 +44,15 @@ class StreamEngine(object):
       for actual_line in string.splitlines() or ['']: # preserve empty lines
         self.write_line(actual_line)
 
+    def write_chunk(self, data):
+      """Write a chunk of lines, each terminated by a newline ('\\n'), to the
+      stream.
+
+      Streams which can write the chunk as-is should override this; by default
+      it's split into lines for write_line."""
+      for line in data.split('\n')[:-1]:
+        self.write_line(line)
+
     # TODO(iannucci): Having a phantom method as part of the API is weird.
     # If there's a real filelike for this Stream, return it.
     #
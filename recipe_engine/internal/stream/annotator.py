@@ -2,6 +2,7 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import re
 import time
 
 from builtins import map
@@ -11,6 +12,10 @@ from PB.recipe_engine.result import Result
 from . import StreamEngine, encode_str
 
 
+# Matches the '@@@' at the start of any line, to escape subannotations.
+_SUBANNOTATION_RE = re.compile(r'^@@@', re.MULTILINE)
+
+
 class AnnotatorStreamEngine(StreamEngine):
   def __init__(self, outstream, emit_timestamps=False, time_fn=None):
     self._current_step = None
@@ -88,6 +93,9 @@ class AnnotatorStreamEngine(StreamEngine):
       else:
         self.basic_write(line + '\n')
 
+    def write_chunk(self, data):
+      self.basic_write(_SUBANNOTATION_RE.sub('!@@@', data))
+
     def open_std_handles(self, stdout=False, stderr=False):
       ret = {}
       if stdout:
@@ -143,6 +151,9 @@ class AnnotatorStreamEngine(StreamEngine):
     def write_line(self, line):
       self.basic_write(line + '\n')
 
+    def write_chunk(self, data):
+      self.basic_write(data)
+
     # HACK(luqui): If the subannotator script changes the active step, we need
     # a way to get back to the real step that spawned the script.  The right
     # way to do that is to parse the annotation stream and re-emit it.  But for
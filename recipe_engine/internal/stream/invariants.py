@@ -52,6 +52,10 @@ class StreamEngineInvariants(StreamEngine):
       assert '\n' not in line
       assert self._open
 
+    def write_chunk(self, data):
+      assert data.endswith('\n'), 'Chunk %r lacks trailing newline' % (data,)
+      assert self._open
+
     def close(self):
       assert self._open
       for log_name, log in iteritems(self._logs):
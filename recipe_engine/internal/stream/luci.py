@@ -3,9 +3,12 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import functools
+import io
 import json
 import logging
 import sys
+import time
 import traceback
 import zlib
 
@@ -24,6 +27,7 @@ from PB.go.chromium.org.luci.buildbucket.proto import common
 
 from ...recipe_api import InfraFailure, StepFailure
 from ...third_party import logdog
+from ...third_party.logdog import varint
 
 from ..attr_util import attr_type
 
@@ -32,6 +36,59 @@ from . import StreamEngine
 
 LOG = logging.getLogger(__name__)
 
+# The field number of Build.steps.
+_STEPS_FIELD_NUMBER = Build.DESCRIPTOR.fields_by_name['steps'].number
+
+# How many build.proto sends may reuse cached step encodings before the whole
+# Build is serialized from scratch again; see LUCIStreamEngine._serialize_build.
+_FULL_SERIALIZE_EVERY = 60
+
+# The default bounds (in seconds) of the interval between build.proto sends;
+# see LUCIStreamEngine._send_interval.
+DEFAULT_MIN_SEND_INTERVAL = 1.0
+DEFAULT_MAX_SEND_INTERVAL = 10.0
+
+# The sender waits at least this many times as long as the last send took to
+# serialize, so that serializing the Build takes up at most ~5% of the time.
+_SERIALIZE_COST_FACTOR = 20
+
+# The sender waits long enough for the last payload to go out at this rate.
+_SEND_BYTES_PER_SECOND = 256 * 1024
+
+
+@attr.s
+class SendMetrics(object):
+  """Counters about the build.proto sends of a LUCIStreamEngine."""
+
+  # The number of build.proto datagrams sent.
+  sends = attr.ib(default=0)
+  # The total size of the sent datagrams (after compression).
+  bytes_sent = attr.ib(default=0)
+  # The size of the last sent datagram.
+  last_bytes = attr.ib(default=0)
+  # The total time (in seconds) spent serializing and compressing the Build.
+  serialize_seconds = attr.ib(default=0.0)
+  # The time spent serializing and compressing the last sent datagram.
+  last_serialize_seconds = attr.ib(default=0.0)
+  # The number of Build updates which were folded into a send triggered by an
+  # earlier update, rather than causing a send of their own.
+  coalesced_updates = attr.ib(default=0)
+  # The size of the biggest step (when serialized) seen so far.
+  max_step_bytes = attr.ib(default=0)
+  # The number of output properties and step summaries which were too big for
+  # the Build, and were moved into logs instead.
+  spilled_values = attr.ib(default=0)
+
+
+def _length_delimited(field_number, data):
+  """Returns the wire encoding of the length-delimited field `field_number`
+  with the value `data` (the serialized bytes of a message)."""
+  buf = io.BytesIO()
+  varint.write_uvarint(buf, (field_number << 3) | 2)
+  varint.write_uvarint(buf, len(data))
+  buf.write(data)
+  return buf.getvalue()
+
 
 @attr.s
 class LUCIStepMarkdownWriter(object):
@@ -127,6 +184,10 @@ class LUCIStepStream(StreamEngine.StepStream):
   #   * self._step
   #   * self._properties
   #
+  # It takes an optional `flush` argument, which is set when the step's status
+  # changes; such changes are sent without waiting for other updates to
+  # coalesce with them.
+  #
   # TODO(iannucci): change _change_cb to a context-manager for step, i.e.
   #   with self._step as pb:
   #      # tweak pb
@@ -159,6 +220,15 @@ class LUCIStepStream(StreamEngine.StepStream):
   _merge_step = attr.ib(default=False,
                         validator=attr.validators.in_((False, True, 'legacy')))
 
+  # Output property values and summaries bigger than this many bytes are
+  # written to logs of this step instead of the Build; see _spill. None means
+  # no limit.
+  _max_property_bytes = attr.ib(default=None)
+  _max_summary_bytes = attr.ib(default=None)
+
+  # Called with no arguments whenever a value is spilled into a log.
+  _spill_cb = attr.ib(default=lambda: None)
+
   _back_compat_markdown = attr.ib(factory=LUCIStepMarkdownWriter)
 
   # A global set of created logdog stream names for all steps. Used to
@@ -263,10 +333,10 @@ class LUCIStepStream(StreamEngine.StepStream):
       self._step.summary_markdown = ""
       self._step.status = common.STARTED
       self._step.start_time.GetCurrentTime()
-      self._change_cb()
+      self._change_cb(flush=True)
 
   def set_summary_markdown(self, text):
-    self._step.summary_markdown = text
+    self._step.summary_markdown = self._limit_summary(text)
     self._change_cb()
 
   def add_step_text(self, text):
@@ -288,6 +358,7 @@ class LUCIStepStream(StreamEngine.StepStream):
       'CANCELED': common.CANCELED,
     }[status]
     # TODO(iannucci): set timeout bit here
+    self._change_cb(flush=True)
 
   def set_build_property(self, key, value):
     # Intercept legacy properties; These were used late-stage in the
@@ -304,10 +375,50 @@ class LUCIStepStream(StreamEngine.StepStream):
       self._output_gitiles_commit.CopyFrom(
           jsonpb.Parse(value, common.GitilesCommit()))
     else:
-      self._properties[key] = json.loads(value)
+      size = len(value.encode('utf-8'))
+      if self._max_property_bytes is not None and (
+          size > self._max_property_bytes):
+        log_name = self._spill(
+            'output property %s' % key, value, 'output property %r' % key,
+            size, self._max_property_bytes)
+        self._properties[key] = {'$spilled_to_log': {
+          'step': self._step.name,
+          'log': log_name,
+          'bytes': size,
+        }}
+      else:
+        self._properties[key] = json.loads(value)
 
     self._change_cb()
 
+  def _limit_summary(self, text):
+    """Returns the summary markdown to put in the Build for `text`.
+
+    If `text` is too big, it's spilled into the 'summary' log and replaced
+    with a note pointing there.
+    """
+    size = len(text.encode('utf-8'))
+    if self._max_summary_bytes is None or size <= self._max_summary_bytes:
+      return text
+    log_name = self._spill(
+        'summary', text, 'summary', size, self._max_summary_bytes)
+    return 'The summary (%d bytes) was too big; see the %r log.' % (
+        size, log_name)
+
+  def _spill(self, log_name, text, what, size, limit):
+    """Writes the oversized value `text` to a new log of this step, instead of
+    keeping it in the Build (which is resent with every update).
+
+    Returns the name of the new log.
+    """
+    LOG.warning(
+        'step %r: %s is %d bytes (limit %d); moving it to log %r',
+        self._step.name, what, size, limit, log_name)
+    with self.new_log_stream(log_name) as log:
+      log.write_split(text)
+    self._spill_cb()
+    return log_name
+
   def set_step_tag(self, key, value):
     self._tags.add(key=key, value=value)
     self._change_cb()
@@ -377,10 +488,11 @@ class LUCIStepStream(StreamEngine.StepStream):
     # in that case.
     if self._step.end_time.ToDatetime() < self._step.start_time.ToDatetime():
       self._step.end_time.CopyFrom(self._step.start_time)
-    self._step.summary_markdown = self._back_compat_markdown.render()
+    self._step.summary_markdown = self._limit_summary(
+        self._back_compat_markdown.render())
     if self._step.status == common.STARTED:
       self._step.status = common.SUCCESS
-    self._change_cb()
+    self._change_cb(flush=True)
 
 
 @attr.s
@@ -417,19 +529,61 @@ class LUCIStreamEngine(StreamEngine):
       content_type += '; encoding=zlib'
     return self._bsc.open_datagram('build.proto', content_type=content_type)
 
-  _send_event = attr.ib(default=gevent.event.Event())
+  # The wire encoding (as a Build.steps field) of each step in _build_proto,
+  # or None if it needs to be serialized again.
+  _step_bytes = attr.ib(factory=list)
+  # The indexes of the steps which changed since they were last serialized.
+  _dirty_steps = attr.ib(factory=set)
+  # The number of sends since _step_bytes was last dropped.
+  _sends_since_full = attr.ib(default=0)
+
+  # The bounds (in seconds) of the interval between build.proto sends.
+  _min_send_interval = attr.ib(default=DEFAULT_MIN_SEND_INTERVAL)
+  _max_send_interval = attr.ib(default=DEFAULT_MAX_SEND_INTERVAL)
+  @_max_send_interval.validator
+  def _check_max_send_interval(self, _attrib, value):
+    if not 0 <= self._min_send_interval <= value:
+      raise ValueError(
+          'expected 0 <= min_send_interval <= max_send_interval, got %r and %r'
+          % (self._min_send_interval, value))
+
+  # See LUCIStepStream._max_property_bytes and _max_summary_bytes.
+  _max_property_bytes = attr.ib(default=None)
+  _max_summary_bytes = attr.ib(default=None)
+
+  metrics = attr.ib(factory=SendMetrics)
+
+  _send_event = attr.ib(factory=gevent.event.Event)
+  # Set when an update should be sent without waiting for others to coalesce.
+  _flush_event = attr.ib(factory=gevent.event.Event)
+  # The number of _send calls since the last send.
+  _pending_updates = attr.ib(default=0)
+  _last_send_time = attr.ib(default=None)
   _sender_die = attr.ib(default=False)
 
   _sender = attr.ib()
   @_sender.default
   def _sender_default(self):
-    def _do_send():
-      self._build_stream.send(
-          jsonpb.MessageToJson(self._build_proto,
-                               preserving_proto_field_name=True).encode('utf-8')
-          if self._export_build_as_json else
-          zlib.compress(self._build_proto.SerializeToString())
-      )
+    def _do_send(full=False):
+      start = time.time()
+      if self._export_build_as_json:
+        data = jsonpb.MessageToJson(
+            self._build_proto, preserving_proto_field_name=True).encode('utf-8')
+      else:
+        data = zlib.compress(self._serialize_build(full))
+      elapsed = time.time() - start
+
+      m = self.metrics
+      m.sends += 1
+      m.bytes_sent += len(data)
+      m.last_bytes = len(data)
+      m.serialize_seconds += elapsed
+      m.last_serialize_seconds = elapsed
+      m.coalesced_updates += max(self._pending_updates - 1, 0)
+      self._pending_updates = 0
+      self._last_send_time = time.time()
+
+      self._build_stream.send(data)
 
     def _send_fn():
       while not self._sender_die:
@@ -438,24 +592,111 @@ class LUCIStreamEngine(StreamEngine):
         if self._sender_die:
           break
 
-        # Then wait for a second, in case other updates come in.
-        gevent.sleep(1)
+        # Then wait a bit, in case other updates come in; see _send_interval.
+        self._wait_to_send()
 
         # atomically:
         #   clear the event
         #   serialize the current build proto state (part of _do_send)
         # then send the serialized data asynchronously.
         self._send_event.clear()
+        self._flush_event.clear()
         _do_send()
 
       # One last send before exiting to make sure all build updates are
       # sent to logdog
-      _do_send()
+      _do_send(full=True)
 
     return gevent.spawn(_send_fn)
 
-  def _send(self):
+  def _serialize_build(self, full=False):
+    """Returns the serialized _build_proto.
+
+    Builds may have thousands of steps, most of which don't change between
+    sends. So instead of serializing the whole Build every time, this keeps the
+    encoding of every step around until the step changes (see _step_changed),
+    and splices the cached encodings together with the rest of the Build.
+
+    The result is the same as `_build_proto.SerializeToString()`. Just in case
+    something changes a step without going through its LUCIStepStream, the
+    cache is dropped every _FULL_SERIALIZE_EVERY sends (and when `full` is
+    set).
+    """
+    steps = self._build_proto.steps
+    self._sends_since_full += 1
+    if (full or self._sends_since_full > _FULL_SERIALIZE_EVERY or
+        len(self._step_bytes) > len(steps)):
+      self._step_bytes = []
+      self._sends_since_full = 0
+    for idx in self._dirty_steps:
+      if idx < len(self._step_bytes):
+        self._step_bytes[idx] = None
+    self._dirty_steps.clear()
+    self._step_bytes.extend([None] * (len(steps) - len(self._step_bytes)))
+
+    parts = []
+    # ListFields returns the fields in field number order, which is also the
+    # order SerializeToString uses.
+    for field, value in self._build_proto.ListFields():
+      if field.number == _STEPS_FIELD_NUMBER:
+        for idx, step in enumerate(steps):
+          if self._step_bytes[idx] is None:
+            self._step_bytes[idx] = _length_delimited(
+                _STEPS_FIELD_NUMBER, step.SerializeToString())
+            self.metrics.max_step_bytes = max(
+                self.metrics.max_step_bytes, len(self._step_bytes[idx]))
+        parts.extend(self._step_bytes)
+      elif field.message_type and field.label != field.LABEL_REPEATED:
+        parts.append(_length_delimited(field.number, value.SerializeToString()))
+      else:
+        only_field = Build()
+        if field.label == field.LABEL_REPEATED:
+          getattr(only_field, field.name).extend(value)
+        else:
+          setattr(only_field, field.name, value)
+        parts.append(only_field.SerializeToString())
+    return b''.join(parts)
+
+  def _send_interval(self):
+    """Returns how long (in seconds) to wait between build.proto sends.
+
+    Big builds are expensive to serialize and to upload, so the interval grows
+    with the cost of the last send: the serialization time (times
+    _SERIALIZE_COST_FACTOR) and the payload size (at _SEND_BYTES_PER_SECOND),
+    bounded by the min and max send interval.
+    """
+    interval = max(
+        self._min_send_interval,
+        self.metrics.last_serialize_seconds * _SERIALIZE_COST_FACTOR,
+        float(self.metrics.last_bytes) / _SEND_BYTES_PER_SECOND)
+    return min(interval, self._max_send_interval)
+
+  def _wait_to_send(self):
+    """Blocks until the next build.proto send is due.
+
+    Updates are coalesced for at least the min send interval, and sends are
+    spaced out by _send_interval. Flushes (and close) only need to wait until
+    the min send interval has passed since the last send.
+    """
+    now = time.time()
+    last_send = self._last_send_time
+    if last_send is None:
+      last_send = float('-inf')
+    deadline = max(
+        now + self._min_send_interval, last_send + self._send_interval())
+    if self._flush_event.wait(max(deadline - now, 0)):
+      gevent.sleep(max(last_send + self._min_send_interval - time.time(), 0))
+
+  def _send(self, flush=False):
+    self._pending_updates += 1
     self._send_event.set()
+    if flush:
+      self._flush_event.set()
+
+  def _step_changed(self, idx, flush=False):
+    """Called when the step at `idx` in _build_proto.steps changes."""
+    self._dirty_steps.add(idx)
+    self._send(flush)
 
   def new_step_stream(self, name_tokens, allow_subannotations,
                       merge_step=False):
@@ -469,15 +710,24 @@ class LUCIStreamEngine(StreamEngine):
     ret = LUCIStepStream(
         step_pb, self._build_proto.output.properties, self._build_proto.tags,
         step_pb.tags, self._build_proto.output.gitiles_commit,
-        self._send, self._bsc, merge_step=merge_step)
+        functools.partial(
+            self._step_changed, len(self._build_proto.steps) - 1),
+        self._bsc, merge_step=merge_step,
+        max_property_bytes=self._max_property_bytes,
+        max_summary_bytes=self._max_summary_bytes,
+        spill_cb=self._value_spilled)
     self._send()
     return ret
 
+  def _value_spilled(self):
+    self.metrics.spilled_values += 1
+
   def close(self):
     self._sender_die = True
-    self._send()
+    self._send(flush=True)
     self._sender.join()
     self._build_stream.close()
+    LOG.info('build.proto send metrics: %r', self.metrics)
 
   @property
   def supports_concurrency(self):
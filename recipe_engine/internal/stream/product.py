@@ -32,6 +32,10 @@ class ProductStreamEngine(StreamEngine):
       self._stream_a.write_line(line)
       self._stream_b.write_line(line)
 
+    def write_chunk(self, data):
+      self._stream_a.write_chunk(data)
+      self._stream_b.write_chunk(data)
+
     def handle_exception(self, exc_type, exc_val, exc_tb):
       ret = self._stream_a.handle_exception(exc_type, exc_val, exc_tb)
       ret = ret or self._stream_b.handle_exception(exc_type, exc_val, exc_tb)
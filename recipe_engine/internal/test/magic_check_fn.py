@@ -23,6 +23,7 @@ import astunparse
 from recipe_engine.post_process_inputs import Step
 
 from ...engine_types import FrozenDict
+from ..recipe_index import stat_key
 
 _PY2 = sys.version_info.major == 2
 
@@ -41,22 +42,93 @@ class CheckFrame(namedtuple('CheckFrame', 'fname line function code varmap')):
     return lines
 
 
+# A frame captured by a failed check; its source is only looked up when the
+# check is formatted.
+#
+#   * code (code) - The code object being executed by the frame.
+#   * line (int) - The line number being executed.
+#   * varmap (Dict[str, str]|None) - The rendered variables relevant to the
+#     check, for the innermost frame only.
+_CapturedFrame = namedtuple('_CapturedFrame', 'code line varmap')
+
+
+def _capture_frames(frames, render_varmap):
+  """Captures (frame, lineno) pairs (outermost first) as _CapturedFrame's.
+
+  The variables of the innermost frame are rendered right away with
+  `render_varmap(code, lineno, lvars, gvars)`, since the code which made the
+  check may go on to modify them.
+  """
+  last = len(frames) - 1
+  return [
+    _CapturedFrame(
+        frame.f_code, lineno,
+        render_varmap(frame.f_code, lineno, frame.f_locals, frame.f_globals)
+        if i == last else None)
+    for i, (frame, lineno) in enumerate(frames)
+  ]
+
+
 class Check(namedtuple('Check', (
     'name ctx_filename ctx_lineno ctx_func ctx_args ctx_kwargs '
-    'frames passed'))):
+    'captured_frames passed'))):
   # filename -> {lineno -> [statements]}
   _PARSED_FILE_CACHE = defaultdict(lambda: defaultdict(list))
   _LAMBDA_CACHE = defaultdict(lambda: defaultdict(list))
+  # (filename, lineno) -> rendered code of the statements at that line
+  _CODE_CACHE = {}
+  # (filename, lineno) -> rendered lambda
+  _LAMBDA_NAME_CACHE = {}
+  # filename -> stat_key of the file when it was parsed
+  _PARSED_FILE_STATS = {}
+
+  @classmethod
+  def forget_changed_files(cls):
+    """Drops everything cached about files which changed on disk since they
+    were parsed.
+
+    Only needed by processes which outlive edits to recipe files (i.e. warm test
+    runners).
+    """
+    changed = {
+      filename for filename, key in iteritems(cls._PARSED_FILE_STATS)
+      if stat_key(filename) != key
+    }
+    if not changed:
+      return
+    for filename in changed:
+      del cls._PARSED_FILE_STATS[filename]
+      cls._PARSED_FILE_CACHE.pop(filename, None)
+      cls._LAMBDA_CACHE.pop(filename, None)
+    for cache in (cls._CODE_CACHE, cls._LAMBDA_NAME_CACHE):
+      for key in [key for key in cache if key[0] in changed]:
+        del cache[key]
 
   @classmethod
   def create(cls, name, hook_context, frames, passed, ignore_set,
              additional_varmap=None):
+    """Creates a Check from the failure at the innermost of `frames`.
+
+    Only the frames' code, line numbers and the rendered variables relevant to
+    the check are captured here; rendering the source of the frames is deferred
+    until the check is formatted (see `frames`).
+
+    Args:
+      * name (str) - The name (hint) of the check.
+      * hook_context (PostprocessHookContext) - The post process hook being run.
+      * frames (List[Tuple[frame, int]]) - The (frame, lineno) pairs relevant
+        to the check, outermost first.
+      * passed (bool) - Whether the check passed.
+      * ignore_set (Set[int]) - The ids of the objects to never render.
+      * additional_varmap (Dict[str, str]|None) - Additional (rendered)
+        variables to show for the innermost frame.
+    """
+    def _render_varmap(code, line, lvars, gvars):
+      return cls._render_varmap(
+          code, line, lvars, gvars, ignore_set, additional_varmap)
+
     try:
-      keep_frames = [cls._process_frame(f, ignore_set, with_vars=False)
-                     for f in frames[:-1]]
-      keep_frames.append(cls._process_frame(
-          frames[-1], ignore_set, with_vars=True,
-          additional_varmap=additional_varmap))
+      captured_frames = _capture_frames(frames, _render_varmap)
     finally:
       # avoid reference cycle as suggested by inspect docs.
       del frames
@@ -68,10 +140,21 @@ class Check(namedtuple('Check', (
         cls._get_name_of_callable(hook_context.func),
         [repr(arg) for arg in hook_context.args],
         {k: repr(v) for k, v in iteritems(hook_context.kwargs)},
-        keep_frames,
+        captured_frames,
         passed,
     )
 
+  @property
+  def frames(self):
+    """The CheckFrame's for this check (outermost first), rendered on first
+    access."""
+    frames = self.__dict__.get('_frames')
+    if frames is None:
+      frames = self.__dict__['_frames'] = [
+        self._process_frame(f) for f in self.captured_frames
+      ]
+    return frames
+
   @classmethod
   def _get_name_of_callable(cls, c):
     if inspect.ismethod(c):
@@ -79,24 +162,30 @@ class Check(namedtuple('Check', (
     if inspect.isfunction(c):
       if c.__name__ == (lambda: None).__name__:
         filename = c.__code__.co_filename
-        cls._ensure_file_in_cache(filename, c)
-        definitions = cls._LAMBDA_CACHE[filename][c.__code__.co_firstlineno]
-        assert definitions
-        # If there's multiple definitions at the same line, there's not enough
-        # information to distinguish which lambda c refers to, so just let
-        # python's generic lambda name be used
-        if len(definitions) == 1:
-          return astunparse.unparse(definitions[0]).strip()
+        key = (filename, c.__code__.co_firstlineno)
+        name = cls._LAMBDA_NAME_CACHE.get(key)
+        if name is None:
+          cls._ensure_file_in_cache(filename, c)
+          definitions = cls._LAMBDA_CACHE[filename][c.__code__.co_firstlineno]
+          assert definitions
+          # If there's multiple definitions at the same line, there's not
+          # enough information to distinguish which lambda c refers to, so just
+          # let python's generic lambda name be used
+          if len(definitions) == 1:
+            name = astunparse.unparse(definitions[0]).strip()
+          else:
+            name = c.__name__
+          cls._LAMBDA_NAME_CACHE[key] = name
+        return name
       return c.__name__
     if hasattr(c, '__call__'):
       return c.__class__.__name__+'.__call__'
     return repr(c)
 
   @classmethod
-  def _get_statements_for_frame(cls, frame):
-    raw_frame, filename, lineno, _, _, _ = frame
-    cls._ensure_file_in_cache(filename, raw_frame)
-    return cls._PARSED_FILE_CACHE[filename][lineno]
+  def _get_statements(cls, filename, line, code):
+    cls._ensure_file_in_cache(filename, code)
+    return cls._PARSED_FILE_CACHE[filename][line]
 
   @classmethod
   def _ensure_file_in_cache(cls, filename, obj_with_code):
@@ -110,6 +199,7 @@ class Check(namedtuple('Check', (
     once.
     """
     if filename not in cls._PARSED_FILE_CACHE:
+      cls._PARSED_FILE_STATS[filename] = stat_key(filename)
       # multi-statement nodes like Module, FunctionDef, etc. have attributes on
       # them like 'body' which house the list of statements they contain. The
       # `to_push` list here is the set of all such attributes across all ast
@@ -178,11 +268,10 @@ class Check(namedtuple('Check', (
             cls._PARSED_FILE_CACHE[filename][lambda_max_line].append(n)
 
   @classmethod
-  def _process_frame(cls, frame, ignore_set, with_vars, additional_varmap=None):
-    """This processes a stack frame into an expect_tests.CheckFrame, which
-    includes file name, line number, function name (of the function containing
-    the frame), the parsed statement at that line, and the relevant local
-    variables/subexpressions (if with_vars is True).
+  def _render_varmap(cls, code, line, lvars, gvars, ignore_set,
+                     additional_varmap):
+    """Renders the local variables/subexpressions of the statement at `line`
+    of `code` which are relevant to a check.
 
     In addition to transforming the expression with _checkTransformer, this
     will:
@@ -190,34 +279,45 @@ class Check(namedtuple('Check', (
       * omit the overall step ordered dictionary
       * transform all subexpression values using render_user_value().
     """
-    nodes = cls._get_statements_for_frame(frame)
-    raw_frame, filename, lineno, func_name, _, _ = frame
+    nodes = cls._get_statements(code.co_filename, line, code)
+    varmap = dict(additional_varmap or {})
 
-    varmap = None
-    if with_vars:
-      varmap = dict(additional_varmap or {})
+    xfrmr = _checkTransformer(lvars, gvars)
+    xfrmd = xfrmr.visit(ast.Module(copy.deepcopy(nodes)))
 
-      xfrmr = _checkTransformer(raw_frame.f_locals, raw_frame.f_globals)
-      xfrmd = xfrmr.visit(ast.Module(copy.deepcopy(nodes)))
+    for n in itertools.chain(ast.walk(xfrmd), xfrmr.extras):
+      if isinstance(n, _resolved):
+        val = n.value
+        if isinstance(val, ast.AST):
+          continue
+        if n.representation in ('True', 'False', 'None'):
+          continue
+        if callable(val) or id(val) in ignore_set:
+          continue
+        if n.representation not in varmap:
+          varmap[n.representation] = render_user_value(val)
+    return varmap
 
-      for n in itertools.chain(ast.walk(xfrmd), xfrmr.extras):
-        if isinstance(n, _resolved):
-          val = n.value
-          if isinstance(val, ast.AST):
-            continue
-          if n.representation in ('True', 'False', 'None'):
-            continue
-          if callable(val) or id(val) in ignore_set:
-            continue
-          if n.representation not in varmap:
-            varmap[n.representation] = render_user_value(val)
+  @classmethod
+  def _process_frame(cls, frame):
+    """This processes a _CapturedFrame into an expect_tests.CheckFrame, which
+    includes file name, line number, function name (of the function containing
+    the frame), the parsed statement at that line, and the relevant local
+    variables/subexpressions (if the frame captured them).
+    """
+    filename = frame.code.co_filename
+    code = cls._CODE_CACHE.get((filename, frame.line))
+    if code is None:
+      nodes = cls._get_statements(filename, frame.line, frame.code)
+      code = cls._CODE_CACHE[filename, frame.line] = '; '.join(
+          astunparse.unparse(n).strip() for n in nodes)
 
     return CheckFrame(
       filename,
-      lineno,
-      func_name,
-      '; '.join(astunparse.unparse(n).strip() for n in nodes),
-      varmap
+      frame.line,
+      frame.code.co_name,
+      code,
+      frame.varmap
     )
 
   def format(self):
@@ -458,24 +558,26 @@ class Checker(object):
       return
 
     # Grab all frames between (non-inclusive) the creation of the checker and
-    # self.__call__
+    # self.__call__. The raw frames are walked instead of using inspect.stack(),
+    # which looks up the source of every frame on the stack.
+    frames = []
     try:
       # Skip over the __call__ and _call_impl frames and order it so that
       # innermost frame is at the bottom
-      frames = inspect.stack()[2:][::-1]
-
-      try:
-        for i, f in enumerate(frames):
-          # The first frame that has self in the local variables is the one
-          # where the checker is created. We must use `is` for equality check
-          # here because otherwise we might end up calling an unrelated object's
-          # __eq__ method.
-          if any(self is obj for obj in itervalues(f[0].f_locals)):
-            break
-        frames = frames[i+1:]
-
-      finally:
-        del f
+      f = sys._getframe(2)  # pylint: disable=protected-access
+      while f is not None:
+        frames.append((f, f.f_lineno))
+        f = f.f_back
+      frames.reverse()
+
+      for i, (f, _) in enumerate(frames):
+        # The first frame that has self in the local variables is the one
+        # where the checker is created. We must use `is` for equality check
+        # here because otherwise we might end up calling an unrelated object's
+        # __eq__ method.
+        if any(self is obj for obj in itervalues(f.f_locals)):
+          break
+      frames = frames[i+1:]
 
       self.failed_checks.append(Check.create(
           hint,
@@ -486,7 +588,7 @@ class Checker(object):
       ))
     finally:
       # avoid reference cycle as suggested by inspect docs.
-      del frames
+      del f, frames
 
   def __call__(self, arg1, arg2=MISSING):
     if arg2 is not MISSING:
@@ -585,6 +687,16 @@ def VerifySubset(a, b):
     return ': unknown type: %r' % (type(a).__name__)
 
 
+def _traceback_frames(tb):
+  """Returns the (frame, lineno) pairs of the traceback `tb`, outermost
+  first."""
+  frames = []
+  while tb is not None:
+    frames.append((tb.tb_frame, tb.tb_lineno))
+    tb = tb.tb_next
+  return frames
+
+
 class PostProcessError(ValueError):
   """Exception raised when any of the post-process hooks fails."""
   pass
@@ -609,8 +721,15 @@ def post_process(test_failures, raw_expectations, test_data):
   Side-effect: updates test_failures with the formatted check failures.
   """
   failed_checks = []
+  # The hooks get Steps which share their values with `raw_expectations`,
+  # instead of a deep copy each. Most hooks only read them; a pristine copy is
+  # used to undo the changes of any hook which modifies them without returning
+  # them, and to verify the steps which a hook returns.
+  pristine = None
   for hook, args, kwargs, context in test_data.post_process_hooks:
-    steps = copy.deepcopy(raw_expectations)
+    if pristine is None:
+      pristine = copy.deepcopy(raw_expectations)
+    steps = copy.copy(raw_expectations)
     # The checker MUST be saved to a local variable in order for it to be able
     # to correctly detect the frames to keep when creating a failure backtrace
     check = Checker(context, steps)
@@ -625,18 +744,22 @@ def post_process(test_failures, raw_expectations, test_data):
         failed_checks.append(Check.create(
             '',
             context,
-            inspect.getinnerframes(exc_traceback)[1:],
+            _traceback_frames(exc_traceback.tb_next),
             False,
             check._ignore_set,
             {'raised exception':
              '%s: %s' % (exc_type.__name__, exc_value)},
-        ))
+        ).format())
       finally:
         # avoid reference cycle as suggested by inspect docs.
         del exc_traceback
+      if raw_expectations != pristine:
+        raw_expectations, pristine = pristine, None
       continue
 
-    failed_checks += check.failed_checks
+    # Render the failed checks before the next hook can modify the values they
+    # refer to.
+    failed_checks.extend(c.format() for c in check.failed_checks)
     if rslt is not None:
       for k, v in iteritems(rslt):
         if isinstance(v, Step):
@@ -645,16 +768,19 @@ def post_process(test_failures, raw_expectations, test_data):
           cmd = rslt[k].get('cmd', None)
           if cmd is not None:
             rslt[k]['cmd'] = list(cmd)
-      msg = VerifySubset(rslt, raw_expectations)
+      msg = VerifySubset(rslt, pristine)
       if msg:
         raise PostProcessError('post process: steps' + msg)
       # restore 'name' if it was removed
       for k, v in iteritems(rslt):
         v['name'] = k
-      raw_expectations = rslt
+      raw_expectations, pristine = rslt, None
+    elif raw_expectations != pristine:
+      # Discard the changes.
+      raw_expectations, pristine = pristine, None
 
-  for check in failed_checks:
-    test_failures.check.add(lines=check.format())
+  for lines in failed_checks:
+    test_failures.check.add(lines=lines)
 
   # Empty means drop expectations
   return list(itervalues(raw_expectations)) if raw_expectations else None
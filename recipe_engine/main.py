@@ -16,6 +16,9 @@ import errno
 import os
 import time
 
+# When the engine started loading; see startup_profile.
+_START = time.time()
+
 # Hack 1; crbug.com/980535
 #
 # On OS X there seems to be an issue with subprocess's use of its error
@@ -79,8 +82,11 @@ except ImportError:
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, ROOT_DIR)
 
+from recipe_engine.internal import startup_profile
 from recipe_engine.internal.commands import parse_and_run
 
+startup_profile.record('engine imports', _START)
+
 
 def _strip_virtualenv():
   # Prune all evidence of VPython/VirtualEnv out of the environment. This means
@@ -131,16 +131,25 @@ class PathsClient(object):
     self.path_strings = []
     self._start_dir = start_dir
 
-  def _initialize_with_recipe_api(self, root_api):
+  def _initialize_with_recipe_api(self, root_api, imported_modules=()):
     """This method is called once before the start of every recipe.
 
     It is passed the recipe's `api` object. This method crawls the api object
-    and extracts every resource base path it can find."""
+    and extracts every resource base path it can find.
+
+    It is also passed the imported recipe modules the recipe depends on, whose
+    resource base paths are added even if their api hasn't been instantiated
+    (yet) because the repo uses lazy_module_init."""
     paths_found = {}
     def add_found(path):
       if path is not None:
         paths_found[str(path)] = path
 
+    for module in imported_modules:
+      # The same paths as RecipeApiPlain.resource() and .repo_resource().
+      add_found(module.RESOURCE_DIRECTORY)
+      add_found(module.REPO_ROOT)
+
     search_set = [root_api]
     found_api_id_set = {id(root_api)}
     while search_set:
@@ -55,6 +55,14 @@ class ModuleInjectionSite(object):
     self.owner_module = owner_module
 
   def __getattr__(self, key):
+    # Lazily instantiated dependencies are instantiated on first access, and
+    # are then set directly on this object (see recipe_deps._resolve).
+    lazy_deps = self.__dict__.get('_lazy_deps')
+    if lazy_deps and key in lazy_deps:
+      value = self.__dict__[key] = lazy_deps[key]()
+      del lazy_deps[key]
+      return value
+
     if self.owner_module is None:
       raise ModuleInjectionError(
         "RecipeApi has no dependency %r. (Add it to DEPS?)" % (key,))
@@ -6,6 +6,10 @@ DEPS = [
   'platform',
 ]
 
+# String functions on Path objects rely on this module being instantiated, so it
+# must be instantiated before RunSteps.
+EAGER_INIT = True
+
 from recipe_engine.recipe_api import Property
 from recipe_engine.config import ConfigGroup, Single
 
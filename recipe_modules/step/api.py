@@ -21,6 +21,12 @@ from recipe_engine.util import Placeholder, returns_placeholder
 from PB.go.chromium.org.luci.buildbucket.proto import build as build_pb2
 from PB.go.chromium.org.luci.buildbucket.proto import common as common_pb2
 
+# The engine checks the size of a step's presentation when it closes the step
+# (i.e. when the next step starts). These warnings should be attributed to the
+# recipe code which did that, not to this module.
+_STEP_CLOSE_WARNINGS = (
+    r'^recipe_engine/(BUILD_PROPERTY|STEP_SUMMARY)_TOO_LARGE$')
+
 # Inherit from RecipeApiPlain because the only thing which is a step is
 # run_from_dict()
 class StepApi(recipe_api.RecipeApiPlain):
@@ -185,6 +191,7 @@ class StepApi(recipe_api.RecipeApiPlain):
     """
     return self.step_client.previous_step_result()
 
+  @recipe_api.escape_warnings(_STEP_CLOSE_WARNINGS)
   def close_non_nest_step(self):
     """Call this to explicitly terminate the currently open non-nest step.
 
@@ -220,6 +227,7 @@ class StepApi(recipe_api.RecipeApiPlain):
       setattr(self.presentation, name, value)
 
   @contextlib.contextmanager
+  @recipe_api.escape_warnings(_STEP_CLOSE_WARNINGS)
   def nest(self, name, status='worst'):
     """Nest allows you to nest steps hierarchically on the build UI.
 
@@ -313,6 +321,7 @@ class StepApi(recipe_api.RecipeApiPlain):
             pres.status = self.SUCCESS
 
   # pylint: disable=too-many-arguments
+  @recipe_api.escape_warnings(_STEP_CLOSE_WARNINGS)
   def empty(self,
             name,
             status="SUCCESS",
@@ -485,6 +494,7 @@ class StepApi(recipe_api.RecipeApiPlain):
     return self._raise_on_disallowed_statuses(
         result, [self.SUCCESS], status_override=status_override)
 
+  @recipe_api.escape_warnings(_STEP_CLOSE_WARNINGS)
   def _run_or_raise_step(self, step_config):
     ret = self.step_client.run_step(step_config)
     allowed_statuses = [self.SUCCESS]
@@ -493,6 +503,7 @@ class StepApi(recipe_api.RecipeApiPlain):
     return self._raise_on_disallowed_statuses(ret, allowed_statuses)
 
   @recipe_api.composite_step
+  @recipe_api.escape_warnings(_STEP_CLOSE_WARNINGS)
   def sub_build(self,
                 name,
                 cmd,
@@ -615,6 +626,7 @@ class StepApi(recipe_api.RecipeApiPlain):
         ))
 
   @recipe_api.composite_step
+  @recipe_api.escape_warnings(_STEP_CLOSE_WARNINGS)
   def __call__(self,
                name,
                cmd,
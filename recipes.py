@@ -25,12 +25,14 @@ To fix bugs, fix in the googlesource repo then run the autoroller.
 # pylint: disable=wrong-import-position
 import argparse
 import errno
+import hashlib
 import json
 import logging
 import os
 import shutil
 import subprocess
 import sys
+import time
 
 import urllib.parse as urlparse
 
@@ -45,6 +47,9 @@ from collections import namedtuple
 #   refs/heads/main)
 EngineDep = namedtuple('EngineDep', 'url revision branch')
 
+# When this script started; see --profile-startup.
+_START = time.time()
+
 
 class MalformedRecipesCfg(Exception):
 
@@ -113,6 +118,50 @@ CIPD = 'cipd' + _BAT
 REQUIRED_BINARIES = {GIT, CIPD}
 
 
+# Name of the file (inside the engine checkout's .git directory) recording the
+# engine checkout which was last verified with git; see checkout_engine.
+_STAMP_NAME = 'recipes_py_stamp.json'
+
+
+def _checkout_stamp(dep, engine_path):
+  """Returns the stamp for the engine checkout at `engine_path`, as it would be
+  once it's verified to be at `dep`, or None if `engine_path` has no git index.
+
+  The stamp has the hash of the engine dep from recipes.cfg, and the mtime and
+  size of the checkout's git index (which git rewrites whenever HEAD or the
+  index change, e.g. on `git reset` or `git checkout`).
+  """
+  try:
+    index = os.stat(os.path.join(engine_path, '.git', 'index'))
+  except OSError:
+    return None
+  dep_hash = hashlib.sha256(
+      json.dumps(dep._asdict(), sort_keys=True).encode('utf-8')).hexdigest()
+  return {
+      'revision': dep.revision,
+      'dep_hash': dep_hash,
+      'index': [index.st_mtime_ns, index.st_size],
+  }
+
+
+def _read_stamp(stamp_path):
+  try:
+    with open(stamp_path, encoding='utf-8') as stamp:
+      return json.load(stamp)
+  except (OSError, ValueError):
+    return None
+
+
+def _write_stamp(stamp_path, value):
+  tmp_path = f'{stamp_path}.{os.getpid()}.tmp'
+  try:
+    with open(tmp_path, 'w', encoding='utf-8') as stamp:
+      json.dump(value, stamp)
+    os.replace(tmp_path, stamp_path)
+  except OSError as exc:
+    logging.warning('failed to write %r: %s', stamp_path, exc)
+
+
 def _is_executable(path):
   return os.path.isfile(path) and os.access(path, os.X_OK)
 
@@ -139,22 +188,29 @@ def parse_args(argv):
   about. Currently this consists of:
     * an override for the recipe engine in the form of `-O recipe_engine=/path`
     * the --package option.
+    * whether the --profile-startup option is set.
   """
   override_prefix = 'recipe_engine='
 
   parser = argparse.ArgumentParser(add_help=False)
   parser.add_argument('-O', '--project-override', action='append')
   parser.add_argument('--package', type=os.path.abspath)
+  parser.add_argument('--profile-startup')
   args, _ = parser.parse_known_args(argv)
+  profile = args.profile_startup is not None
   for override in args.project_override or ():
     if override.startswith(override_prefix):
-      return override[len(override_prefix):], args.package
-  return None, args.package
+      return override[len(override_prefix):], args.package, profile
+  return None, args.package, profile
 
 
 def checkout_engine(engine_path, repo_root, recipes_cfg_path):
   """Checks out the recipe_engine repo pinned in recipes.cfg.
 
+  Verifying the checkout takes several git invocations, so once it's verified,
+  a stamp is recorded in the checkout's .git directory (see `_checkout_stamp`).
+  If the stamp still matches on the next run, git isn't invoked at all.
+
   Returns the path to the recipe engine repo.
   """
   dep, recipes_path = parse(repo_root, recipes_cfg_path)
@@ -174,6 +230,13 @@ def checkout_engine(engine_path, repo_root, recipes_cfg_path):
     # Ensure that we have the recipe engine cloned.
     engine_path = os.path.join(recipes_path, '.recipe_deps', 'recipe_engine')
 
+    # Without a pinned revision, the engine is re-fetched every time.
+    stamp_path = os.path.join(engine_path, '.git', _STAMP_NAME)
+    stamp = _checkout_stamp(dep, engine_path) if revision else None
+    if stamp and _read_stamp(stamp_path) == stamp:
+      logging.info('engine checkout matches %r', stamp_path)
+      return engine_path
+
     # Note: this logic mirrors the logic in recipe_engine/fetch.py
     _git_check_call(['init', engine_path], stdout=subprocess.DEVNULL)
 
@@ -203,6 +266,9 @@ def checkout_engine(engine_path, repo_root, recipes_cfg_path):
     # or things will get squirrely.
     _git_check_call(['clean', '-qxf'], cwd=engine_path)
 
+    if revision:
+      _write_stamp(stamp_path, _checkout_stamp(dep, engine_path))
+
   return engine_path
 
 
@@ -215,7 +281,7 @@ def main():
     logging.getLogger().setLevel(logging.INFO)
 
   args = sys.argv[1:]
-  engine_override, recipes_cfg_path = parse_args(args)
+  engine_override, recipes_cfg_path, profile = parse_args(args)
 
   if recipes_cfg_path:
     # calculate repo_root from recipes_cfg_path
@@ -229,7 +295,9 @@ def main():
     repo_root = os.path.abspath(repo_root).decode()
     recipes_cfg_path = os.path.join(repo_root, 'infra', 'config', 'recipes.cfg')
     args = ['--package', recipes_cfg_path] + args
+  checkout_start = time.time()
   engine_path = checkout_engine(engine_override, repo_root, recipes_cfg_path)
+  checkout_end = time.time()
 
   vpython = 'vpython3' + _BAT
   if not shutil.which(vpython):
@@ -239,6 +307,15 @@ def main():
     vpython, '-u', os.path.join(engine_path, 'recipe_engine', 'main.py'),
   ] + args)
 
+  if profile:
+    # The engine picks these up and adds them to its startup profile.
+    os.environ['RECIPES_STARTUP_PROFILE'] = json.dumps([
+      [name, start * 1e6, end * 1e6] for name, start, end in (
+        ('recipes.py', _START, time.time()),
+        ('checkout_engine', checkout_start, checkout_end),
+      )
+    ])
+
   if IS_WIN:
     # No real 'exec' on windows; set these signals to ignore so that they
     # propagate to our children but we still wait for the child process to quit.
@@ -129,6 +129,18 @@ class TestChecker(test_env.RecipeEngineUnitTest):
       self.sanitize(c.failed_checks[0].frames[0]),
       self.mk('body', 'check((val is False))', {'val': 'True'}))
 
+  def test_var_fail_in_loop(self):
+    c = Checker(HOOK_CONTEXT)
+    def body(check):
+      for val in (1, 2):
+        check(val == 3)
+    body(c)
+    self.assertEqual(len(c.failed_checks), 2)
+    self.assertEqual(
+      [self.sanitize(check.frames[0]) for check in c.failed_checks],
+      [self.mk('body', 'check((val == 3))', {'val': '1'}),
+       self.mk('body', 'check((val == 3))', {'val': '2'})])
+
   def test_dict_membership(self):
     c = Checker(HOOK_CONTEXT)
     def body(check):
@@ -169,6 +181,26 @@ class TestChecker(test_env.RecipeEngineUnitTest):
       self.mk('body', "check(('me' == targ['a'][sub]))",
               {"targ['a'][sub]": "'whee'", 'sub': "'sub'"}))
 
+  def test_modified_after_fail(self):
+    c = Checker(HOOK_CONTEXT)
+    def body(check):
+      targ = {'a': ['x'], 'c': 'd'}
+      check('y' in targ['a'])
+      check('b' in targ)
+      # The failures show the values at the time of the check.
+      targ['a'].append('y')
+      del targ['c']
+    body(c)
+    self.assertEqual(len(c.failed_checks), 2)
+    self.assertEqual(
+      self.sanitize(c.failed_checks[0].frames[0]),
+      self.mk('body', "check(('y' in targ['a']))",
+              {"targ['a']": "['x']"}))
+    self.assertEqual(
+      self.sanitize(c.failed_checks[1].frames[0]),
+      self.mk('body', "check(('b' in targ))",
+              {'targ.keys()': "['a', 'c']"}))
+
   def test_lambda_call(self):
     c = Checker(HOOK_CONTEXT)
     def body(check):
@@ -567,6 +599,40 @@ class TestPostProcessHooks(test_env.RecipeEngineUnitTest):
     with self.assertRaises(PostProcessError):
       post_process(Outcome.Results(), d, test_data)
 
+  def test_modifying_without_returning(self):
+    d = OrderedDict([
+        ('x', {'name': 'x', 'cmd': ['one'], 'env': {'A': 'a'}}),
+        ('y', {'name': 'y', 'cmd': []}),
+    ])
+    def modify(check, steps):
+      steps['x'].env['A'] = 'modified'
+      steps['x'].cmd.append('two')
+      del steps['y']
+    def verify(check, steps):
+      check(steps['x'].env == {'A': 'a'})
+      check(steps['x'].cmd == ['one'])
+      check('y' in steps)
+    api = self.mkApi()
+    test_data = api.post_process(modify) + api.post_process(verify)
+    results = Outcome.Results()
+    expectations = post_process(results, d, test_data)
+    self.assertEqual(expectations, [
+        {'name': 'x', 'cmd': ['one'], 'env': {'A': 'a'}},
+        {'name': 'y', 'cmd': []},
+    ])
+    self.assertEqual(len(results.check), 0)
+
+  def test_returning_modified_nonsubset(self):
+    d = OrderedDict([
+        ('x', {'name': 'x', 'cmd': ['one'], 'env': {'A': 'a'}}),
+    ])
+    def modify(check, steps):
+      steps['x'].env['B'] = 'b'
+      return steps
+    test_data = self.mkApi().post_process(modify)
+    with self.assertRaises(PostProcessError):
+      post_process(Outcome.Results(), d, test_data)
+
   def test_removing_name(self):
     d = OrderedDict([
         ('x', {'name': 'x', 'cmd': ['one', 'two', 'three']}),
@@ -66,6 +66,25 @@ class ErrorsTest(test_env.RecipeEngineUnitTest):
     self._test_cmd(
         deps, ['run', 'foo'], retcode=1, asserts=_assert_nomodule)
 
+  def test_cyclical_module_dependency(self):
+    deps = self.FakeRecipeDeps()
+    with deps.main_repo.write_recipe('foo') as recipe:
+      recipe.DEPS = ['chicken']
+
+    with deps.main_repo.write_module('chicken') as mod:
+      mod.DEPS.append('egg')
+
+    with deps.main_repo.write_module('egg') as mod:
+      mod.DEPS.append('chicken')
+
+    def _assert_cycle(output):
+      self.assertIn(
+          "'main/chicken' has a cyclical dependency. Loading chain "
+          "[('main', 'chicken'), ('main', 'egg')].", output)
+
+    self._test_cmd(
+        deps, ['run', 'foo'], retcode=1, asserts=_assert_cycle)
+
   def test_no_such_recipe(self):
     deps = self.FakeRecipeDeps()
     result = self._test_cmd(
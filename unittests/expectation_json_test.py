@@ -0,0 +1,63 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import collections
+import json
+
+import test_env
+
+from recipe_engine.engine_types import FrozenDict
+from recipe_engine.internal.commands.test import expectation_json
+
+
+def _json_dumps(obj):
+  return json.dumps(obj, sort_keys=True, indent=2, separators=(',', ': '))
+
+
+class TestDumps(test_env.RecipeEngineUnitTest):
+  def test_matches_json(self):
+    for obj in [
+        None, True, False, 0, -3, 2**70, 1.5, float('nan'), float('inf'),
+        -float('inf'), '', 'hi', u'☃ "quoted"\n', [], {}, [[]], [{}],
+        {'': {}},
+        [1, 'two', [3, None], {'four': 4.0}],
+        {'b': [1, 2], 'a': {'z': None, 'y': [True, False]}},
+        {2: 'int', 2.5: 'float', False: 'bool'},
+        collections.OrderedDict([('z', 1), ('a', 2)]),
+        [{
+          'cmd': ['echo', 'hi'],
+          'env': {'PATH': '/bin'},
+          'name': 'step',
+          '~followup_annotations': ['@@@STEP_LOG_LINE@log@line@@@'],
+        }, {
+          'name': '$result',
+        }],
+    ]:
+      self.assertEqual(expectation_json.dumps(obj), _json_dumps(obj))
+
+  def test_decodes_bytes(self):
+    self.assertEqual(
+        expectation_json.dumps({b'key': [b'value', b'\xff']}),
+        _json_dumps({'key': ['value', u'�']}))
+
+  def test_generic_containers(self):
+    self.assertEqual(
+        expectation_json.dumps(FrozenDict(b=(i for i in range(2)), a=())),
+        _json_dumps({'b': [0, 1], 'a': []}))
+    self.assertEqual(
+        expectation_json.dumps({'keys': {'a': 1}.keys(), 'set': {3}}),
+        _json_dumps({'keys': ['a'], 'set': [3]}))
+
+  def test_bad_types(self):
+    with self.assertRaises(TypeError):
+      expectation_json.dumps([object()])
+    with self.assertRaises(TypeError):
+      expectation_json.dumps({(1, 2): 'tuple key'})
+    with self.assertRaises(TypeError):
+      expectation_json.dumps({1: 'mixed', 'a': 'keys'})
+
+
+if __name__ == '__main__':
+  test_env.main()
@@ -351,8 +351,8 @@ class FakeRecipeRepo(object):
     The PROPERTIES attribute is a Python expression to assign to the module's
     PROPERTIES field.
 
-    The DISABLE_STRICT_COVERAGE maps directly to the same-named option in
-    `__init__.py`.
+    The DISABLE_STRICT_COVERAGE and EAGER_INIT attributes map directly to the
+    same-named options in `__init__.py`.
     """
     path = attr.ib()  # base path of the module folder
 
@@ -366,6 +366,7 @@ class FakeRecipeRepo(object):
     ENV_PROPERTIES = attr.ib(default='None')
     WARNINGS = attr.ib(factory=list)
     DISABLE_STRICT_COVERAGE = attr.ib(default=False)
+    EAGER_INIT = attr.ib(default=False)
 
   @contextlib.contextmanager
   def write_module(self, mod_name):
@@ -404,6 +405,8 @@ class FakeRecipeRepo(object):
 
       DISABLE_STRICT_COVERAGE = {DISABLE_STRICT_COVERAGE!r}
 
+      {eager_init}
+
       PROPERTIES = {PROPERTIES}
       GLOBAL_PROPERTIES = {GLOBAL_PROPERTIES}
       ENV_PROPERTIES = {ENV_PROPERTIES}
@@ -412,6 +415,8 @@ class FakeRecipeRepo(object):
           DEPS=mod.DEPS,
           WARNINGS = mod.WARNINGS,
           DISABLE_STRICT_COVERAGE=mod.DISABLE_STRICT_COVERAGE,
+          # Only written when set, so it doesn't change coverage numbers.
+          eager_init='EAGER_INIT = True' if mod.EAGER_INIT else '',
           PROPERTIES=mod.PROPERTIES,
           GLOBAL_PROPERTIES=mod.GLOBAL_PROPERTIES,
           ENV_PROPERTIES=mod.ENV_PROPERTIES,
@@ -4,6 +4,7 @@
 # that can be found in the LICENSE file.
 
 import json
+import os
 import subprocess
 
 from unittest import mock
@@ -342,5 +343,82 @@ class TestGit(test_env.RecipeEngineUnitTest):
     self.assertMultiDone(git)
 
 
+class TestGitCache(test_env.RecipeEngineUnitTest):
+  def setUp(self):
+    super(TestGitCache, self).setUp()
+    fetch.Backend._GIT_METADATA_CACHE = {}
+    self.upstream = self.tempdir()
+    self.git(self.upstream, 'init', '-q', '-b', 'main')
+    self.revisions = [self.commit('one'), self.commit('two')]
+    self.cache = os.path.join(self.tempdir(), 'cache')
+    self.work = self.tempdir()
+
+  def git(self, cwd, *args):
+    return subprocess.check_output(('git',) + args, cwd=cwd, text=True).strip()
+
+  def commit(self, contents):
+    with open(os.path.join(self.upstream, 'file'), 'w') as f:
+      f.write(contents)
+    self.git(self.upstream, 'add', 'file')
+    self.git(self.upstream, 'commit', '-q', '-m', contents)
+    return self.git(self.upstream, 'rev-parse', 'HEAD')
+
+  def checkout(self, name, revision):
+    """Checks out `revision` in the `name` checkout, returning the number of
+    fetches it did."""
+    real_execute = fetch.GitBackend._execute
+    fetches = []
+    def _execute(backend, *args):
+      if 'fetch' in args:
+        fetches.append(args)
+      return real_execute(backend, *args)
+
+    checkout_dir = os.path.join(self.work, name)
+    with mock.patch.object(fetch.GitBackend, '_execute', _execute):
+      fetch.GitBackend(checkout_dir, self.upstream, self.cache).checkout(
+          'refs/heads/main', revision)
+    self.assertEqual(
+        self.git(checkout_dir, 'rev-parse', 'HEAD'), revision)
+    return len(fetches)
+
+  def test_shared(self):
+    self.assertEqual(self.checkout('a', self.revisions[0]), 1)
+    # A second checkout of the same repo finds everything in the cache.
+    self.assertEqual(self.checkout('b', self.revisions[0]), 0)
+    self.assertEqual(self.checkout('b', self.revisions[1]), 0)
+
+    cache_dirs = [d for d in os.listdir(self.cache) if not d.endswith('.lock')]
+    self.assertEqual(len(cache_dirs), 1)
+    cache_objects = os.path.join(self.cache, cache_dirs[0], '.git', 'objects')
+    for name in ('a', 'b'):
+      with open(os.path.join(self.work, name, '.git', 'objects', 'info',
+                             'alternates')) as f:
+        self.assertEqual(f.read(), cache_objects + '\n')
+
+  def test_new_revision(self):
+    self.checkout('a', self.revisions[0])
+    new_revision = self.commit('three')
+    self.assertEqual(self.checkout('b', new_revision), 1)
+    self.assertEqual(self.checkout('a', new_revision), 0)
+
+  def test_gc(self):
+    self.checkout('a', self.revisions[0])
+    new_revision = self.commit('three')
+    self.checkout('a', new_revision)
+    cache_dir = os.path.join(self.cache, [
+        d for d in os.listdir(self.cache) if not d.endswith('.lock')][0])
+    self.assertEqual(
+        self.git(cache_dir, 'for-each-ref', '--format=%(objectname)',
+                 'refs/cache/').split(),
+        sorted([self.revisions[1], new_revision]))
+
+    # Everything fetched survives gc, so new checkouts still don't fetch.
+    self.git(cache_dir, 'gc', '-q', '--prune=now')
+    self.assertEqual(
+        self.git(cache_dir, 'count-objects', '-v').splitlines()[0], 'count: 0')
+    self.assertEqual(self.checkout('b', self.revisions[0]), 0)
+    self.assertEqual(self.checkout('c', new_revision), 0)
+
+
 if __name__ == '__main__':
   test_env.main()
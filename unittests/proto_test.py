@@ -8,9 +8,13 @@ import os
 import shutil
 import subprocess
 import textwrap
+import time
+
+import mock
 
 import test_env
 
+from recipe_engine.internal import proto_support
 from recipe_engine.internal.simple_cfg import RECIPES_CFG_LOCATION_REL
 
 
@@ -448,6 +452,51 @@ class TestProtoSupport(test_env.RecipeEngineUnitTest):
     self.assertEqual(retcode, 0, output)
     self.assertProtoInOutput({"field": "norp", "fweep": "dorp"}, output)
 
+  def test_update_compiles_changed_units(self):
+    main = self.deps.main_repo
+    units_dir = os.path.join(self.deps.recipe_deps_path, '_pb3', 'units')
+
+    def _write_proto(fields):
+      with main.write_file('recipes/cool.proto') as proto:
+        proto.write('''
+          syntax = "proto3";
+          package recipes.main.cool;
+          message CoolData {
+            %s
+          }
+        ''' % (fields,))
+
+    def _units():
+      return {
+        name: os.stat(os.path.join(units_dir, name)).st_ino
+        for name in os.listdir(units_dir)
+      }
+
+    _write_proto('string field = 1;')
+    output, retcode = main.recipes_py('fetch')
+    self.assertEqual(retcode, 0, output)
+    before = _units()
+    # One unit for recipe_engine, and one for main.
+    self.assertEqual(len(before), 2)
+
+    _write_proto('string field = 1; string fweep = 2;')
+    with main.write_recipe('cool') as recipe:
+      recipe.imports = [
+        'from PB.recipes.main.cool import CoolData'
+      ]
+      recipe.RunSteps.write('''
+        data = CoolData(field="norp", fweep="dorp")
+        api.step('hello!', ['echo', _dumps(data)])
+      ''')
+    output, retcode = main.recipes_py('run', 'cool')
+    self.assertEqual(retcode, 0, output)
+    self.assertProtoInOutput({"field": "norp", "fweep": "dorp"}, output)
+
+    after = _units()
+    self.assertEqual(len(after), 2)
+    # The recipe_engine unit was reused as-is, main's was recompiled.
+    self.assertEqual(len(set(before.items()) & set(after.items())), 1)
+
   def test_conflicting_proto_error(self):
     main = self.deps.main_repo
     upstream = self.deps.add_repo('upstream')
@@ -606,5 +655,54 @@ class TestProtoSupport(test_env.RecipeEngineUnitTest):
                   output)
 
 
+class TestDigestCache(test_env.RecipeEngineUnitTest):
+  def setUp(self):
+    super(TestDigestCache, self).setUp()
+    self.root = self.tempdir()
+    self.cache_path = os.path.join(self.root, 'src_digests.json')
+    self.srcs = []
+    for name in ('a.proto', 'b.proto'):
+      self.srcs.append(os.path.join(self.root, name))
+      self.write(name, 'syntax = "proto3";')
+
+  def write(self, name, data, age=60):
+    path = os.path.join(self.root, name)
+    with open(path, 'w') as f:
+      f.write(data)
+    old = time.time() - age
+    os.utime(path, (old, old))
+
+  def blobhashes(self):
+    cache = proto_support._DigestCache.load(self.cache_path)
+    with mock.patch.object(proto_support, '_blobhash',
+                           wraps=proto_support._blobhash) as hasher:
+      ret = cache.blobhashes(self.srcs)
+    cache.save()
+    return ret, sorted(call[0][0] for call in hasher.call_args_list)
+
+  def test_warm(self):
+    hashes, hashed = self.blobhashes()
+    self.assertEqual(hashed, self.srcs)
+    # git hash-object of 'syntax = "proto3";'
+    self.assertEqual(hashes[self.srcs[0]],
+                     'd95660ed98fffd5cd824c39e2c32d62c62c518a0')
+    self.assertEqual(self.blobhashes(), (hashes, []))
+
+  def test_changed(self):
+    hashes, _ = self.blobhashes()
+    self.write('b.proto', 'syntax = "proto2";')
+    new_hashes, hashed = self.blobhashes()
+    self.assertEqual(hashed, [self.srcs[1]])
+    self.assertEqual(new_hashes[self.srcs[0]], hashes[self.srcs[0]])
+    self.assertNotEqual(new_hashes[self.srcs[1]], hashes[self.srcs[1]])
+
+  def test_racy(self):
+    # b.proto could still change within the same mtime tick, so it shouldn't
+    # be cached.
+    self.write('b.proto', 'syntax = "proto2";', age=0)
+    self.blobhashes()
+    self.assertEqual(self.blobhashes()[1], [self.srcs[1]])
+
+
 if __name__ == '__main__':
   test_env.main()
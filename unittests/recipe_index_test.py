@@ -0,0 +1,145 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import json
+import os
+import time
+
+import test_env
+
+from recipe_engine.internal.recipe_index import RecipeIndex, stat_key
+
+
+def _age(*paths):
+  """Moves the mtime of `paths` a minute into the past."""
+  old = time.time() - 60
+  for path in paths:
+    os.utime(path, (old, old))
+
+
+class TestRecipeIndex(test_env.RecipeEngineUnitTest):
+  def setUp(self):
+    super(TestRecipeIndex, self).setUp()
+    self.root = self.tempdir()
+    self.index_path = os.path.join(self.root, '.recipe_deps', '.recipe_index')
+    self.recipes_dir = os.path.join(self.root, 'recipes')
+    os.mkdir(self.recipes_dir)
+    self.scans = 0
+
+  def scan(self):
+    self.scans += 1
+    return (
+      {self.recipes_dir: stat_key(self.recipes_dir)},
+      {'recipes': sorted(os.listdir(self.recipes_dir))},
+    )
+
+  def get_repo(self, index=None):
+    index = index or RecipeIndex.load(self.index_path)
+    ret = index.get_repo(self.root, self.scan)
+    index.save()
+    return ret
+
+  def test_repo_reused(self):
+    _age(self.recipes_dir)
+    self.assertEqual(self.get_repo(), {'recipes': []})
+    self.assertEqual(self.get_repo(), {'recipes': []})
+    self.assertEqual(self.scans, 1)
+
+  def test_repo_changed(self):
+    _age(self.recipes_dir)
+    self.get_repo()
+    with open(os.path.join(self.recipes_dir, 'foo.py'), 'w'):
+      pass
+    _age(self.recipes_dir)
+    self.assertEqual(self.get_repo(), {'recipes': ['foo.py']})
+    self.assertEqual(self.scans, 2)
+
+  def test_repo_racy(self):
+    # recipes_dir was just created, so it could still change within the same
+    # mtime tick.
+    self.get_repo()
+    self.get_repo()
+    self.assertEqual(self.scans, 2)
+
+  def test_file_data(self):
+    path = os.path.join(self.root, 'foo.py')
+    with open(path, 'w') as f:
+      f.write('DEPS = []')
+    _age(path)
+    computed = []
+    def compute(value):
+      computed.append(value)
+      return value
+
+    index = RecipeIndex.load(self.index_path)
+    self.assertEqual(index.get_file_data(path, 'key', lambda: compute(1)), 1)
+    self.assertEqual(index.get_file_data(path, 'key', lambda: compute(2)), 1)
+    self.assertEqual(
+        index.get_file_data(path, 'other key', lambda: compute(3)), 3)
+    index.save()
+
+    index = RecipeIndex.load(self.index_path)
+    self.assertEqual(
+        index.get_file_data(path, 'other key', lambda: compute(4)), 3)
+    with open(path, 'w') as f:
+      f.write('DEPS = ["foo"]')
+    self.assertEqual(
+        index.get_file_data(path, 'other key', lambda: compute(5)), 5)
+    self.assertEqual(computed, [1, 3, 5])
+
+  def test_bad_index(self):
+    os.makedirs(os.path.dirname(self.index_path))
+    with open(self.index_path, 'w') as f:
+      f.write('not json')
+    _age(self.recipes_dir)
+    self.assertEqual(self.get_repo(), {'recipes': []})
+    with open(self.index_path) as f:
+      self.assertEqual(json.load(f)['repos'][self.root]['dirs'], {
+        'recipes': stat_key(self.recipes_dir),
+      })
+
+
+class TestRecipeIndexRepo(test_env.RecipeEngineUnitTest):
+  def test_new_recipe(self):
+    deps = self.FakeRecipeDeps()
+    main = deps.main_repo
+    with main.write_recipe('foo'):
+      pass
+
+    def _age_repo():
+      for base, dirs, _ in os.walk(main.path):
+        dirs[:] = [d for d in dirs if d not in ('.git', '.recipe_deps')]
+        _age(base)
+
+    _age_repo()
+    output, retcode = main.recipes_py('test', 'list')
+    self.assertEqual(retcode, 0, output)
+    self.assertEqual(output.split(), ['foo.basic'])
+    self.assertTrue(
+        os.path.isfile(os.path.join(deps.recipe_deps_path, '.recipe_index')))
+
+    with main.write_recipe('bar'):
+      pass
+    output, retcode = main.recipes_py('test', 'list')
+    self.assertEqual(retcode, 0, output)
+    self.assertEqual(sorted(output.split()), ['bar.basic', 'foo.basic'])
+
+    with main.write_module('mod') as mod:
+      mod.api.write('''
+        def hello(self):
+          pass
+      ''')
+    with main.write_recipe('mod', 'examples/full') as recipe:
+      recipe.DEPS = ['mod']
+    _age_repo()
+    output, retcode = main.recipes_py('test', 'list')
+    self.assertEqual(retcode, 0, output)
+    self.assertEqual(
+        sorted(output.split()),
+        ['bar.basic', 'foo.basic', 'mod:examples/full.basic'])
+
+
+if __name__ == '__main__':
+  test_env.main()
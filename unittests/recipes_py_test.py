@@ -0,0 +1,98 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import importlib.util
+import json
+import os
+import subprocess
+
+from unittest import mock
+
+import test_env
+
+
+def _load_recipes_py():
+  spec = importlib.util.spec_from_file_location(
+      'recipes_py', os.path.join(test_env.ROOT_DIR, 'recipes.py'))
+  mod = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(mod)
+  return mod
+
+recipes_py = _load_recipes_py()
+
+
+class TestCheckoutEngine(test_env.RecipeEngineUnitTest):
+  def setUp(self):
+    super(TestCheckoutEngine, self).setUp()
+    # A stand-in for the engine repo; checkout_engine doesn't care what's in
+    # it.
+    self.engine_url = self.tempdir()
+    self.git('init', '-q', '-b', 'main')
+    self.contents = ['one', 'two']
+    self.revisions = [self.commit(contents) for contents in self.contents]
+
+    self.repo_root = self.tempdir()
+    self.cfg_path = os.path.join(
+        self.repo_root, 'infra', 'config', 'recipes.cfg')
+    os.makedirs(os.path.dirname(self.cfg_path))
+
+  def git(self, *args):
+    return subprocess.check_output(
+        ('git',) + args, cwd=self.engine_url, text=True).strip()
+
+  def commit(self, contents):
+    with open(os.path.join(self.engine_url, 'file'), 'w') as f:
+      f.write(contents)
+    self.git('add', 'file')
+    self.git('commit', '-q', '-m', contents)
+    return self.git('rev-parse', 'HEAD')
+
+  def checkout(self, idx):
+    """Checks out the engine at the `idx`'th revision, returning the git
+    commands run."""
+    with open(self.cfg_path, 'w') as f:
+      json.dump({
+        'api_version': 2,
+        'repo_name': 'main',
+        'deps': {
+          'recipe_engine': {
+            'url': self.engine_url,
+            'branch': 'refs/heads/main',
+            'revision': self.revisions[idx],
+          },
+        },
+      }, f)
+    with mock.patch.object(recipes_py, '_git_check_call',
+                           wraps=recipes_py._git_check_call) as git_call:
+      engine_path = recipes_py.checkout_engine(
+          None, self.repo_root, self.cfg_path)
+    with open(os.path.join(engine_path, 'file')) as f:
+      self.assertEqual(f.read(), self.contents[idx])
+    return [call[0][0][0] for call in git_call.call_args_list]
+
+  def test_stamp(self):
+    self.assertEqual(
+        self.checkout(0),
+        ['init', 'rev-parse', 'fetch', 'diff', 'reset', 'clean'])
+    self.assertEqual(self.checkout(0), [])
+
+    # Rolling the engine goes through git again.
+    self.assertEqual(
+        self.checkout(1),
+        ['init', 'rev-parse', 'diff', 'reset', 'clean'])
+    self.assertEqual(self.checkout(1), [])
+
+  def test_stamp_checkout_changed(self):
+    self.checkout(0)
+    engine_path = os.path.join(self.repo_root, '.recipe_deps', 'recipe_engine')
+    subprocess.check_call(
+        ['git', 'checkout', '-q', self.revisions[1]], cwd=engine_path)
+    self.assertEqual(
+        self.checkout(0),
+        ['init', 'rev-parse', 'diff', 'reset', 'clean'])
+
+
+if __name__ == '__main__':
+  test_env.main()
@@ -6,6 +6,7 @@
 from __future__ import print_function
 from future.utils import iteritems
 
+import argparse
 import contextlib
 import json
 import os
@@ -17,10 +18,14 @@ import sys
 import tempfile
 import time
 
+from io import StringIO
+from unittest import mock
+
 from parameterized import parameterized, parameterized_class
 
 import test_env
 
+from recipe_engine.internal.commands import luciexe as luciexe_parser
 from recipe_engine.internal.engine import _shell_quote
 
 from recipe_engine.third_party import luci_context
@@ -73,6 +78,25 @@ class RunTest(test_env.RecipeEngineUnitTest):
     self.assertEqual(retcode, 1)
     self.assertIn('Repo \'a\' depends on [\'b\'], which is missing', output)
 
+  def test_run_failed_checkouts(self):
+    deps = self.FakeRecipeDeps()
+    for name in ('a', 'b', 'c'):
+      deps.add_repo(name).commit(name + ' something')
+
+    with deps.main_repo.edit_recipes_cfg_pb2() as spec:
+      spec.deps['a'].revision = 'a' * 40
+      spec.deps['b'].revision = 'b' * 40
+
+    output, retcode = deps.main_repo.recipes_py('--fetch-jobs', '2', 'fetch')
+    self.assertEqual(retcode, 1)
+    # Every failing repo is reported, and the other checkouts still happen.
+    self.assertIn("failed to check out 'a', 'b':", output)
+    self.assertIn('  a: ', output)
+    self.assertIn('  b: ', output)
+    self.assertNotIn('  c: ', output)
+    self.assertTrue(
+        os.path.isfile(os.path.join(deps.recipe_deps_path, 'c', 'recipes.py')))
+
   def test_run_circular_deps(self):
     deps = self.FakeRecipeDeps()
 
@@ -90,6 +114,38 @@ class RunTest(test_env.RecipeEngineUnitTest):
     self.assertIn(
         'Dependency \'a\' has circular dependency on \'main\'', output)
 
+  def test_run_profile_startup(self):
+    deps = self.FakeRecipeDeps()
+    with deps.main_repo.write_module('mod') as mod:
+      mod.api.write('''
+      def do_thing(self):
+        self.m.step('do the thing', ['echo', 'thing'])
+      ''')
+    with deps.main_repo.write_recipe('my_recipe') as recipe:
+      recipe.DEPS = ['mod']
+      recipe.RunSteps.write('''
+        api.mod.do_thing()
+      ''')
+
+    trace_path = os.path.join(self.tempdir(), 'trace.json')
+    output, retcode = deps.main_repo.recipes_py(
+        '--profile-startup', trace_path, 'run', 'my_recipe')
+    self.assertEqual(retcode, 0, output)
+    self.assertIn('Startup profile (ms):', output)
+    # The summary is printed before the first step of the recipe runs.
+    self.assertLess(output.index('Startup profile (ms):'),
+                    output.index('do the thing'))
+
+    with open(trace_path) as f:
+      events = json.load(f)['traceEvents']
+    names = set(ev['name'] for ev in events)
+    for name in ('recipes.py', 'checkout_engine', 'engine imports',
+                 'RecipeDeps.create', 'protos', 'load recipe',
+                 'instantiate module APIs', 'setup_build',
+                 'RECIPE_MODULES.main.mod'):
+      self.assertIn(name, names)
+    self.assertTrue(all(ev['ph'] == 'X' and ev['ts'] >= 0 for ev in events))
+
 
 class RunSmokeTest(test_env.RecipeEngineUnitTest):
   def _run_cmd(self, recipe, workdir, properties=None, engine_args=()):
@@ -439,5 +495,31 @@ class LuciexeSmokeTest(test_env.RecipeEngineUnitTest):
     self.assertEqual(final_build['status'], 'SUCCESS')
 
 
+class LuciexeArgsTest(test_env.RecipeEngineUnitTest):
+  def _parse(self, *argv):
+    parser = argparse.ArgumentParser()
+    subp = parser.add_subparsers()
+    luciexe_parser.add_arguments(subp.add_parser('luciexe'))
+    args = parser.parse_args(('luciexe',) + argv)
+    args.postprocess_func(parser.error, args)
+    return args
+
+  @mock.patch('argparse._sys.stderr', new_callable=StringIO)
+  def test_send_intervals(self, stderr):
+    args = self._parse('--build-proto-min-send-interval', '5')
+    self.assertEqual(args.build_proto_min_send_interval, 5)
+
+    for argv in (('--build-proto-min-send-interval', '20'),
+                 ('--build-proto-min-send-interval', '-1'),
+                 ('--build-proto-min-send-interval', '2',
+                  '--build-proto-max-send-interval', '1')):
+      stderr.seek(0)
+      stderr.truncate()
+      with self.assertRaises(SystemExit):
+        self._parse(*argv)
+      self.assertIn('expected 0 <= --build-proto-min-send-interval',
+                    stderr.getvalue())
+
+
 if __name__ == '__main__':
   test_env.main()
@@ -3,6 +3,9 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import json
+import os
+
 import test_env
 
 
@@ -166,6 +169,68 @@ class TestSimulation(test_env.RecipeEngineUnitTest):
     _, retcode = deps.main_repo.recipes_py('test', 'train')
     self.assertEqual(retcode, 0)
 
+  def _lazy_init_steps(self, lazy):
+    deps = self.FakeRecipeDeps()
+    main = deps.main_repo
+    with main.edit_recipes_cfg_pb2() as spec:
+      spec.lazy_module_init = lazy
+    for name, eager in (('unused', False), ('used', False), ('early', True)):
+      with main.write_module(name) as mod:
+        mod.DISABLE_STRICT_COVERAGE = True
+        mod.EAGER_INIT = eager
+        mod.api.write('''
+          def initialize(self):
+            self.m.step('%s init', None)
+
+          def hello(self):
+            self.m.step('%s hello', None)
+        ''' % (name, name))
+    with main.write_recipe('foo') as recipe:
+      recipe.DEPS = ['recipe_engine/step', 'unused', 'used', 'early']
+      recipe.RunSteps.write('''
+        api.step('first', None)
+        api.used.hello()
+      ''')
+
+    output, retcode = main.recipes_py('test', 'train', '--filter', 'foo')
+    self.assertEqual(retcode, 0, 'failed train with output:\n' + output)
+    with open(os.path.join(main.path, 'recipes', 'foo.expected',
+                           'basic.json')) as f:
+      return [step['name'] for step in json.load(f)]
+
+  def test_eager_module_init(self):
+    self.assertEqual(self._lazy_init_steps(False), [
+      'unused init', 'used init', 'early init', 'first', 'used hello',
+      '$result',
+    ])
+
+  def test_lazy_module_init(self):
+    self.assertEqual(self._lazy_init_steps(True), [
+      'early init', 'first', 'used init', 'used hello', '$result',
+    ])
+
+  def test_lazy_module_resource_abs_to_path(self):
+    deps = self.FakeRecipeDeps()
+    main = deps.main_repo
+    with main.edit_recipes_cfg_pb2() as spec:
+      spec.lazy_module_init = True
+    with main.write_module('lazy') as mod:
+      mod.DISABLE_STRICT_COVERAGE = True
+    with main.write_recipe('foo') as recipe:
+      recipe.DEPS = ['recipe_engine/path', 'recipe_engine/step', 'lazy']
+      recipe.RunSteps.write('''
+        resource = api.lazy.resource('script.py')
+        api.step('abs', ['echo', api.path.abs_to_path(str(resource))])
+      ''')
+
+    output, retcode = main.recipes_py('test', 'train', '--filter', 'foo')
+    self.assertEqual(retcode, 0, 'failed train with output:\n' + output)
+    with open(os.path.join(main.path, 'recipes', 'foo.expected',
+                           'basic.json')) as f:
+      self.assertEqual(json.load(f)[0]['cmd'], [
+        'echo', 'RECIPE_MODULE[main::lazy]/resources/script.py',
+      ])
+
 
 if __name__ == '__main__':
   test_env.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import ast
+import textwrap
+
+import test_env
+
+from recipe_engine.internal.static_symbols import (
+    NOT_LITERAL, extract_jsonish_assignments, literal_symbol)
+
+
+def _deps(code):
+  return literal_symbol(ast.parse(textwrap.dedent(code)), 'DEPS', ())
+
+
+class TestLiteralSymbol(test_env.RecipeEngineUnitTest):
+  def test_literal(self):
+    self.assertEqual(_deps('''
+      DEPS = ['step', 'recipe_engine/path']
+
+      def RunSteps(api):
+        api.step('hi', ['echo', 'hi'])
+    '''), ['step', 'recipe_engine/path'])
+    self.assertEqual(_deps('''
+      DEPS = {'local': 'repo/module'}
+    '''), {'local': 'repo/module'})
+
+  def test_missing(self):
+    self.assertEqual(_deps('''
+      def RunSteps(api):
+        pass
+    '''), ())
+
+  def test_not_literal(self):
+    for code in [
+        'DEPS = ["step"] + OTHER',
+        'DEPS = ["step"]\nDEPS.append("path")',
+        'DEPS = ["step"]\nDEPS = ["path"]',
+        'if True:\n  DEPS = ["step"]',
+        'from .common import DEPS',
+        'from .common import *',
+        'def f():\n  global DEPS\n  DEPS = []\nDEPS = ["step"]',
+    ]:
+      self.assertIs(_deps(code), NOT_LITERAL, code)
+
+
+class TestExtractJsonishAssignments(test_env.RecipeEngineUnitTest):
+  def test_extract(self):
+    self.assertEqual(extract_jsonish_assignments(ast.parse(textwrap.dedent('''
+      Foo = "hello"
+      Bar = [1, 2, "something"]
+      Other, Things = range(2)
+      Bogus = object()
+    '''))), {'Foo': 'hello', 'Bar': [1, 2, 'something']})
+
+
+if __name__ == '__main__':
+  test_env.main()
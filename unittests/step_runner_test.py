@@ -4,10 +4,19 @@
 # that can be found in the LICENSE file.
 
 import os
+import signal
+import sys
+import unittest
+
+from unittest import mock
+
+from gevent import subprocess
 
 import test_env
 
 from recipe_engine.internal.engine_env import merge_envs
+from recipe_engine.internal.step_runner import Step, subproc
+from recipe_engine.internal.stream import StreamEngine
 
 
 class TestMergeEnvs(test_env.RecipeEngineUnitTest):
@@ -83,5 +92,142 @@ class TestMergeEnvs(test_env.RecipeEngineUnitTest):
         {})
 
 
+
+class _LineStream(StreamEngine.Stream):
+  def __init__(self):
+    self.lines = []
+
+  def write_line(self, line):
+    self.lines.append(line)
+
+
+class TestCopyLines(test_env.RecipeEngineUnitTest):
+  OUTPUT = (
+      b'hello\n@@@annotation@@@\nwindows\r\nold mac\rnext\n\n'
+      + u'\u2603 snowman\n'.encode('utf-8') * 3
+      + b'x' * 1000 + b'\nno trailing newline')
+
+  def copy(self, copy_fn, output=OUTPUT):
+    proc = subprocess.Popen(
+        [sys.executable, '-c',
+         'import sys; sys.stdout.buffer.write(%r)' % (output,)],
+        stdout=subprocess.PIPE, universal_newlines=True, encoding='utf-8')
+    stream = _LineStream()
+    copy_fn(proc.stdout, stream)
+    proc.stdout.close()
+    proc.wait()
+    return stream.lines
+
+  def test_copy_lines(self):
+    expected = self.copy(subproc._copy_lines_slow)
+    self.assertEqual(expected[:6], [
+      'hello', '@@@annotation@@@', 'windows', 'old mac', 'next', ''])
+    self.assertEqual(expected[-1], 'no trailing newline')
+    # Small chunk sizes split lines (and multi-byte characters) across reads.
+    for chunk_size in (1, 2, 7, 64 * 1024):
+      with mock.patch.object(subproc, '_COPY_CHUNK_SIZE', chunk_size):
+        self.assertEqual(self.copy(subproc._copy_lines), expected, chunk_size)
+
+  def test_copy_lines_trailing_cr(self):
+    for output, expected in ((b'x\r', ['x']), (b'x\ry\r', ['x', 'y'])):
+      self.assertEqual(
+          self.copy(subproc._copy_lines_slow, output), expected, output)
+      for chunk_size in (1, 2, 64 * 1024):
+        with mock.patch.object(subproc, '_COPY_CHUNK_SIZE', chunk_size):
+          self.assertEqual(
+              self.copy(subproc._copy_lines, output), expected,
+              (output, chunk_size))
+
+
+class TestSubprocessStepRunner(test_env.RecipeEngineUnitTest):
+  SCRIPT = '\n'.join([
+    'import os, sys',
+    'print(os.environ.get("FOO"))',
+    'print(os.getcwd())',
+    'print(os.getpgid(0) == os.getpid())',
+    'print(sys.stdin.read())',
+    'sys.stderr.write("oh no\\n")',
+    'sys.exit(3)',
+  ])
+
+  def run_step(self, use_posix_spawn, cwd):
+    tdir = self.tempdir()
+    stdin_path = os.path.join(tdir, 'stdin')
+    with open(stdin_path, 'w') as f:
+      f.write('input')
+    stderr_path = os.path.join(tdir, 'stderr')
+    step = Step(
+        cmd=[sys.executable, '-c', self.SCRIPT],
+        cwd=cwd,
+        stdin=stdin_path,
+        stdout=_LineStream(),
+        stderr=stderr_path,
+        env={'FOO': 'bar', 'PATH': os.environ['PATH']},
+        luci_context={})
+    runner = subproc.SubprocessStepRunner(use_posix_spawn=use_posix_spawn)
+    result = runner.run(('step',), _LineStream(), step)
+    self.assertEqual(result.retcode, 3)
+    self.assertFalse(result.was_cancelled)
+    with open(stderr_path) as f:
+      self.assertEqual(f.read(), 'oh no\n')
+    return step.stdout.lines
+
+  def test_run(self):
+    for cwd in (os.getcwd(), os.path.realpath(self.tempdir())):
+      self.assertEqual(
+          self.run_step(False, cwd), ['bar', cwd, 'True', 'input'])
+
+  @unittest.skipUnless(subproc.HAVE_POSIX_SPAWN, 'needs posix_spawn')
+  def test_run_posix_spawn(self):
+    path = os.environ['PATH']
+    for cwd in (os.getcwd(), os.path.realpath(self.tempdir())):
+      with mock.patch.object(subprocess, 'Popen') as popen:
+        self.assertEqual(
+            self.run_step(True, cwd), ['bar', cwd, 'True', 'input'])
+      popen.assert_not_called()
+      self.assertEqual(os.environ['PATH'], path)
+
+  def run_cmd(self, use_posix_spawn, cmd, cwd):
+    step = Step(
+        cmd=cmd, cwd=cwd, stdin=None, stdout=_LineStream(),
+        stderr=_LineStream(), env={'PATH': os.environ['PATH']},
+        luci_context={})
+    runner = subproc.SubprocessStepRunner(use_posix_spawn=use_posix_spawn)
+    result = runner.run(('step',), _LineStream(), step)
+    self.assertEqual(result.retcode, 0)
+    return step.stdout.lines
+
+  @unittest.skipUnless(
+      subproc.HAVE_POSIX_SPAWN and os.path.exists('/proc/self/status'),
+      'needs posix_spawn and /proc')
+  def test_run_posix_spawn_signals(self):
+    # Python ignores SIGPIPE and SIGXFSZ; steps shouldn't. (glibc's
+    # posix_spawn also ignores its own internal signals in the child, which
+    # nothing else can use, so only compare the ones we care about.)
+    cmd = ['/bin/sh', '-c', 'grep SigIgn /proc/self/status']
+    mask = 0
+    for sig in (signal.SIGPIPE, signal.SIGXFSZ):
+      mask |= 1 << (sig - 1)
+    def ignored(use_posix_spawn, cwd):
+      line, = self.run_cmd(use_posix_spawn, cmd, cwd)
+      return int(line.split()[1], 16) & mask
+    for cwd in (os.getcwd(), os.path.realpath(self.tempdir())):
+      self.assertEqual(ignored(True, cwd), 0)
+      self.assertEqual(ignored(False, cwd), 0)
+
+  @unittest.skipUnless(subproc.HAVE_POSIX_SPAWN, 'needs posix_spawn')
+  def test_run_posix_spawn_bad_cwd(self):
+    tdir = self.tempdir()
+    a_file = os.path.join(tdir, 'file')
+    with open(a_file, 'w'):
+      pass
+    for cwd, exc_type in ((os.path.join(tdir, 'missing'), FileNotFoundError),
+                          (a_file, NotADirectoryError)):
+      for use_posix_spawn in (False, True):
+        with self.assertRaises(exc_type) as caught:
+          self.run_cmd(use_posix_spawn, ['/bin/true'], cwd)
+        self.assertEqual(caught.exception.filename, cwd)
+
+
 if __name__ == '__main__':
   test_env.main()
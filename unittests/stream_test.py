@@ -3,13 +3,26 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
-from io import StringIO
+import zlib
+
+from io import BytesIO, StringIO
+from unittest import mock
+
+import attr
+import gevent
 
 import test_env
 
+from PB.go.chromium.org.luci.buildbucket.proto import common as common_pb2
+from PB.go.chromium.org.luci.buildbucket.proto.build import Build
+from PB.go.chromium.org.luci.buildbucket.proto.step import Step
+from PB.recipe_engine import result as result_pb2
+
 from recipe_engine.internal.stream.annotator import AnnotatorStreamEngine
 from recipe_engine.internal.stream.invariants import StreamEngineInvariants
+from recipe_engine.internal.stream.luci import LUCIStreamEngine
 from recipe_engine.internal.stream.simulator import SimulationStreamEngine
+from recipe_engine.third_party import logdog
 
 
 class StreamTest(test_env.RecipeEngineUnitTest):
@@ -119,6 +132,20 @@ bar tries to kiss foo, but foo already left
       with self.assertRaises(AssertionError):
         foo.close()
 
+  def test_write_chunk(self):
+    chunk = '@@@a@@@\nb @@@\n\n@@@c@@@\n'
+    for allow_subannotations in (False, True):
+      by_line, by_chunk = StringIO(), StringIO()
+      for out, write in ((by_line, lambda s: s.write_split(chunk[:-1])),
+                         (by_chunk, lambda s: s.write_chunk(chunk))):
+        with StreamEngineInvariants.wrap(AnnotatorStreamEngine(out)) as engine:
+          step = engine.new_step_stream(('step',), allow_subannotations)
+          write(step)
+          step.close()
+      self.assertEqual(by_chunk.getvalue(), by_line.getvalue())
+      self.assertEqual(
+          '!@@@a@@@' in by_chunk.getvalue(), not allow_subannotations)
+
   def test_no_write_multiple_lines(self):
     with StreamEngineInvariants() as engine:
       foo = engine.new_step_stream(('foo',), False)
@@ -145,5 +172,205 @@ bar tries to kiss foo, but foo already left
       with self.assertRaises(AssertionError):
         foo.set_step_tag("", "")
 
+
+class _FakeStreamClient(logdog.stream.StreamClient):
+  """A butler StreamClient which keeps everything written to its streams."""
+  def __init__(self):
+    super(_FakeStreamClient, self).__init__()
+    self.streams = []
+
+  def _connect_raw(self):
+    ret = _FakeConnection()
+    self.streams.append(ret)
+    return ret
+
+
+class _FakeConnection(BytesIO):
+  def close(self):
+    pass
+
+
+@attr.s
+class _FakeBuildStream(object):
+  sent = attr.ib(factory=list)
+
+  def send(self, data):
+    self.sent.append(Build.FromString(zlib.decompress(data)))
+
+  def close(self):
+    pass
+
+
+class LUCIStreamTest(test_env.RecipeEngineUnitTest):
+  def setUp(self):
+    super(LUCIStreamTest, self).setUp()
+    self.build_stream = _FakeBuildStream()
+    self.engine = LUCIStreamEngine(
+        False, bsc=_FakeStreamClient(), build_stream=self.build_stream)
+    self.addCleanup(self.engine.close)
+
+  def assertSerializes(self):
+    build = self.engine.current_build_proto
+    self.assertEqual(
+        self.engine._serialize_build(), build.SerializeToString())
+
+  def test_serialize_build(self):
+    steps = [
+      self.engine.new_step_stream(('step %d' % i,), False) for i in range(3)
+    ]
+    self.assertSerializes()
+
+    steps[1].mark_running()
+    steps[1].set_build_property('prop', '{"some": ["value"]}')
+    self.assertSerializes()
+
+    steps[2].add_step_text('hi')
+    steps[2].set_step_tag('key', 'value')
+    steps[2].set_step_status('EXCEPTION', False)
+    self.assertSerializes()
+    steps[2].close()
+    self.engine.write_result(result_pb2.RawResult(
+        status=common_pb2.FAILURE, summary_markdown='oh no'))
+    self.assertSerializes()
+
+    steps.append(self.engine.new_step_stream(('step 3',), False))
+    self.assertSerializes()
+
+  def test_serialize_build_reuses_steps(self):
+    steps = [
+      self.engine.new_step_stream(('step %d' % i,), False) for i in range(3)
+    ]
+    self.engine._serialize_build()
+    with mock.patch.object(Step, 'SerializeToString',
+                           autospec=True,
+                           side_effect=Step.SerializeToString) as serialize:
+      steps[1].set_summary_markdown('changed')
+      self.engine._serialize_build()
+      # Only the changed step is serialized again.
+      self.assertEqual(serialize.call_count, 1)
+    self.assertSerializes()
+
+  def test_final_send(self):
+    step = self.engine.new_step_stream(('step',), False)
+    step.mark_running()
+    step.close()
+    self.engine.close()
+    self.assertEqual(self.build_stream.sent[-1],
+                     self.engine.current_build_proto)
+
+  def test_spill_property(self):
+    engine = LUCIStreamEngine(
+        False, bsc=_FakeStreamClient(), build_stream=_FakeBuildStream(),
+        max_property_bytes=20)
+    self.addCleanup(engine.close)
+    step = engine.new_step_stream(('parent', 'step'), False)
+    step.set_build_property('small', '"hello"')
+    step.set_build_property('big', '"%s"' % ('x' * 20))
+    props = engine.current_build_proto.output.properties
+    self.assertEqual(props['small'], 'hello')
+    self.assertEqual(dict(props['big']['$spilled_to_log']), {
+      'step': 'parent|step',
+      'log': 'output property big',
+      'bytes': 22,
+    })
+    log = engine.current_build_proto.steps[0].logs[0]
+    self.assertEqual(log.name, 'output property big')
+    # The stream starts with the butler's stream header.
+    self.assertTrue(engine._bsc.streams[-1].getvalue().endswith(
+        ('"%s"\n' % ('x' * 20)).encode()))
+    self.assertEqual(engine.metrics.spilled_values, 1)
+
+  def test_no_spill_by_default(self):
+    engine = LUCIStreamEngine(
+        False, bsc=_FakeStreamClient(), build_stream=_FakeBuildStream())
+    self.addCleanup(engine.close)
+    step = engine.new_step_stream(('step',), False)
+    big = 'x' * (1024 * 1024)
+    step.set_build_property('big', '"%s"' % (big,))
+    step.add_step_text(big)
+    step.close()
+    self.assertEqual(engine.current_build_proto.output.properties['big'], big)
+    step_pb = engine.current_build_proto.steps[0]
+    self.assertEqual(step_pb.summary_markdown, big)
+    self.assertEqual(list(step_pb.logs), [])
+    self.assertEqual(engine.metrics.spilled_values, 0)
+
+  def test_spill_summary(self):
+    engine = LUCIStreamEngine(
+        False, bsc=_FakeStreamClient(), build_stream=_FakeBuildStream(),
+        max_summary_bytes=10)
+    self.addCleanup(engine.close)
+    step = engine.new_step_stream(('step',), False)
+    step.set_summary_markdown('short')
+    self.assertEqual(engine.current_build_proto.steps[0].summary_markdown,
+                     'short')
+    self.assertEqual(engine.metrics.spilled_values, 0)
+
+    step.add_step_text('a long step text')
+    step.close()
+    step_pb = engine.current_build_proto.steps[0]
+    self.assertEqual(step_pb.summary_markdown,
+                     "The summary (16 bytes) was too big; see the 'summary' "
+                     "log.")
+    self.assertEqual([log.name for log in step_pb.logs], ['summary'])
+    self.assertEqual(engine.metrics.spilled_values, 1)
+
+
+class LUCIStreamSendTest(test_env.RecipeEngineUnitTest):
+  def mk_engine(self, **kwargs):
+    build_stream = _FakeBuildStream()
+    engine = LUCIStreamEngine(
+        False, bsc=_FakeStreamClient(), build_stream=build_stream, **kwargs)
+    self.addCleanup(engine.close)
+    return engine, build_stream
+
+  def test_send_interval(self):
+    engine, _ = self.mk_engine(min_send_interval=1, max_send_interval=10)
+    self.assertEqual(engine._send_interval(), 1)
+    engine.metrics.last_serialize_seconds = 0.2
+    self.assertEqual(engine._send_interval(), 4)
+    engine.metrics.last_bytes = 2 * 1024 * 1024
+    self.assertEqual(engine._send_interval(), 8)
+    engine.metrics.last_serialize_seconds = 1
+    self.assertEqual(engine._send_interval(), 10)
+
+  def test_bad_send_interval(self):
+    with self.assertRaises(ValueError):
+      LUCIStreamEngine(False, bsc=_FakeStreamClient(),
+                       build_stream=_FakeBuildStream(),
+                       min_send_interval=2, max_send_interval=1)
+
+  def test_coalesce(self):
+    engine, build_stream = self.mk_engine(min_send_interval=0.1)
+    step = engine.new_step_stream(('step',), False)
+    step.set_summary_markdown('hi')
+    step.set_build_property('prop', '1')
+    gevent.sleep(0.5)
+    self.assertEqual(len(build_stream.sent), 1)
+    self.assertEqual(engine.metrics.sends, 1)
+    self.assertEqual(engine.metrics.coalesced_updates, 2)
+    self.assertEqual(engine.metrics.bytes_sent, engine.metrics.last_bytes)
+    self.assertGreater(engine.metrics.bytes_sent, 0)
+
+  def test_flush(self):
+    engine, build_stream = self.mk_engine(
+        min_send_interval=0.05, max_send_interval=30)
+    step = engine.new_step_stream(('step',), False)
+    gevent.sleep(0.3)
+    self.assertEqual(len(build_stream.sent), 1)
+
+    # Pretend the build is huge, so regular updates wait for the max interval.
+    engine.metrics.last_bytes = 100 * 1024 * 1024
+    step.set_summary_markdown('hi')
+    gevent.sleep(0.3)
+    self.assertEqual(len(build_stream.sent), 1)
+
+    # Status changes don't wait.
+    step.mark_running()
+    gevent.sleep(0.3)
+    self.assertEqual(len(build_stream.sent), 2)
+    self.assertEqual(build_stream.sent[-1].steps[0].status, common_pb2.STARTED)
+
+
 if __name__ == '__main__':
   test_env.main()
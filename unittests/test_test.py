@@ -8,6 +8,7 @@ from future.utils import iteritems, itervalues
 import argparse
 import json
 import os
+import tempfile
 
 from io import StringIO
 from unittest import mock
@@ -1097,6 +1098,253 @@ class TestTrain(Common):
         ))
 
 
+class TestDaemon(Common):
+  def _run_daemon_test(self, *args, **kwargs):
+    return self._run_test(
+        *(args + ('--daemon', '--daemon-idle-timeout', '30')), **kwargs)
+
+  def _write_module(self, step_name):
+    with self.main.write_module('foo_module') as mod:
+      mod.api.write('''
+        def bar(self):
+          self.m.step(%r, ['echo', 'one'])
+      ''' % (step_name,))
+    with self.main.write_recipe('foo_module', 'examples/full') as recipe:
+      recipe.DEPS = ['foo_module']
+      recipe.RunSteps.write('api.foo_module.bar()')
+      recipe.expectation['basic'] = [
+        {'cmd': ['echo', 'one'], 'name': 'one'},
+        {'name': '$result'},
+      ]
+
+  def test_reloads_changed_module(self):
+    self._write_module('one')
+
+    self.assertDictEqual(
+        self._run_daemon_test('run').data,
+        self._outcome_json(per_test={'foo_module:examples/full.basic': []}))
+    # Runs on the now-warm runners.
+    self.assertDictEqual(
+        self._run_daemon_test(
+            'run', '--filter', 'foo_module:examples/full.basic').data,
+        self._outcome_json(
+            per_test={'foo_module:examples/full.basic': []}, coverage=0))
+
+    self._write_module('two')
+    self.assertDictEqual(
+        self._run_daemon_test('run', should_fail=True).data,
+        self._outcome_json(per_test={
+          'foo_module:examples/full.basic': [self.OutcomeType.diff],
+        }))
+
+  def test_edited_check(self):
+    def _write_recipe(step_name):
+      with self.main.write_recipe('foo') as recipe:
+        recipe.GenTests.write('''
+          yield (api.test('basic')
+            + api.post_check(lambda check, steps: check(%r in steps))
+          )
+        ''' % (step_name,))
+      result = self._run_daemon_test('run', '--jobs', '1', should_fail=True)
+      self.assertDictEqual(
+          result.data,
+          self._outcome_json(per_test={
+            'foo.basic': [self.OutcomeType.check],
+          }))
+      return result.text_output
+
+    self.assertIn("check(('bar' in steps))", _write_recipe('bar'))
+    # The check is on the same line, but the warm runner must render it from
+    # the edited file.
+    output = _write_recipe('baz')
+    self.assertIn("check(('baz' in steps))", output)
+    self.assertNotIn("'bar'", output)
+
+  def test_private_pool_dir(self):
+    from recipe_engine.internal.commands.test import daemon
+    path = os.path.join(self.tempdir(), 'pool')
+    daemon._ensure_private_dir(path)
+    self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+    daemon._ensure_private_dir(path)
+
+    # Somebody else could have planted things in these.
+    os.chmod(path, 0o777)
+    with self.assertRaises(ValueError):
+      daemon._ensure_private_dir(path)
+    os.rmdir(path)
+    os.symlink(self.tempdir(), path)
+    with self.assertRaises(ValueError):
+      daemon._ensure_private_dir(path)
+
+
+class TestForkServer(Common):
+  def test_basic(self):
+    with self.main.write_module('foo_module') as mod:
+      mod.api.write('''
+        def bar(self):
+          self.m.step('one', ['echo', 'one'])
+      ''')
+    with self.main.write_recipe('foo_module', 'examples/full') as recipe:
+      recipe.DEPS = ['foo_module']
+      recipe.RunSteps.write('api.foo_module.bar()')
+      recipe.expectation['basic'] = [
+        {'cmd': ['echo', 'one'], 'name': 'one'},
+        {'name': '$result'},
+      ]
+
+    def _sock_dirs():
+      return {d for d in os.listdir(tempfile.gettempdir())
+              if d.startswith('recipes-fork-server-')}
+    sock_dirs = _sock_dirs()
+
+    # Module imports happen in the fork server, but still count as coverage.
+    self.assertDictEqual(
+        self._run_test('run', '--fork-server', '--jobs', '2').data,
+        self._outcome_json(per_test={'foo_module:examples/full.basic': []}))
+    # The private socket directory is removed again.
+    self.assertEqual(_sock_dirs(), sock_dirs)
+
+  def test_not_with_daemon(self):
+    output, retcode = self.main.recipes_py(
+        'test', 'run', '--fork-server', '--daemon')
+    self.assertEqual(retcode, 2)
+    self.assertIn('mutually exclusive', output)
+
+
+class TestResultCache(Common):
+  def _run_cached(self, *args, **kwargs):
+    return self._run_test('run', '--filter', 'foo.basic', *args, **kwargs)
+
+  def test_reuses_passing_result(self):
+    with self.main.write_recipe('foo'):
+      pass
+
+    result = self._run_cached()
+    self.assertDictEqual(result.data, self._outcome_json(coverage=0))
+    self.assertIn('Test result cache: 0 hits, 1 misses', result.text_output)
+
+    result = self._run_cached()
+    self.assertDictEqual(result.data, self._outcome_json(coverage=0))
+    self.assertIn('Test result cache: 1 hits, 0 misses', result.text_output)
+
+    result = self._run_cached('--no-cache')
+    self.assertDictEqual(result.data, self._outcome_json(coverage=0))
+    self.assertNotIn('Test result cache', result.text_output)
+
+  def test_expectation_change(self):
+    with self.main.write_recipe('foo') as recipe:
+      expect_path = os.path.join(recipe.expect_path, 'basic.json')
+    self._run_cached()
+
+    with self.main.write_file(expect_path) as fil:
+      fil.write('[]')
+    result = self._run_cached(should_fail=True)
+    self.assertDictEqual(result.data, self._outcome_json(
+        per_test={'foo.basic': [self.OutcomeType.diff]}, coverage=0))
+    self.assertIn('Test result cache: 0 hits, 1 misses', result.text_output)
+
+  def test_module_change(self):
+    def _write_module(step_name):
+      with self.main.write_module('foo_module') as mod:
+        mod.api.write('''
+          def bar(self):
+            self.m.step(%r, ['echo', 'one'])
+        ''' % (step_name,))
+      # Only a module's own recipes count as test coverage for it.
+      with self.main.write_recipe('foo_module', 'examples/full'):
+        pass
+    _write_module('one')
+    with self.main.write_recipe('foo') as recipe:
+      recipe.DEPS = ['foo_module']
+      recipe.RunSteps.write('api.foo_module.bar()')
+      recipe.expectation['basic'] = [
+        {'cmd': ['echo', 'one'], 'name': 'one'},
+        {'name': '$result'},
+      ]
+    self._run_cached()
+
+    _write_module('two')
+    result = self._run_cached(should_fail=True)
+    self.assertDictEqual(result.data, self._outcome_json(
+        per_test={'foo.basic': [self.OutcomeType.diff]}, coverage=0))
+
+  def test_cached_coverage(self):
+    with self.main.write_recipe('foo'):
+      pass
+
+    result = self._run_test('run')
+    self.assertIn('Test result cache: 0 hits, 1 misses', result.text_output)
+
+    # Without filters, results are only reused along with their coverage.
+    result = self._run_test('run')
+    self.assertDictEqual(result.data, self._outcome_json())
+    self.assertIn('Test result cache: 1 hits, 0 misses', result.text_output)
+
+  def test_incremental_coverage(self):
+    with self.main.write_recipe('foo'):
+      pass
+    with self.main.write_recipe('bar'):
+      pass
+    self._run_test('run')
+
+    with self.main.write_recipe('bar') as recipe:
+      recipe.RunSteps.write('''
+        bool_var = False
+        if bool_var:
+          a = 1
+      ''')
+    result = self._run_test(
+        'run', '--filter', 'bar.*', '--incremental-coverage', should_fail=True)
+    self.assertDictEqual(result.data, self._outcome_json(
+        per_test={'bar.basic': []}, coverage=93.8))
+
+    # foo's cached coverage is outdated.
+    with self.main.write_recipe('foo') as recipe:
+      recipe.RunSteps.write('foo_var = 1')
+    with self.main.write_recipe('bar'):
+      pass
+    result = self._run_test(
+        'run', '--filter', 'bar.*', '--incremental-coverage', should_fail=True)
+    self.assertIn(
+        'No up-to-date coverage is cached for 1 tests excluded by --filter',
+        result.text_output)
+    self.assertIn('foo.basic', result.text_output)
+    self.assertDictEqual(result.data, self._outcome_json(
+        per_test={'bar.basic': []}, coverage=0))
+
+    self._run_test('run', '--filter', 'foo.*', '--incremental-coverage')
+    result = self._run_test(
+        'run', '--filter', 'bar.*', '--incremental-coverage')
+    self.assertDictEqual(
+        result.data, self._outcome_json(per_test={'bar.basic': []}))
+
+
+class TestDurations(Common):
+  def test_records_durations(self):
+    with self.main.write_recipe('foo') as recipe:
+      recipe.GenTests.write('''
+        yield api.test('basic')
+        yield api.test('second')
+      ''')
+      recipe.expectation['second'] = [{'name': '$result'}]
+    durations_path = os.path.join(
+        self.deps.recipe_deps_path, '.test_durations')
+
+    result = self._run_test('run')
+    self.assertIn('Critical path: ', result.text_output)
+    self.assertNotIn('predicted', result.text_output)
+    with open(durations_path) as durations_file:
+      self.assertEqual(
+          sorted(json.load(durations_file)), ['foo.basic', 'foo.second'])
+
+    # Filtered runs keep the durations of the other tests.
+    result = self._run_test('run', '--filter', 'foo.basic', '--no-cache')
+    self.assertIn('predicted', result.text_output)
+    with open(durations_path) as durations_file:
+      self.assertEqual(
+          sorted(json.load(durations_file)), ['foo.basic', 'foo.second'])
+
+
 class TestArgs(test_env.RecipeEngineUnitTest):
   @mock.patch('argparse._sys.stderr', new_callable=StringIO)
   def test_normalize_filter(self, stderr):
@@ -633,6 +633,27 @@ class WarningIntegrationTests(test_env.RecipeEngineUnitTest):
     output, _  = self.deps.main_repo.recipes_py('test', 'train')
     self.assertIn('Found 1 call sites and 0 import sites', output)
 
+  def test_too_large_warnings(self):
+    with self.deps.main_repo.write_file('recipes/big.py') as recipe:
+      recipe.write('''
+        DEPS = ['recipe_engine/step']
+        def RunSteps(api):
+          step = api.step.empty('big')
+          step.presentation.properties['big'] = 'x' * 100000
+          step.presentation.step_text = 'y' * 20000
+          api.step.empty('next')
+        def GenTests(api):
+          yield api.test('basic')
+      '''.lstrip('\n'))
+    output, retcode = self.deps.main_repo.recipes_py('test', 'train')
+    self.assertEqual(retcode, 0)
+    for name in ('BUILD_PROPERTY_TOO_LARGE', 'STEP_SUMMARY_TOO_LARGE'):
+      self.assertRegex(output, textwrap.dedent(r'''
+      \s*WARNING: recipe_engine/%s\s*
+      \s*Found 1 call sites and 0 import sites\s*
+      '''.strip('\n') % name))
+    self.assertIn('/recipes/big.py:6', output)
+
   def test_escape_warnings(self):
     with self.deps.main_repo.write_module('my_mod') as mod:
       mod.DEPS.append('recipe_engine/warning')